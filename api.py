@@ -0,0 +1,189 @@
+"""Обработчики /api/* без привязки к веб-фреймворку.
+
+Каждый обработчик получает базу и параметры запроса (JSON для POST,
+параметры строки для GET) и возвращает пару (ответ, код статуса).
+Flask (app.py) и aiohttp (server.py) только переводят запросы в этот вид.
+"""
+from typing import Dict, Any
+from database import LEADERBOARD_WINDOWS
+from config import BATCH_MAX_ACTIONS, LEADERBOARD_PAGE_MAX, MAX_EQUIPPED_PETS, BOX_MAX_BATCH
+from pets import PETS
+
+
+def _int_arg(data: Dict[str, Any], name: str, default: int) -> int:
+    """Целый параметр строки запроса; при ошибке - значение по умолчанию"""
+    try:
+        return int(data.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+def get_stats(db, data):
+    """Получение статистики игрока"""
+    user_id = data.get('user_id')
+    if not user_id:
+        return {'error': 'No user_id provided'}, 400
+
+    stats = db.get_user_stats(user_id)
+    stats['max_pets'] = MAX_EQUIPPED_PETS
+    return stats, 200
+
+
+def click(db, data):
+    """Обработка пачки кликов: count кликов с номером пачки seq вкладки session"""
+    user_id = data.get('user_id')
+    if not user_id:
+        return {'error': 'No user_id provided'}, 400
+    count = data.get('count', 1)
+    seq = data.get('seq')
+    session = data.get('session')
+    if not isinstance(count, int) or count < 1 or (seq is not None and not isinstance(seq, int)):
+        return {'error': 'Invalid count or seq'}, 400
+    if session is not None and (not isinstance(session, str) or len(session) > 64):
+        return {'error': 'Invalid session'}, 400
+    user, accepted = db.click_batch(user_id, count, seq, session)
+    return {**user, 'accepted': accepted}, 200
+
+
+def _buy_levels(db, data, upgrade, buy):
+    """Один уровень без параметров, иначе n уровней или максимум"""
+    user_id = data.get('user_id')
+    if not user_id:
+        return {'error': 'No user_id provided'}, 400
+    n = data.get('n')
+    if n is None and data.get('max') is not True:
+        result = upgrade(user_id)
+    elif data.get('max') is True:
+        result = buy(user_id)
+    elif not _is_count(n):
+        return {'error': 'Invalid n'}, 400
+    else:
+        result = buy(user_id, n)
+    return (result if result else {'error': 'Недостаточно кликов'}), 200
+
+
+def upgrade_click(db, data):
+    """Улучшение силы клика; n - купить n уровней, max - сколько хватит кликов"""
+    return _buy_levels(db, data, db.upgrade_click, db.buy_click_levels)
+
+
+def upgrade_passive(db, data):
+    """Улучшение пассивного дохода; n - купить n уровней, max - сколько хватит кликов"""
+    return _buy_levels(db, data, db.upgrade_passive, db.buy_passive_levels)
+
+
+def open_box(db, data):
+    """Открытие бокса с питомцем или, с параметром n, сразу n боксов"""
+    user_id = data.get('user_id')
+    if not user_id:
+        return {'error': 'No user_id provided'}, 400
+    n = data.get('n')
+    if n is None:
+        result = db.open_box(user_id)
+    elif not _is_count(n) or n > BOX_MAX_BATCH:
+        return {'error': 'Invalid n'}, 400
+    else:
+        result = db.open_boxes(user_id, n)
+    return (result if result else {'error': 'Недостаточно кликов'}), 200
+
+
+def _pet_action(method, error: str):
+    """Обработчик действия с питомцем: user_id и pet обязательны"""
+    def handler(db, data):
+        user_id = data.get('user_id')
+        pet = data.get('pet')
+        if not user_id or not pet:
+            return {'error': 'Invalid request'}, 400
+        result = getattr(db, method)(user_id, pet)
+        return (result if result else {'error': error}), 200
+    handler.__name__ = method
+    return handler
+
+
+equip_pet = _pet_action('equip_pet', 'Не удалось экипировать питомца')
+unequip_pet = _pet_action('unequip_pet', 'Не удалось снять питомца')
+upgrade_pet = _pet_action('upgrade_pet', 'Не удалось улучшить питомца')
+delete_pet = _pet_action('delete_pet', 'Не удалось удалить питомца')
+equip_all_same = _pet_action('equip_all_same', 'Не удалось экипировать питомцев')
+
+
+def passive_income(db, data):
+    """Статистика с пассивным доходом, начисленным по времени"""
+    user_id = data.get('user_id')
+    if not user_id:
+        return {'error': 'No user_id provided'}, 400
+    result = db.passive_income(user_id)
+    return (result if result else {'error': 'Нет пассивного дохода'}), 200
+
+
+def batch(db, data):
+    """Несколько действий игрока за один запрос"""
+    user_id = data.get('user_id')
+    actions = data.get('actions')
+    if not user_id or not isinstance(actions, list) or len(actions) > BATCH_MAX_ACTIONS:
+        return {'error': 'Invalid request'}, 400
+    try:
+        return db.apply_batch(user_id, actions), 200
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+
+def leaderboard(db, data):
+    """Страница рейтинга игроков и, если передан user_id, место игрока.
+
+    window=all - по текущему балансу, day и week - по кликам,
+    заработанным за последние сутки или неделю.
+    """
+    window = data.get('window', 'all')
+    offset = _int_arg(data, 'offset', 0)
+    limit = _int_arg(data, 'limit', 50)
+    if window != 'all' and window not in LEADERBOARD_WINDOWS:
+        return {'error': 'Invalid window'}, 400
+    if offset < 0 or limit < 1 or limit > LEADERBOARD_PAGE_MAX:
+        return {'error': 'Invalid offset or limit'}, 400
+    user_id = data.get('user_id')
+    if window == 'all':
+        players = db.get_leaderboard(limit=limit, offset=offset)
+        me = db.get_rank(user_id) if user_id else None
+    else:
+        players = db.get_window_leaderboard(window, limit=limit, offset=offset)
+        me = db.get_window_rank(window, user_id) if user_id else None
+    for place, player in enumerate(players, offset + 1):
+        player['rank'] = place
+
+    total = me['total'] if me else db.leaderboard_size(window)
+    return {'window': window, 'total': total, 'offset': offset, 'limit': limit, 'players': players, 'me': me}, 200
+
+
+def get_pets(db, data):
+    """Получение информации о питомцах"""
+    return PETS, 200
+
+
+def cache_stats(db, data):
+    """Счетчики кэша пользователей для подбора его размера"""
+    return db.cache_stats(), 200
+
+
+# Маршруты API: метод, путь, обработчик
+ROUTES = (
+    ('GET', '/api/stats', get_stats),
+    ('POST', '/api/click', click),
+    ('POST', '/api/upgrade_click', upgrade_click),
+    ('POST', '/api/upgrade_passive', upgrade_passive),
+    ('POST', '/api/box', open_box),
+    ('POST', '/api/equip_pet', equip_pet),
+    ('POST', '/api/unequip_pet', unequip_pet),
+    ('POST', '/api/upgrade_pet', upgrade_pet),
+    ('POST', '/api/passive_income', passive_income),
+    ('POST', '/api/delete_pet', delete_pet),
+    ('POST', '/api/batch', batch),
+    ('GET', '/api/leaderboard', leaderboard),
+    ('GET', '/api/pets', get_pets),
+    ('GET', '/api/cache_stats', cache_stats),
+    ('POST', '/api/equip_all_same', equip_all_same),
+)
@@ -0,0 +1,90 @@
+"""Асинхронный доступ к базе для обработчиков бота.
+
+Методы базы вызываются в потоках asyncio.to_thread: даже изменение в
+памяти может ждать блокировку игрока (ее держат веб-обработчики),
+всех игроков (массовые изменения) или чтение игрока с диска, и цикл
+событий при этом не должен стоять. Запись на диск базы в памяти (файл
+в режиме 'sync', журнал в режиме 'journal') идет в отдельном потоке
+Persister, чтобы не занимать потоки обработчиков. Запросы на запись,
+пришедшие, пока идет предыдущая запись, объединяются в одну.
+"""
+import asyncio
+import atexit
+import threading
+
+
+class Persister:
+    """Поток записи изменений базы, отложенных обработчиками"""
+
+    def __init__(self, db):
+        self.db = db
+        self._pending = set()
+        self._requested = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.requests = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name='database-persister', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, user_ids) -> bool:
+        """Запросить запись пользователей user_ids и очереди журнала"""
+        with self._lock:
+            self._pending |= set(user_ids)
+            self._requested = True
+            self.requests += 1
+        self._wakeup.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                user_ids, self._pending = self._pending, set()
+                requested, self._requested = self._requested, False
+                stopped = self._stopped
+            if requested:
+                try:
+                    self.db._persist_now(user_ids)
+                    self.writes += 1
+                except Exception as e:
+                    print(f"Error in background persist: {e}")
+            if stopped:
+                return
+
+    def close(self):
+        """Запись оставшихся изменений и остановка потока"""
+        with self._lock:
+            self._stopped = True
+        self._wakeup.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class AsyncDatabase:
+    """Методы Database в виде корутин: user = await adb.get_user_stats(user_id)"""
+
+    def __init__(self, db):
+        self.db = db
+        if db.in_memory and db.save_mode in ('sync', 'journal'):
+            db.persister = Persister(db)
+
+    async def run(self, func, *args, **kwargs):
+        """Вызов func в потоке, не останавливая цикл событий"""
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,107 @@
+"""Сравнение памяти и скорости сохранения пользователей в словарях и в колонках.
+
+Запуск: python bench_users.py [число игроков]
+"""
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from columnar_database import ColumnarStore
+from pets import PETS_BY_ID, INVENTORY_SIZE, empty_inventory, empty_slots, empty_levels
+
+
+def make_user(rng: random.Random) -> dict:
+    """Игрок с полями, которые Database держит в памяти, включая производные"""
+    inventory = empty_inventory()
+    for _ in range(rng.randrange(6)):
+        inventory[rng.randrange(1, INVENTORY_SIZE)] += 1
+    owned = [pet for pet, count in enumerate(inventory) if count]
+    slots = empty_slots()
+    for i, pet in enumerate(owned[:len(slots)]):
+        slots[i] = pet
+    click_power = rng.randrange(1, 30)
+    passive_income = rng.randrange(0, 20)
+    return {
+        'clicks': rng.randrange(10 ** 6),
+        'click_power': click_power,
+        'passive_income': passive_income,
+        'inventory': inventory,
+        'equipped_pets': slots,
+        'pet_levels': empty_levels(),
+        'achievements': {'clicks_made': rng.randrange(10 ** 5), 'boxes_opened': len(owned), 'pets_collected': len(owned)},
+        'click_seq': rng.randrange(1000),
+        'last_save': time.time() - rng.random() * 86400,
+        'click_multiplier': 1.2,
+        'passive_multiplier': 1.1,
+        'current_click_power': round(click_power * 1.2, 1),
+        'current_passive_income': round(passive_income * 1.1, 1),
+        'pet_counts': {PETS_BY_ID[pet]['name']: inventory[pet] for pet in owned}
+    }
+
+
+def measure(build):
+    """Результат build и прирост памяти на нем по tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def timed(action) -> float:
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(1)
+    # Одни и те же игроки для обоих вариантов: строки JSON не считаются ни там, ни там
+    source = [json.dumps(make_user(rng)) for _ in range(count)]
+
+    users, dict_bytes = measure(lambda: {str(100000000 + i): json.loads(raw) for i, raw in enumerate(source)})
+
+    def build_store():
+        store = ColumnarStore()
+        for i, raw in enumerate(source):
+            store._write_users({str(100000000 + i): json.loads(raw)})
+        return store
+
+    store, store_bytes = measure(build_store)
+
+    print(f"Players: {count}")
+    print(f"dict:     {dict_bytes / 2 ** 20:8.1f} MiB, {dict_bytes / count:6.0f} bytes per player")
+    print(f"columnar: {store_bytes / 2 ** 20:8.1f} MiB, {store_bytes / count:6.0f} bytes per player "
+          f"(columns {store.nbytes / 2 ** 20:.1f} MiB)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, 'users.json')
+        columns_file = os.path.join(directory, 'users.columns')
+
+        def save_json():
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(users, f, ensure_ascii=False)
+
+        def load_json():
+            with open(json_file, 'r', encoding='utf-8') as f:
+                json.load(f)
+
+        json_save = timed(save_json)
+        json_load = timed(load_json)
+        columns_save = timed(lambda: store.write(columns_file))
+        columns_load = timed(lambda: ColumnarStore().read(columns_file))
+        print(f"JSON save {json_save:.2f}s, load {json_load:.2f}s, {os.path.getsize(json_file) / 2 ** 20:.1f} MiB")
+        print(f"columns save {columns_save:.2f}s, load {columns_load:.2f}s, "
+              f"{os.path.getsize(columns_file) / 2 ** 20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""Рассылка сообщения всем игрокам с соблюдением ограничений Telegram.
+
+Рассылка хранится в data/broadcasts: <id>.json - текст и список
+получателей, <id>.log - дописываемые итоги по каждому получателю
+(как журнал базы). После перезапуска отправка продолжается с тех, кого
+нет в журнале; сообщение, отправленное прямо перед остановкой, может
+прийти повторно. Рассылки отправляются по очереди, в порядке создания.
+
+Темп задают ведра токенов: общее (BROADCAST_RATE сообщений в секунду)
+и по одному на чат (BROADCAST_CHAT_RATE). Ответ 429 останавливает все
+отправки на указанное Telegram время, ошибки сети и сервера повторяются
+с удвоением паузы.
+
+Запуск без бота: python broadcast.py send ТЕКСТ | resume | status
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, Any
+from aiogram.exceptions import (TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError,
+                                TelegramServerError)
+from config import BROADCAST_RATE, BROADCAST_CHAT_RATE, BROADCAST_SENDERS, BROADCAST_MAX_RETRIES, BROADCAST_BACKOFF
+from database import DATA_DIR
+
+BROADCAST_DIR = os.path.join(DATA_DIR, 'broadcasts')
+
+# Итоги отправки одному получателю
+STATUSES = ('sent', 'blocked', 'failed')
+
+# Сколько ведер чатов хранить; сверх этого удаляются снова полные ведра
+CHAT_BUCKETS_MAX = 10000
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity сразу"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float = None) -> float:
+        """Сколько секунд ждать следующего токена"""
+        now = time.monotonic() if now is None else now
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Остановка выдачи токенов (ответ 429); после паузы ведро начинается пустым"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+    def idle(self, now: float) -> bool:
+        """Ведро снова полное - его можно удалить и создать заново"""
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class Broadcast:
+    """Одна рассылка: текст, получатели и итоги из журнала"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.id = spec['id']
+        self.text = spec['text']
+        self.created = spec['created']
+        self.recipients = spec['recipients']
+        self.results = {}
+        self._log = None
+
+    @property
+    def spec_filename(self) -> str:
+        return os.path.join(BROADCAST_DIR, f"{self.id}.json")
+
+    @property
+    def log_filename(self) -> str:
+        return os.path.join(BROADCAST_DIR, f"{self.id}.log")
+
+    @classmethod
+    def create(cls, text: str, recipients: list) -> 'Broadcast':
+        """Рассылка получателям recipients; id, которые не могут быть чатом
+        Telegram (не число), пропускаются"""
+        os.makedirs(BROADCAST_DIR, exist_ok=True)
+        broadcast_id = time.strftime('%Y%m%d-%H%M%S') + f"-{time.time_ns() % 10 ** 6:06d}"
+        chat_ids = [str(user_id) for user_id in recipients if str(user_id).lstrip('-').isdigit()]
+        if len(chat_ids) < len(recipients):
+            print(f"Broadcast {broadcast_id}: skipped {len(recipients) - len(chat_ids)} non-numeric ids")
+        broadcast = cls({'id': broadcast_id, 'text': text, 'created': time.time(), 'recipients': chat_ids})
+        temp_file = f"{broadcast.spec_filename}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'id': broadcast.id, 'text': broadcast.text, 'created': broadcast.created,
+                       'recipients': broadcast.recipients}, f, ensure_ascii=False)
+        os.replace(temp_file, broadcast.spec_filename)
+        return broadcast
+
+    @classmethod
+    def load(cls, filename: str) -> 'Broadcast':
+        with open(filename, 'r', encoding='utf-8') as f:
+            broadcast = cls(json.load(f))
+        if os.path.exists(broadcast.log_filename):
+            with open(broadcast.log_filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная запись при аварийном завершении - получатель будет отправлен заново
+                        continue
+                    broadcast.results[record['u']] = record['s']
+        return broadcast
+
+    def pending(self) -> list:
+        return [user_id for user_id in self.recipients if user_id not in self.results]
+
+    def record(self, user_id: str, status: str):
+        if self._log is None:
+            self._log = open(self.log_filename, 'a', encoding='utf-8')
+        self._log.write(json.dumps({'u': user_id, 's': status}) + '\n')
+        self._log.flush()
+        self.results[user_id] = status
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def status(self) -> Dict[str, Any]:
+        counts = {status: 0 for status in STATUSES}
+        for status in self.results.values():
+            counts[status] += 1
+        return {'id': self.id, 'recipients': len(self.recipients), 'pending': len(self.recipients) - len(self.results),
+                **counts}
+
+
+def load_broadcasts() -> list:
+    """Все рассылки в порядке создания"""
+    if not os.path.isdir(BROADCAST_DIR):
+        return []
+    names = sorted(name for name in os.listdir(BROADCAST_DIR) if name.endswith('.json'))
+    return [Broadcast.load(os.path.join(BROADCAST_DIR, name)) for name in names]
+
+
+class Broadcaster:
+    """Фоновая отправка рассылок по очереди"""
+
+    def __init__(self, bot, rate: float = BROADCAST_RATE, chat_rate: float = BROADCAST_CHAT_RATE,
+                 senders: int = BROADCAST_SENDERS):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.senders = max(1, senders)
+        self._chat_buckets = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.current = None
+        self.retry_after = 0
+
+    async def create(self, db, text: str) -> Broadcast:
+        """Новая рассылка всем игрокам базы; список получателей фиксируется сразу"""
+        broadcast = await asyncio.to_thread(lambda: Broadcast.create(text, list(db.users)))
+        self._wakeup.set()
+        return broadcast
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка; неотправленное продолжится после перезапуска"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self, forever: bool = True):
+        """Отправка незавершенных рассылок, затем ожидание новых"""
+        while True:
+            self._wakeup.clear()
+            for broadcast in await asyncio.to_thread(load_broadcasts):
+                if broadcast.pending():
+                    await self.send(broadcast)
+            if not forever:
+                return
+            await self._wakeup.wait()
+
+    async def send(self, broadcast: Broadcast):
+        pending = broadcast.pending()
+        print(f"Broadcast {broadcast.id}: sending to {len(pending)} of {len(broadcast.recipients)} players")
+        self.current = broadcast
+        queue = asyncio.Queue()
+        for user_id in pending:
+            queue.put_nowait(user_id)
+        start = time.monotonic()
+        senders = [asyncio.create_task(self._sender(broadcast, queue)) for _ in range(self.senders)]
+        try:
+            await queue.join()
+        finally:
+            for sender in senders:
+                sender.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+            broadcast.close()
+        print(f"Broadcast {broadcast.id} finished in {time.monotonic() - start:.1f}s: {broadcast.status()}")
+
+    async def _sender(self, broadcast: Broadcast, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                try:
+                    status = await self._deliver(user_id, broadcast.text)
+                except Exception as e:
+                    # Отправитель не должен завершиться: иначе queue.join() не дождется очереди
+                    print(f"Broadcast to {user_id} failed: {e}")
+                    status = 'failed'
+                broadcast.record(user_id, status)
+            finally:
+                queue.task_done()
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= CHAT_BUCKETS_MAX:
+                now = time.monotonic()
+                self._chat_buckets = {chat: b for chat, b in self._chat_buckets.items() if not b.idle(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    async def _deliver(self, chat_id: str, text: str) -> str:
+        """Отправка одному получателю с повторами; возвращает итог из STATUSES"""
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(int(chat_id), text)
+                return 'sent'
+            except TelegramRetryAfter as e:
+                # Превышен лимит - ждут все отправители, а не только этот
+                self.retry_after += 1
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return 'blocked'
+            except TelegramBadRequest as e:
+                print(f"Broadcast to {chat_id} failed: {e}")
+                return 'failed'
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > BROADCAST_MAX_RETRIES:
+                    print(f"Broadcast to {chat_id} failed after {attempt} attempts: {e}")
+                    return 'failed'
+                await asyncio.sleep(BROADCAST_BACKOFF * 2 ** (attempt - 1))
+            except Exception as e:
+                print(f"Broadcast to {chat_id} failed: {e}")
+                return 'failed'
+
+    async def status(self) -> Dict[str, Any]:
+        """Ход текущей или последней рассылки"""
+        broadcast = self.current
+        if broadcast is None:
+            broadcasts = await asyncio.to_thread(load_broadcasts)
+            broadcast = broadcasts[-1] if broadcasts else None
+        if broadcast is None:
+            return {}
+        return {**broadcast.status(), 'rate_limited': self.retry_after}
+
+
+async def run_command(args: list):
+    from main import bot, db
+    try:
+        if args[:1] == ['send'] and len(args) > 1:
+            broadcaster = Broadcaster(bot)
+            await broadcaster.create(db, ' '.join(args[1:]))
+            await broadcaster.run(forever=False)
+        elif args == ['resume']:
+            await Broadcaster(bot).run(forever=False)
+        elif args == ['status']:
+            for broadcast in load_broadcasts():
+                print(broadcast.status())
+        else:
+            print("Usage: python broadcast.py send TEXT | resume | status")
+    finally:
+        await bot.session.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run_command(sys.argv[1:]))
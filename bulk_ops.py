@@ -0,0 +1,151 @@
+"""Массовые операции над всеми игроками для админских событий.
+
+Изменение описывается словарем поле -> (операция, значение):
+'add' - прибавить, 'scale' - умножить с округлением вниз, 'set' - заменить.
+Каждое хранилище применяет его за один проход своим способом
+(Database.bulk_update) и сохраняет данные один раз.
+
+Запуск без бота: python bulk_ops.py grant 1000
+"""
+import sys
+import time
+from typing import Dict, Any
+from config import CLUSTER_ROUTER_URL
+from pets import empty_inventory, empty_slots, empty_levels, pet_id, set_pet_multipliers
+
+try:
+    import numpy
+except ImportError:
+    # Без numpy колонки обрабатываются циклом по array
+    numpy = None
+
+# Числовые поля, к которым применимы 'add' и 'scale'
+BULK_FIELDS = ('clicks', 'click_power', 'passive_income')
+
+# Поля-списки, которые можно только заменить целиком
+BULK_VECTOR_FIELDS = ('inventory', 'equipped_pets', 'pet_levels')
+
+BULK_OPS = ('add', 'scale', 'set')
+
+
+def season_reset() -> Dict[str, tuple]:
+    """Сброс прогресса к значениям нового игрока; достижения остаются"""
+    return {
+        'clicks': ('set', 0),
+        'click_power': ('set', 1),
+        'passive_income': ('set', 0),
+        'inventory': ('set', empty_inventory()),
+        'equipped_pets': ('set', empty_slots()),
+        'pet_levels': ('set', empty_levels())
+    }
+
+
+def validate(changes: Dict[str, tuple]):
+    if not changes:
+        raise ValueError("No changes")
+    for field, (op, value) in changes.items():
+        if field in BULK_VECTOR_FIELDS:
+            if op != 'set' or not isinstance(value, list):
+                raise ValueError(f"Field {field} can only be set to a list")
+        elif field not in BULK_FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        elif op not in BULK_OPS or type(value) not in (int, float):
+            raise ValueError(f"Invalid change for {field}: {op} {value!r}")
+        elif op != 'scale' and type(value) is not int:
+            raise ValueError(f"Field {field} takes whole numbers")
+        elif op == 'scale' and value < 0:
+            raise ValueError("Scale factor must not be negative")
+
+
+def apply_value(value, op: str, arg):
+    """Новое значение поля одного игрока"""
+    if op == 'set':
+        return list(arg) if isinstance(arg, list) else arg
+    if op == 'add':
+        return value + arg
+    return int(value * arg)
+
+
+def apply_column(column, op: str, arg, slots=None, missing=None):
+    """Изменение числовой колонки array целиком или в строках slots.
+
+    Элементы, равные missing (нет значения), не меняются.
+    """
+    if numpy is not None and len(column):
+        values = numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+        index = slice(None) if slots is None else numpy.asarray(slots, dtype=numpy.intp)
+        selected = values[index]
+        mask = selected != missing if missing is not None else numpy.ones(len(selected), dtype=bool)
+        if op == 'set':
+            selected[mask] = arg
+        elif op == 'add':
+            selected[mask] += arg
+        else:
+            selected[mask] = numpy.floor(selected[mask] * arg)
+        values[index] = selected
+        del values, selected
+        return
+
+    for slot in range(len(column)) if slots is None else slots:
+        if column[slot] != missing:
+            column[slot] = apply_value(column[slot], op, arg)
+
+
+def describe(changes: Dict[str, tuple]) -> str:
+    return ', '.join(f"{field} {op} {'[...]' if isinstance(value, list) else value}"
+                     for field, (op, value) in changes.items())
+
+
+def timed_update(db, changes: Dict[str, tuple], user_ids=None) -> Dict[str, Any]:
+    """Применение изменений с замером времени"""
+    validate(changes)
+    start = time.perf_counter()
+    users = db.bulk_update(changes, user_ids)
+    seconds = time.perf_counter() - start
+    print(f"Bulk update ({describe(changes)}) of {users} users in {seconds * 1000:.1f} ms")
+    return {'users': users, 'seconds': round(seconds, 4), 'changes': describe(changes)}
+
+
+def run_command(db, args: list) -> Dict[str, Any]:
+    """Команда из аргументов строки:
+
+    grant N [поле]        - начислить N (по умолчанию клики)
+    adjust ПОЛЕ ПРОЦЕНТ   - изменить поле на ПРОЦЕНТ процентов (100 - удвоить)
+    reset                 - сброс сезона
+    rederive              - пересчитать множители питомцев
+    rebalance ПИТОМЕЦ КЛИК ДОХОД - новые множители питомца (сохраняются в
+                          data/pet_overrides.json) и их пересчет
+    """
+    command = args[0] if args else ''
+    if command == 'grant' and len(args) in (2, 3):
+        return timed_update(db, {args[2] if len(args) == 3 else 'clicks': ('add', int(args[1]))})
+    if command == 'adjust' and len(args) == 3:
+        return timed_update(db, {args[1]: ('scale', 1 + float(args[2]) / 100)})
+    if command == 'reset' and len(args) == 1:
+        return timed_update(db, season_reset())
+    if command == 'rebalance' and len(args) == 4:
+        if CLUSTER_ROUTER_URL:
+            # Воркер пересчитал бы только свою часть игроков, остальные процессы - со старыми множителями
+            raise ValueError("rebalance is not available in cluster mode: stop the cluster, "
+                             "run python bulk_ops.py rebalance and start it again")
+        pet = pet_id(args[1])
+        if not pet:
+            raise ValueError(f"Unknown pet: {args[1]}")
+        set_pet_multipliers(pet, float(args[2]), float(args[3]))
+        command, args = 'rederive', ['rederive']
+    if command == 'rederive' and len(args) == 1:
+        start = time.perf_counter()
+        users = db.bulk_rederive()
+        seconds = time.perf_counter() - start
+        print(f"Rederived multipliers of {users} users in {seconds * 1000:.1f} ms")
+        return {'users': users, 'seconds': round(seconds, 4), 'changes': 'rederive'}
+    raise ValueError("Usage: grant N [field] | adjust FIELD PERCENT | reset | rederive | rebalance PET CLICK PASSIVE")
+
+
+if __name__ == '__main__':
+    from database import open_database
+    database = open_database()
+    try:
+        run_command(database, sys.argv[1:])
+    finally:
+        database.close()
@@ -0,0 +1,349 @@
+"""Несколько процессов без общего состояния: игроки делятся между
+воркерами по хэшу user_id.
+
+python cluster.py - маршрутизатор на WEB_PORT и CLUSTER_WORKERS воркеров.
+Каждый воркер - отдельный процесс со своей базой (своя часть игроков,
+свои файлы в data/) и веб-API из server.py на CLUSTER_BASE_PORT + номер.
+Маршрутизатор пересылает /api/* воркеру-владельцу игрока, а рейтинги
+собирает из всех частей. Telegram опрашивает тоже маршрутизатор и
+передает обновления воркеру, которому принадлежит автор.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import zlib
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+from api import _int_arg
+from config import (BOT_TOKEN, WEB_HOST, WEB_PORT, STORAGE_URL, CLUSTER_WORKERS, CLUSTER_BASE_PORT,
+                    LEADERBOARD_PAGE_MAX, TELEGRAM_API_URL)
+from database import open_database, DATA_DIR, DERIVED_FIELDS, LEADERBOARD_WINDOWS
+import server
+
+# Число частей, по которым сейчас разложены игроки
+CLUSTER_FILE = os.path.join(DATA_DIR, 'cluster.json')
+
+# Сколько ждать запуска воркеров, секунд
+WORKER_START_TIMEOUT = 60
+
+
+def partition_of(user_id, partitions: int) -> int:
+    """Номер воркера, которому принадлежит игрок"""
+    return zlib.crc32(str(user_id).encode('utf-8')) % partitions
+
+
+def partition_url(url: str, partition: int, partitions: int) -> str:
+    """STORAGE_URL части: database.json -> database.p0-of-4.json"""
+    scheme, _, path = url.partition(':///')
+    base, ext = os.path.splitext(path)
+    return f"{scheme}:///{base}.p{partition}-of-{partitions}{ext}"
+
+
+def prepare_partitions(url: str, partitions: int):
+    """Раскладка игроков по частям при первом запуске или смене числа воркеров.
+
+    Игроки копируются из общей базы (или из частей прежнего числа) в
+    новые части; исходные файлы остаются как есть. Рейтинги за сутки и
+    неделю не переносятся.
+    """
+    try:
+        with open(CLUSTER_FILE, 'r', encoding='utf-8') as f:
+            previous = json.load(f)['partitions']
+    except (OSError, ValueError, KeyError):
+        previous = None
+    if previous == partitions:
+        return
+
+    sources = [url] if previous is None else [partition_url(url, i, previous) for i in range(previous)]
+    # Общий database.json переносит только исходная база, не каждая часть
+    targets = [open_database(partition_url(url, i, partitions), import_legacy=False) for i in range(partitions)]
+    moved = 0
+    try:
+        for source_url in sources:
+            source = open_database(source_url)
+            try:
+                for user_id in list(source.users):
+                    user = {key: value for key, value in source.users[user_id].items() if key not in DERIVED_FIELDS}
+                    target = targets[partition_of(user_id, partitions)]
+                    target.users[user_id] = user
+                    target.mark_dirty(user_id, 'create')
+                    moved += 1
+            finally:
+                source.close()
+    finally:
+        for target in targets:
+            target.close()
+
+    with open(CLUSTER_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'partitions': partitions}, f)
+    print(f"Moved {moved} users into {partitions} partitions")
+
+
+def partition_leaderboard(db, data):
+    """Рейтинг одной части: первые limit игроков, размер и, если
+    переданы, место user_id и число игроков выше результата ahead"""
+    window = data.get('window', 'all')
+    limit = data.get('limit', 0)
+    user_id = data.get('user_id')
+    if window == 'all':
+        players = db.get_leaderboard(limit=limit) if limit else []
+        me = db.get_rank(user_id) if user_id else None
+    else:
+        players = db.get_window_leaderboard(window, limit=limit) if limit else []
+        me = db.get_window_rank(window, user_id) if user_id else None
+    result = {'players': players, 'total': db.leaderboard_size(window), 'me': me}
+    if data.get('ahead'):
+        score, ahead_of = data['ahead']
+        result['ahead'] = db.count_ahead(window, score, ahead_of)
+    return result, 200
+
+
+async def run_worker():
+    """Воркер: веб-API над своей частью и обработка пересланных обновлений бота.
+
+    STORAGE_URL, WEB_HOST и PORT воркера задает маршрутизатор.
+    """
+    if BOT_TOKEN:
+        from main import bot, dp, db
+    else:
+        bot, dp, db = None, None, open_database(import_legacy=False)
+
+    app = server.create_app(db)
+    app.router.add_post('/internal/leaderboard', server.aiohttp_view(db, partition_leaderboard))
+    if dp is not None:
+        async def feed_update(request: web.Request) -> web.Response:
+            await dp.feed_raw_update(bot, await request.json())
+            return web.json_response({'ok': True})
+        app.router.add_post('/internal/update', feed_update)
+
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+    print(f"Worker for {os.getenv('STORAGE_URL')} listening on {WEB_HOST}:{WEB_PORT}")
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if bot is not None:
+            await bot.session.close()
+        db.close()
+
+
+class Router:
+    """Маршрутизатор запросов к воркерам по владельцу игрока"""
+
+    def __init__(self, partitions: int):
+        self.partitions = partitions
+        self.urls = [f"http://127.0.0.1:{CLUSTER_BASE_PORT + i}" for i in range(partitions)]
+        self.session = None
+
+    async def call(self, worker: int, path: str, data: dict) -> dict:
+        async with self.session.post(f"{self.urls[worker]}{path}", json=data) as response:
+            return await response.json()
+
+    async def forward(self, request: web.Request) -> web.Response:
+        """Пересылка запроса воркеру, которому принадлежит user_id"""
+        body = await request.read()
+        if request.method == 'GET':
+            user_id = request.query.get('user_id')
+        else:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            user_id = data.get('user_id') if isinstance(data, dict) else None
+        worker = partition_of(user_id, self.partitions) if user_id else 0
+        try:
+            async with self.session.request(request.method, f"{self.urls[worker]}{request.path_qs}", data=body,
+                                            headers={'Content-Type': 'application/json'}) as response:
+                return web.Response(body=await response.read(), status=response.status,
+                                    content_type='application/json')
+        except (ClientError, asyncio.TimeoutError) as e:
+            print(f"Error forwarding to worker {worker}: {e}")
+            return web.json_response({'error': 'Worker unavailable'}, status=503)
+
+    async def stream(self, request: web.Request) -> web.StreamResponse:
+        """Поток изменений игрока (stream.py) от его воркера, без ожидания конца ответа"""
+        user_id = request.query.get('user_id')
+        worker = partition_of(user_id, self.partitions) if user_id else 0
+        try:
+            upstream = await self.session.get(f"{self.urls[worker]}{request.path_qs}", timeout=ClientTimeout(total=None))
+        except (ClientError, asyncio.TimeoutError) as e:
+            print(f"Error streaming from worker {worker}: {e}")
+            return web.json_response({'error': 'Worker unavailable'}, status=503)
+        async with upstream:
+            response = web.StreamResponse(status=upstream.status, headers={
+                'Content-Type': upstream.headers.get('Content-Type', 'application/json'),
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+            await response.prepare(request)
+            try:
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+            except (ClientError, ConnectionResetError):
+                # Закрылся воркер или клиент - клиент переподключится сам
+                pass
+            return response
+
+    async def leaderboard(self, request: web.Request) -> web.Response:
+        """Общий рейтинг: слияние первых offset + limit игроков каждой части.
+
+        Место игрока - число игроков выше его результата во всех частях.
+        """
+        data = request.query
+        window = data.get('window', 'all')
+        offset = _int_arg(data, 'offset', 0)
+        limit = _int_arg(data, 'limit', 50)
+        if window != 'all' and window not in LEADERBOARD_WINDOWS:
+            return web.json_response({'error': 'Invalid window'}, status=400)
+        if offset < 0 or limit < 1 or limit > LEADERBOARD_PAGE_MAX:
+            return web.json_response({'error': 'Invalid offset or limit'}, status=400)
+        user_id = data.get('user_id')
+        owner = partition_of(user_id, self.partitions) if user_id else None
+        score = 'clicks' if window == 'all' else 'earned'
+
+        parts = await asyncio.gather(*(
+            self.call(worker, '/internal/leaderboard',
+                      {'window': window, 'limit': offset + limit, 'user_id': user_id if worker == owner else None})
+            for worker in range(self.partitions)))
+        merged = heapq.merge(*(part['players'] for part in parts), key=lambda player: (-player[score], player['user_id']))
+        players = list(itertools.islice(merged, offset, offset + limit))
+        for place, player in enumerate(players, offset + 1):
+            player['rank'] = place
+        total = sum(part['total'] for part in parts)
+
+        me = parts[owner]['me'] if owner is not None else None
+        if me:
+            ahead = await asyncio.gather(*(
+                self.call(worker, '/internal/leaderboard', {'window': window, 'ahead': [me[score], str(user_id)]})
+                for worker in range(self.partitions)))
+            rank = sum(part['ahead'] for part in ahead) + 1
+            me = {**me, 'rank': rank, 'total': total, 'percentile': round(100 * (total - rank) / total, 2)}
+        return web.json_response({'window': window, 'total': total, 'offset': offset, 'limit': limit,
+                                  'players': players, 'me': me})
+
+    async def cache_stats(self, request: web.Request) -> web.Response:
+        """Счетчики кэша каждого воркера"""
+        stats = []
+        for url in self.urls:
+            async with self.session.get(f"{url}/api/cache_stats") as response:
+                stats.append(await response.json())
+        return web.json_response({'workers': stats})
+
+    async def relay_updates(self, bot):
+        """Опрос Telegram и передача обновлений воркерам: обновления
+        одного воркера передаются по порядку, разных - параллельно"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30)
+            except Exception as e:
+                print(f"Error getting updates: {e}")
+                await asyncio.sleep(5)
+                continue
+            batches = {}
+            for update in updates:
+                offset = update.update_id + 1
+                try:
+                    author = getattr(update.event, 'from_user', None)
+                except Exception:
+                    author = None
+                worker = partition_of(author.id, self.partitions) if author else 0
+                batches.setdefault(worker, []).append(update.model_dump(mode='json', exclude_unset=True))
+            await asyncio.gather(*(self._feed(worker, batch) for worker, batch in batches.items()))
+
+    async def _feed(self, worker: int, updates: list):
+        for update in updates:
+            try:
+                await self.call(worker, '/internal/update', update)
+            except (ClientError, asyncio.TimeoutError) as e:
+                print(f"Error passing update {update.get('update_id')} to worker {worker}: {e}")
+
+    async def _wait_for_workers(self):
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        for url in self.urls:
+            while True:
+                try:
+                    async with self.session.get(f"{url}/api/pets") as response:
+                        if response.status == 200:
+                            break
+                except (ClientError, asyncio.TimeoutError):
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker {url} did not start")
+                await asyncio.sleep(0.2)
+
+    async def serve(self):
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+
+        self.session = ClientSession(timeout=ClientTimeout(total=30))
+        app = web.Application()
+        app.router.add_get('/', server.index)
+        app.router.add_static('/static', os.path.join(server.BASE_DIR, 'static'))
+        app.router.add_get('/api/leaderboard', self.leaderboard)
+        app.router.add_get('/api/cache_stats', self.cache_stats)
+        app.router.add_get('/api/stream', self.stream)
+        app.router.add_route('*', '/api/{tail:.*}', self.forward)
+        runner = web.AppRunner(app)
+        relay = None
+        bot = None
+        try:
+            await self._wait_for_workers()
+            await runner.setup()
+            await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+            print(f"Router listening on {WEB_HOST}:{WEB_PORT} for {self.partitions} workers")
+            if BOT_TOKEN:
+                from aiogram import Bot
+                from aiogram.client.session.aiohttp import AiohttpSession
+                from aiogram.client.telegram import TelegramAPIServer
+                session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+                bot = Bot(token=BOT_TOKEN, session=session)
+                await bot.delete_webhook()
+                relay = asyncio.create_task(self.relay_updates(bot))
+            await stop.wait()
+        finally:
+            if relay is not None:
+                relay.cancel()
+            if bot is not None:
+                await bot.session.close()
+            await runner.cleanup()
+            await self.session.close()
+
+
+def main():
+    partitions = max(1, CLUSTER_WORKERS)
+    prepare_partitions(STORAGE_URL, partitions)
+    workers = []
+    for i in range(partitions):
+        env = dict(os.environ,
+                   STORAGE_URL=partition_url(STORAGE_URL, i, partitions),
+                   WEB_HOST='127.0.0.1',
+                   PORT=str(CLUSTER_BASE_PORT + i),
+                   CLUSTER_ROUTER_URL=f"http://127.0.0.1:{WEB_PORT}")
+        workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker'], env=env))
+    try:
+        asyncio.run(Router(partitions).serve())
+    finally:
+        # Воркеры сохраняют свои части при SIGTERM
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['worker']:
+        asyncio.run(run_worker())
+    else:
+        main()
@@ -0,0 +1,422 @@
+import copy
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Any
+from config import MAX_EQUIPPED_PETS, COLUMNAR_HOT_USERS
+from bulk_ops import apply_column, apply_value
+from database import Database, DERIVED_FIELDS
+from pets import INVENTORY_SIZE, migrate_user
+from user_cache import LRUUsers
+
+# Версия двоичного снимка: при несовпадении файл не читается
+COLUMNS_VERSION = 1
+
+# Числовые поля пользователя: колонка на поле
+SCALAR_COLUMNS = (
+    ('clicks', 'q'),
+    ('click_power', 'q'),
+    ('passive_income', 'q'),
+    ('click_seq', 'q'),
+    ('last_save', 'd'),
+    ('last_click_at', 'd'),
+)
+
+# Счетчики достижений: колонка на счетчик
+ACHIEVEMENTS = ('clicks_made', 'boxes_opened', 'pets_collected')
+
+# Списки фиксированной длины: строка матрицы на пользователя
+VECTOR_COLUMNS = (
+    ('inventory', 'I', INVENTORY_SIZE),
+    ('equipped_pets', 'H', MAX_EQUIPPED_PETS),
+    ('pet_levels', 'H', INVENTORY_SIZE),
+)
+
+PACKED_FIELDS = frozenset([name for name, _ in SCALAR_COLUMNS] + [name for name, _, _ in VECTOR_COLUMNS]
+                          + ['achievements'])
+
+# Отсутствующее значение в целочисленной колонке; в дробной - NaN
+MISSING_INT = -2 ** 63
+
+# Допустимые значения целочисленных колонок
+LIMITS = {'q': (MISSING_INT + 1, 2 ** 63 - 1), 'I': (0, 2 ** 32 - 1), 'H': (0, 2 ** 16 - 1)}
+
+_MISSING = object()
+
+
+class ColumnarStore:
+    """Пользователи в колонках: числовые поля - массивы array по номеру
+    пользователя, инвентарь и уровни питомцев - матрицы счетчиков.
+
+    Пользователь с user_id занимает строку slots[user_id] во всех
+    колонках. Значения, которые не помещаются в колонку (дробные клики,
+    неизвестные поля), хранятся в словаре extra этой строки. Словари
+    пользователей собираются только при чтении (_read_user), поэтому
+    класс подходит как хранилище для LRUUsers.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._slots = {}
+        self._ids = []
+        self._extra = {}
+        self._widths = {name: 1 for name, _ in SCALAR_COLUMNS}
+        self._widths.update({f"achievements.{key}": 1 for key in ACHIEVEMENTS})
+        self._widths.update({name: width for name, _, width in VECTOR_COLUMNS})
+        typecodes = dict(SCALAR_COLUMNS)
+        typecodes.update({f"achievements.{key}": 'q' for key in ACHIEVEMENTS})
+        typecodes.update({name: typecode for name, typecode, _ in VECTOR_COLUMNS})
+        self._columns = {name: array(typecode) for name, typecode in typecodes.items()}
+        self._empty_rows = {name: array(typecode, [self._missing(typecode)]) if self._widths[name] == 1
+                            else array(typecode, [0]) * self._widths[name]
+                            for name, typecode in typecodes.items()}
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Размер колонок в байтах (без словарей slots и extra)"""
+        return sum(len(column) * column.itemsize for column in self._columns.values())
+
+    @staticmethod
+    def _missing(typecode: str):
+        return math.nan if typecode == 'd' else MISSING_INT
+
+    @staticmethod
+    def _fits(typecode: str, value) -> bool:
+        if typecode == 'd':
+            return type(value) in (int, float) and not math.isnan(value)
+        low, high = LIMITS[typecode]
+        return type(value) is int and low <= value <= high
+
+    def _append(self, user_id: str) -> int:
+        slot = len(self._ids)
+        self._ids.append(user_id)
+        self._slots[user_id] = slot
+        for name, column in self._columns.items():
+            column.extend(self._empty_rows[name])
+        return slot
+
+    def _pack(self, slot: int, user: Dict[str, Any]):
+        """Запись словаря пользователя в строку slot"""
+        extra = {}
+        for name, typecode in SCALAR_COLUMNS:
+            value = user.get(name, _MISSING)
+            if value is not _MISSING and self._fits(typecode, value):
+                self._columns[name][slot] = value
+            else:
+                self._columns[name][slot] = self._missing(typecode)
+                if value is not _MISSING:
+                    extra[name] = value
+
+        achievements = user.get('achievements', _MISSING)
+        packed = (isinstance(achievements, dict) and bool(achievements)
+                  and all(key in ACHIEVEMENTS and self._fits('q', value) for key, value in achievements.items()))
+        for key in ACHIEVEMENTS:
+            self._columns[f"achievements.{key}"][slot] = achievements.get(key, MISSING_INT) if packed else MISSING_INT
+        if achievements is not _MISSING and not packed:
+            extra['achievements'] = achievements
+
+        for name, typecode, width in VECTOR_COLUMNS:
+            value = user.get(name, _MISSING)
+            start = slot * width
+            if (isinstance(value, list) and len(value) == width
+                    and all(self._fits(typecode, item) for item in value)):
+                self._columns[name][start:start + width] = array(typecode, value)
+            else:
+                self._columns[name][start:start + width] = self._empty_rows[name]
+                if value is not _MISSING:
+                    extra[name] = value
+
+        for key, value in user.items():
+            if key not in PACKED_FIELDS and key not in DERIVED_FIELDS:
+                extra[key] = value
+        if extra:
+            self._extra[slot] = copy.deepcopy(extra)
+        else:
+            self._extra.pop(slot, None)
+
+    def _unpack(self, slot: int) -> Dict[str, Any]:
+        """Сборка словаря пользователя из строки slot"""
+        user = {}
+        for name, typecode in SCALAR_COLUMNS:
+            value = self._columns[name][slot]
+            if value != MISSING_INT and not (typecode == 'd' and math.isnan(value)):
+                user[name] = value
+
+        achievements = {}
+        for key in ACHIEVEMENTS:
+            value = self._columns[f"achievements.{key}"][slot]
+            if value != MISSING_INT:
+                achievements[key] = value
+        if achievements:
+            user['achievements'] = achievements
+
+        for name, _, width in VECTOR_COLUMNS:
+            start = slot * width
+            user[name] = self._columns[name][start:start + width].tolist()
+        if slot in self._extra:
+            user.update(copy.deepcopy(self._extra[slot]))
+        migrate_user(user)
+        return user
+
+    # Интерфейс хранилища для LRUUsers
+
+    def _read_user(self, user_id: str):
+        with self._lock:
+            slot = self._slots.get(user_id)
+            return None if slot is None else self._unpack(slot)
+
+    def _write_users(self, users: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            for user_id, user in users.items():
+                slot = self._slots.get(user_id)
+                if slot is None:
+                    slot = self._append(user_id)
+                migrate_user(user)
+                self._pack(slot, user)
+
+    def _has_user(self, user_id: str) -> bool:
+        return user_id in self._slots
+
+    def _user_ids(self) -> list:
+        with self._lock:
+            return list(self._ids)
+
+    def _count_users(self) -> int:
+        return len(self._ids)
+
+    def clicks_items(self) -> list:
+        """Пары (user_id, clicks) без сборки словарей пользователей"""
+        with self._lock:
+            clicks = self._columns['clicks']
+            return [(user_id, clicks[slot] if clicks[slot] != MISSING_INT
+                     else self._extra.get(slot, {}).get('clicks', 0))
+                    for slot, user_id in enumerate(self._ids)]
+
+    def bulk_update(self, changes: Dict[str, tuple], user_ids=None) -> int:
+        """Изменение колонок целиком (или строк user_ids) без сборки словарей"""
+        with self._lock:
+            slots = None
+            if user_ids is not None:
+                slots = sorted({self._slots[str(user_id)] for user_id in user_ids if str(user_id) in self._slots})
+            selected = None if slots is None else set(slots)
+            for field, (op, value) in changes.items():
+                column = self._columns[field]
+                width = self._widths[field]
+                if width == 1:
+                    # set заполняет и пустые значения, add и scale их пропускают
+                    apply_column(column, op, value, slots, None if op == 'set' else self._missing(column.typecode))
+                else:
+                    if len(value) != width:
+                        raise ValueError(f"Field {field} needs {width} values")
+                    row = array(column.typecode, value)
+                    if slots is None:
+                        self._columns[field] = row * len(self._ids)
+                    else:
+                        for slot in slots:
+                            column[slot * width:(slot + 1) * width] = row
+                # Значения, не поместившиеся в колонку, меняются по одному
+                for slot, extra in self._extra.items():
+                    if field in extra and (selected is None or slot in selected):
+                        if op == 'set' or width > 1:
+                            del extra[field]
+                        elif type(extra[field]) in (int, float):
+                            extra[field] = apply_value(extra[field], op, value)
+            for slot in [slot for slot, extra in self._extra.items() if not extra]:
+                del self._extra[slot]
+            return len(self._ids) if slots is None else len(slots)
+
+    def import_users(self, users: Dict[str, Dict[str, Any]]):
+        """Перенос пользователей из словаря (снимка JSON или бэкапа)"""
+        self._write_users({str(user_id): user for user_id, user in users.items()})
+
+    def write(self, filename: str):
+        """Двоичный снимок: заголовок, user_id и extra в JSON, затем колонки как есть"""
+        with self._lock:
+            header = {
+                'version': COLUMNS_VERSION,
+                'byteorder': sys.byteorder,
+                'count': len(self._ids),
+                'columns': [[name, column.typecode, column.itemsize, self._widths[name]]
+                            for name, column in self._columns.items()]
+            }
+            temp_file = f"{filename}.tmp"
+            with open(temp_file, 'wb') as f:
+                for part in (header, self._ids, {str(slot): extra for slot, extra in self._extra.items()}):
+                    f.write(json.dumps(part, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+                for column in self._columns.values():
+                    column.tofile(f)
+        os.replace(temp_file, filename)
+
+    def read(self, filename: str):
+        """Чтение двоичного снимка, записанного write"""
+        with open(filename, 'rb') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != COLUMNS_VERSION:
+                raise ValueError(f"Unsupported columns version in {filename}")
+            ids = json.loads(f.readline())
+            extra = json.loads(f.readline())
+            count = header['count']
+            columns = {}
+            for name, typecode, itemsize, width in header['columns']:
+                column = array(typecode)
+                if column.itemsize != itemsize:
+                    raise ValueError(f"Column {name} in {filename} has item size {itemsize}")
+                column.fromfile(f, count * width)
+                if header['byteorder'] != sys.byteorder:
+                    column.byteswap()
+                columns[name] = column
+
+        with self._lock:
+            for name in self._columns:
+                # Колонка, которой не было в старом снимке, заполняется пустыми значениями
+                self._columns[name] = columns.get(name) or self._empty_rows[name] * count
+            self._ids = ids
+            self._slots = {user_id: slot for slot, user_id in enumerate(ids)}
+            self._extra = {int(slot): value for slot, value in extra.items()}
+
+
+class ColumnarDatabase(Database):
+    """Хранилище с пользователями в колонках (ColumnarStore).
+
+    Словарями в памяти живут только недавно активные пользователи
+    (LRUUsers), остальные занимают по строке в колонках. Снимок -
+    один двоичный файл, который пишется и читается целыми колонками.
+    Если снимка нет, при первом запуске переносится database.json
+    с тем же именем.
+    """
+
+    def __init__(self, filename: str = 'database.columns', hot_users: int = COLUMNAR_HOT_USERS):
+        self.store = ColumnarStore()
+        self.hot_users = max(1, hot_users)
+        super().__init__(filename)
+
+    def load(self):
+        needs_save = False
+        self.users = LRUUsers(self.store, self.hot_users)
+        try:
+            legacy = f"{os.path.splitext(self.filename)[0]}.json"
+            if os.path.exists(self.filename):
+                self.store.read(self.filename)
+                print(f"Loaded data for {len(self.store)} users")
+            elif os.path.exists(legacy):
+                with open(legacy, 'r', encoding='utf-8') as f:
+                    self.store.import_users(json.load(f))
+                self._legacy_files = [legacy]
+                needs_save = True
+                print(f"Imported {len(self.store)} users from {legacy}")
+            else:
+                print("No existing database found, creating new")
+            if self.save_mode == 'journal':
+                self._replay_journal()
+            needs_save = needs_save or self._journal_records > 0
+        except Exception as e:
+            print(f"Error loading database: {e}")
+            self._create_backup()
+            self.store = ColumnarStore()
+            self.users = LRUUsers(self.store, self.hot_users)
+            self._legacy_files = []
+            needs_save = True
+        finally:
+            if needs_save and self.save() and self._legacy_files:
+                for file in self._legacy_files:
+                    shutil.move(file, f"{file}.backup")
+                print(f"Migrated {self._legacy_files[0]} to {self.filename}")
+                self._legacy_files = []
+
+    def save(self, user_ids=None):
+        """Запись снимка целиком: колонки пишутся без разбора по пользователям"""
+        with self._save_lock:
+            try:
+                self.users.flush()
+                self.store.write(self.filename)
+                self._save_windows()
+                print(f"Data saved successfully ({len(self.store)} users)")
+
+                if self.save_mode == 'journal':
+                    self._reset_journal()
+                return True
+            except Exception as e:
+                print(f"Error saving database: {e}")
+                return False
+
+    @contextmanager
+    def _user_operation(self, user_id: str):
+        """Изменяемый пользователь закрепляется в горячем наборе: его не
+        вытеснят и не перенесут в колонки наполовину измененным"""
+        with super()._user_operation(user_id):
+            users = self.users
+            users.pin(user_id)
+            try:
+                yield
+            finally:
+                users.unpin(user_id)
+
+    def mark_dirty(self, user_id: str, op: str = 'update', fields=None, pets=()):
+        self.users.mark_dirty(user_id)
+        return super().mark_dirty(user_id, op, fields, pets)
+
+    def _apply_journal_record(self, record: Dict[str, Any]):
+        super()._apply_journal_record(record)
+        self.users.mark_dirty(record['u'])
+
+    def _leaderboard_players(self):
+        """Рейтинг строится по колонке кликов, не собирая словари пользователей"""
+        self.users.flush()
+        return self.store.clicks_items()
+
+    def bulk_update(self, changes: Dict[str, tuple], user_ids=None) -> int:
+        """Массовое изменение прямо в колонках: горячие словари сначала
+        записываются в колонки, а после изменения сбрасываются"""
+        with self._save_lock, self._operation():
+            self.users.flush()
+            if 'passive_income' in changes:
+                targets = self.store._user_ids() if user_ids is None else \
+                    [str(user_id) for user_id in user_ids if self.store._has_user(str(user_id))]
+                settled = {user_id: self.store._read_user(user_id) for user_id in targets}
+                self._settle_passive(settled.items())
+                self.store._write_users(settled)
+            count = self.store.bulk_update(changes, user_ids)
+            self.users = LRUUsers(self.store, self.hot_users)
+            self._reset_leaderboard()
+            self._derived_valid.clear()
+            self.save()
+        return count
+
+    def bulk_rederive(self) -> int:
+        """Множители не хранятся в колонках - пересчитываются только горячие словари"""
+        self._derived_valid.clear()
+        users = self.users.resident()
+        for user_id, user in users:
+            self._derived(user_id, user)
+        return len(users)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        stats = self.users.stats()
+        stats['stored_users'] = len(self.store)
+        stats['column_bytes'] = self.store.nbytes
+        return stats
+
+    def restore_from_backup(self, backup_name):
+        """Восстановить данные из JSON-бэкапа"""
+        try:
+            with open(backup_name, 'r') as f:
+                data = json.load(f)
+            with self._save_lock, self._operation():
+                store = ColumnarStore()
+                store.import_users(data)
+                self.store = store
+                self.users = LRUUsers(store, self.hot_users)
+            self._reset_leaderboard()
+            self._derived_valid.clear()
+            self.save()
+            return True
+        except:
+            return False
@@ -6,31 +6,100 @@ load_dotenv()
 # Основные настройки
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 WEBAPP_URL = os.getenv('WEBAPP_URL')
-DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///database.db')
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')  # адрес веб-сервера server.py
+WEB_PORT = int(os.getenv('PORT', '5000'))  # порт веб-сервера server.py (PORT задает хостинг)
+
+# Получение обновлений ботом: 'polling' - опрос Telegram, 'webhook' - Telegram сам присылает их в server.py
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес server.py, например https://telegram-clicker.onrender.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')  # путь, на который приходят обновления
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # секрет запросов Telegram, по умолчанию выводится из токена
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', '64'))  # обновлений в обработке одновременно
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # одновременных запросов Telegram (1-100)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # другой сервер Bot API, например http://127.0.0.1:8081 (fake_telegram.py)
+
+# Рассылки игрокам (broadcast.py): Telegram допускает около 30 сообщений в секунду и 1 в секунду одному чату
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # сообщений рассылки в секунду, остальное - ответам бота
+BROADCAST_CHAT_RATE = float(os.getenv('BROADCAST_CHAT_RATE', '1'))  # сообщений в секунду одному чату
+BROADCAST_SENDERS = int(os.getenv('BROADCAST_SENDERS', '8'))  # одновременных запросов отправки
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '5'))  # повторов при ошибках сети и сервера
+BROADCAST_BACKOFF = float(os.getenv('BROADCAST_BACKOFF', '1'))  # пауза перед первым повтором, дальше вдвое больше
+
+# Поток изменений статистики в веб-приложение (stream.py)
+STREAM_INTERVAL = float(os.getenv('STREAM_INTERVAL', '1'))  # секунд между проверками изменений, не чаще - обновления
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', '15'))  # пустое сообщение без изменений, чтобы прокси не закрыл поток
+STREAM_RANK_INTERVAL = float(os.getenv('STREAM_RANK_INTERVAL', '10'))  # секунд между пересчетами места игрока в потоке
+
+# Несколько процессов (cluster.py): игроки делятся между воркерами по хэшу user_id
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))  # число воркеров
+CLUSTER_BASE_PORT = int(os.getenv('CLUSTER_BASE_PORT', '5100'))  # порт первого воркера, остальные - следующие
+CLUSTER_ROUTER_URL = os.getenv('CLUSTER_ROUTER_URL')  # задается воркерам: адрес маршрутизатора для общего рейтинга
+ADMIN_IDS = {user_id.strip() for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}  # id админов через запятую
+# Хранилище игроков. Не DATABASE_URL: его задает хостинг для своей базы (postgres://...)
+# 'json:///database.json' - JSON-файл в data/, 'sqlite:///database.db' - SQLite в data/,
+# 'columns:///database.columns' - колонки в памяти с двоичным снимком в data/
+STORAGE_URL = os.getenv('STORAGE_URL', 'json:///database.json')
+
+# Настройки сохранения базы данных
+# 'sync' - запись файла после каждого изменения,
+# 'write_behind' - изменения копятся в памяти и сохраняются фоновым потоком,
+# 'journal' - каждое изменение дописывается в журнал, снимок пересобирается периодически
+SAVE_MODE = os.getenv('SAVE_MODE', 'write_behind')
+SAVE_INTERVAL = float(os.getenv('SAVE_INTERVAL', '5'))  # секунд между фоновыми сохранениями
+SAVE_MAX_DIRTY = int(os.getenv('SAVE_MAX_DIRTY', '100'))  # внеочередное сохранение при стольких изменённых игроках
+JOURNAL_COMPACT_RECORDS = int(os.getenv('JOURNAL_COMPACT_RECORDS', '10000'))  # записей журнала до пересборки снимка
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', '0') == '1'  # fsync после каждой записи в журнал
+SNAPSHOT_SHARDS = int(os.getenv('SNAPSHOT_SHARDS', '1'))  # число файлов снимка, 1 - единый database.json
+LAZY_LOAD = os.getenv('LAZY_LOAD', '1') == '1'  # при старте читать только индекс, игроков - при первом обращении
+USER_LOCK_STRIPES = int(os.getenv('USER_LOCK_STRIPES', '64'))  # блокировок игроков: игроки разных блокировок меняются параллельно
+
+# Кэш активных игроков для SQLite (только один процесс): остальные читаются с диска по запросу
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '0'))  # максимум игроков в памяти, 0 - без кэша
+USER_CACHE_BYTES = int(os.getenv('USER_CACHE_BYTES', '0'))  # примерный лимит памяти кэша в байтах, 0 - без лимита
+COLUMNAR_HOT_USERS = int(os.getenv('COLUMNAR_HOT_USERS', '1024'))  # игроков в виде словарей при хранении в колонках
 
 # Настройки игры
 BOX_COST = 500
+BOX_MAX_BATCH = int(os.getenv('BOX_MAX_BATCH', '1000'))  # максимум боксов, открываемых одним запросом
 MAX_EQUIPPED_PETS = 2
+CLICK_MAX_PER_SECOND = int(os.getenv('CLICK_MAX_PER_SECOND', '20'))  # сколько кликов в секунду засчитывается
+CLICK_MAX_BATCH = int(os.getenv('CLICK_MAX_BATCH', '100'))  # максимум кликов в одном запросе
+CLICK_SESSIONS = int(os.getenv('CLICK_SESSIONS', '16'))  # для скольких последних вкладок игрока помнить номер пачки кликов
+BATCH_MAX_ACTIONS = int(os.getenv('BATCH_MAX_ACTIONS', '100'))  # максимум действий в /api/batch
+LEADERBOARD_PAGE_MAX = int(os.getenv('LEADERBOARD_PAGE_MAX', '100'))  # максимум игроков на странице рейтинга
+EARNED_BUCKET_SECONDS = int(os.getenv('EARNED_BUCKET_SECONDS', '3600'))  # длина корзины заработка для рейтингов за сутки и неделю
 
-# Питомцы и их характеристики
-PETS = {
-    'cat': {'name': 'Кот', 'click_power': 2, 'passive_income': 1, 'rarity': 'common'},
-    'dog': {'name': 'Собака', 'click_power': 3, 'passive_income': 2, 'rarity': 'common'},
-    'dragon': {'name': 'Дракон', 'click_power': 5, 'passive_income': 3, 'rarity': 'rare'},
-    'unicorn': {'name': 'Единорог', 'click_power': 7, 'passive_income': 4, 'rarity': 'rare'},
-    'phoenix': {'name': 'Феникс', 'click_power': 10, 'passive_income': 5, 'rarity': 'epic'}
-}
+# Каталог питомцев. id - номер питомца в инвентаре игроков,
+# его нельзя менять или отдавать другому питомцу.
+# Множители указаны для первого уровня, улучшение с уровня L стоит upgrade_cost * L
+PET_CATALOG = (
+    {'id': 1, 'name': 'Котенок', 'click_multiplier': 1.2, 'passive_multiplier': 1.1, 'rarity': 'Обычный', 'tier': 'common',
+     'max_level': 10, 'upgrade_cost': 1000},
+    {'id': 2, 'name': 'Щенок', 'click_multiplier': 1.2, 'passive_multiplier': 1.2, 'rarity': 'Обычный', 'tier': 'common',
+     'max_level': 10, 'upgrade_cost': 1000},
+    {'id': 3, 'name': 'Хомяк', 'click_multiplier': 1.5, 'passive_multiplier': 1.3, 'rarity': 'Редкий', 'tier': 'rare',
+     'max_level': 10, 'upgrade_cost': 2500},
+    {'id': 4, 'name': 'Попугай', 'click_multiplier': 1.5, 'passive_multiplier': 1.5, 'rarity': 'Редкий', 'tier': 'rare',
+     'max_level': 10, 'upgrade_cost': 2500},
+    {'id': 5, 'name': 'Единорог', 'click_multiplier': 2.0, 'passive_multiplier': 1.8, 'rarity': 'Эпический', 'tier': 'epic',
+     'max_level': 10, 'upgrade_cost': 5000},
+    {'id': 6, 'name': 'Дракон', 'click_multiplier': 3.0, 'passive_multiplier': 2.0, 'rarity': 'Легендарный', 'tier': 'legendary',
+     'max_level': 10, 'upgrade_cost': 10000}
+)
+PET_LEVEL_BONUS = 0.25  # каждый уровень после первого добавляет такую долю бонуса множителя первого уровня
 
-# Шансы выпадения питомцев из боксов
+# Шансы выпадения питомцев из боксов по редкости (делятся поровну между питомцами редкости)
 BOX_CHANCES = {
     'common': 0.7,
     'rare': 0.25,
-    'epic': 0.05
+    'epic': 0.04,
+    'legendary': 0.01
 }
 
 # Цвета для редкостей питомцев
 RARITY_COLORS = {
     'common': '⚪️',
     'rare': '🔵',
-    'epic': '🟣'
+    'epic': '🟣',
+    'legendary': '🟡'
 } 
\ No newline at end of file
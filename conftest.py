@@ -0,0 +1,11 @@
+"""Общие фикстуры проверок: данные пишутся во временную директорию pytest"""
+import pytest
+import database
+import sqlite_database
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(sqlite_database, 'DATA_DIR', str(tmp_path))
+    return tmp_path
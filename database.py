@@ -2,28 +2,108 @@ import sqlite3
 import json
 import os
 import shutil
-from datetime import datetime
-from config import PETS, BOX_CHANCES, BOX_COST
-import random
+import atexit
+import signal
+import threading
+import time
+import glob
+import re
+import zlib
+import math
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from config import (BOX_COST, BOX_MAX_BATCH, STORAGE_URL, SAVE_MODE, SAVE_INTERVAL, SAVE_MAX_DIRTY,
+                    JOURNAL_COMPACT_RECORDS, JOURNAL_FSYNC, SNAPSHOT_SHARDS, USER_CACHE_SIZE,
+                    USER_CACHE_BYTES, LAZY_LOAD, USER_LOCK_STRIPES, CLICK_MAX_PER_SECOND, CLICK_MAX_BATCH,
+                    CLICK_SESSIONS, EARNED_BUCKET_SECONDS)
+from lazy_users import LazyUsers, index_filename, load_index, write_index
+from leaderboard import Leaderboard, WindowedLeaderboard
+from upgrades import CLICK_UPGRADE_COSTS, PASSIVE_UPGRADE_COSTS
+from bulk_ops import apply_value
+from pets import (PETS, PETS_BY_ID, BOX_SAMPLER, PET_LEVEL_STRIDE, PET_CLICK_MULTIPLIERS, PET_PASSIVE_MULTIPLIERS,
+                  PET_UPGRADE_COSTS, pet_id, empty_inventory, empty_slots, empty_levels, equipped_count, migrate_user)
 from typing import Dict, Any
 
-# Улучшенная система питомцев с уровнями
-PETS = {
-    'Котенок': {'name': 'Котенок', 'click_multiplier': 1.2, 'passive_multiplier': 1.1, 'rarity': 'Обычный'},
-    'Щенок': {'name': 'Щенок', 'click_multiplier': 1.2, 'passive_multiplier': 1.2, 'rarity': 'Обычный'},
-    'Хомяк': {'name': 'Хомяк', 'click_multiplier': 1.5, 'passive_multiplier': 1.3, 'rarity': 'Редкий'},
-    'Попугай': {'name': 'Попугай', 'click_multiplier': 1.5, 'passive_multiplier': 1.5, 'rarity': 'Редкий'},
-    'Единорог': {'name': 'Единорог', 'click_multiplier': 2.0, 'passive_multiplier': 1.8, 'rarity': 'Эпический'},
-    'Дракон': {'name': 'Дракон', 'click_multiplier': 3.0, 'passive_multiplier': 2.0, 'rarity': 'Легендарный'}
+# Поля, которые пересчитываются при чтении и не пишутся в журнал
+DERIVED_FIELDS = ('current_click_power', 'current_passive_income', 'pet_counts',
+                  'click_multiplier', 'passive_multiplier', 'click_cost', 'passive_cost')
+
+# Поля, при изменении которых производные поля нужно пересчитать
+DERIVED_SOURCES = frozenset(('click_power', 'passive_income', 'inventory', 'equipped_pets', 'pet_levels'))
+
+# Действия для apply_batch: метод Database, его параметры и текст ошибки
+BATCH_ACTIONS = {
+    'click': ('click_batch', ('count', 'seq', 'session'), None),
+    'upgrade_click': ('upgrade_click', (), 'Недостаточно кликов'),
+    'upgrade_passive': ('upgrade_passive', (), 'Недостаточно кликов'),
+    'buy_click': ('buy_click_levels', ('n',), 'Недостаточно кликов'),
+    'buy_passive': ('buy_passive_levels', ('n',), 'Недостаточно кликов'),
+    'box': ('open_box', (), 'Недостаточно кликов'),
+    'boxes': ('open_boxes', ('n',), 'Недостаточно кликов'),
+    'equip_pet': ('equip_pet', ('pet',), 'Не удалось экипировать питомца'),
+    'unequip_pet': ('unequip_pet', ('pet',), 'Не удалось снять питомца'),
+    'equip_all_same': ('equip_all_same', ('pet',), 'Не удалось экипировать питомцев'),
+    'delete_pet': ('delete_pet', ('pet',), 'Не удалось удалить питомца'),
+    'upgrade_pet': ('upgrade_pet', ('pet',), 'Не удалось улучшить питомца')
 }
 
-MAX_EQUIPPED_PETS = 2
+# Допустимые типы параметров действий
+BATCH_PARAM_TYPES = {'count': int, 'seq': int, 'session': str, 'n': int, 'pet': (str, int)}
+# Параметры, без которых действие не выполнить
+BATCH_REQUIRED_PARAMS = frozenset(('pet',))
+
+# Окна рейтингов по заработанным кликам, в секундах
+LEADERBOARD_WINDOWS = {'day': 24 * 3600, 'week': 7 * 24 * 3600}
+
+# Путь к директории данных (вне Git)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def open_database(url: str = STORAGE_URL, import_legacy: bool = True) -> 'Database':
+    """Создание хранилища по STORAGE_URL.
+
+    'sqlite:///database.db' - SQLite, 'json:///database.json' - JSON-файл,
+    'columns:///database.columns' - колонки в памяти с двоичным снимком.
+    Относительные пути отсчитываются от директории data. При
+    import_legacy=False пустая база SQLite не переносит data/database.json.
+    """
+    scheme, _, path = url.partition(':///')
+    if scheme == 'sqlite':
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(path or 'database.db', cache_size=USER_CACHE_SIZE, cache_bytes=USER_CACHE_BYTES,
+                              import_legacy=import_legacy)
+    if scheme == 'columns':
+        from columnar_database import ColumnarDatabase
+        return ColumnarDatabase(path or 'database.columns')
+    if scheme == 'json':
+        return Database(path or 'database.json')
+    raise ValueError(f"Unsupported STORAGE_URL: {url}")
+
+
+def _per_user(method):
+    """Выполнение метода Database под блокировкой пользователя user_id"""
+    def wrapper(self, user_id, *args, **kwargs):
+        with self._user_operation(user_id):
+            return method(self, user_id, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
 
 class Database:
-    def __init__(self):
-        # Путь к директории данных (вне Git)
-        self.data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-        self.filename = os.path.join(self.data_dir, 'database.json')
+    # Изменения выполняются в памяти, диск - только при сохранении
+    in_memory = True
+    # Поток записи изменений вместо записи в потоке изменения (AsyncDatabase)
+    persister = None
+
+    def __init__(self, filename: str = 'database.json'):
+        self.data_dir = DATA_DIR
+        self.filename = os.path.join(self.data_dir, filename)
+        self.journal_filename = f"{os.path.splitext(self.filename)[0]}.journal"
+        self.earned_filename = f"{os.path.splitext(self.filename)[0]}.earned.json"
+        # Корзины заработка - по файлу на корзину, записываются только измененные
+        self.earned_dir = f"{os.path.splitext(self.filename)[0]}.earned"
         
         # Создаем директорию для данных, если её нет
         if not os.path.exists(self.data_dir):
@@ -31,55 +111,435 @@ class Database:
             print(f"Created data directory at {self.data_dir}")
         
         self.users = {}
+        self.save_mode = SAVE_MODE
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._save_lock = threading.RLock()
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flusher = None
+        # Игроки делятся между блокировками по хэшу: разные игроки меняются параллельно
+        self._user_locks = [threading.RLock() for _ in range(max(1, USER_LOCK_STRIPES))]
+        self._op_state = threading.local()
+        self._batch_state = threading.local()
+        self._journal = None
+        self._journal_records = 0
+        self._journal_lock = threading.Lock()
+        self._journal_queue = []
+        self.shards = max(1, SNAPSHOT_SHARDS)
+        self._shard_members = [set() for _ in range(self.shards)]
+        self._legacy_files = []
+        self._leaderboard = None
+        self._leaderboard_lock = threading.Lock()
+        # Пока рейтинг строится без блокировки, mark_dirty копит сюда изменения кликов
+        self._leaderboard_changes = None
+        self._leaderboard_build_lock = threading.Lock()
+        self._derived_valid = set()
         self.load()
-        print(f"Database initialized at {self.filename}")
+        self._windows = self._load_windows()
+
+        if self.save_mode in ('write_behind', 'journal'):
+            self._start_flusher()
+        print(f"Database initialized at {self.filename} (save mode: {self.save_mode})")
 
     def load(self):
-        """Загрузка данных с проверкой целостности"""
+        """Загрузка данных с проверкой целостности.
+
+        Файл снимка перезаписывается только при миграции раскладки,
+        после применения журнала или если снимок поврежден.
+        """
+        needs_save = False
         try:
-            if os.path.exists(self.filename):
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, dict):
-                        self.users = data
-                        print(f"Loaded data for {len(self.users)} users")
-                    else:
-                        print("Warning: Invalid data format, creating backup")
-                        self._create_backup()
-                        self.users = {}
+            files = self._snapshot_files()
+            if files:
+                data = self._read_snapshot(files)
+                if data is not None:
+                    self.users = data
+                    print(f"Loaded data for {len(self.users)} users")
+                else:
+                    print("Warning: Invalid data format, creating backup")
+                    self._create_backup()
+                    self.users = {}
+                    needs_save = True
             else:
                 print("No existing database found, creating new")
                 self.users = {}
+            if self.save_mode == 'journal':
+                self._replay_journal()
+            needs_save = needs_save or bool(self._legacy_files) or self._journal_records > 0
         except Exception as e:
             print(f"Error loading database: {e}")
             self._create_backup()
             self.users = {}
+            self._legacy_files = []
+            needs_save = True
         finally:
-            self.save()
+            if needs_save and self.save() and self._legacy_files:
+                # Данные перенесены в новую раскладку - старые файлы убираем в бэкап
+                for file in self._legacy_files:
+                    shutil.move(file, f"{file}.backup")
+                    if os.path.exists(index_filename(file)):
+                        os.remove(index_filename(file))
+                print(f"Migrated {len(self._legacy_files)} snapshot files to {self.shards} shards")
+                self._legacy_files = []
+            if not needs_save and self.shards > 1:
+                self._shard_members = [set() for _ in range(self.shards)]
+                for user_id in self.users:
+                    self._shard_members[self._shard_of(user_id)].add(user_id)
 
-    def save(self):
-        """Безопасное сохранение данных"""
-        try:
-            # Создаем временный файл
-            temp_file = f"{self.filename}.tmp"
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, ensure_ascii=False, indent=2)
-            
-            # Безопасно заменяем основной файл
-            shutil.move(temp_file, self.filename)
-            print(f"Data saved successfully ({len(self.users)} users)")
+    def _shard_of(self, user_id: str) -> int:
+        """Стабильный номер части снимка для пользователя"""
+        return zlib.crc32(str(user_id).encode('utf-8')) % self.shards
+
+    def _shard_filename(self, shard: int, shards: int = None) -> str:
+        base = os.path.splitext(self.filename)[0]
+        return f"{base}.{shard}-of-{shards or self.shards}.json"
+
+    def _snapshot_files(self) -> list:
+        """Файлы снимка в текущей раскладке или, для миграции, в прежней"""
+        if self.shards == 1:
+            current = [self.filename] if os.path.exists(self.filename) else []
+        else:
+            current = [self._shard_filename(i) for i in range(self.shards)]
+            current = [file for file in current if os.path.exists(file)]
+        if current:
+            return current
+
+        # Ищем снимок с другим числом частей или единый файл
+        base = os.path.splitext(self.filename)[0]
+        pattern = re.compile(re.escape(os.path.basename(base)) + r'\.\d+-of-(\d+)\.json$')
+        legacy = sorted(file for file in glob.glob(f"{glob.escape(base)}.*-of-*.json")
+                        if pattern.search(os.path.basename(file)))
+        if not legacy and self.shards > 1 and os.path.exists(self.filename):
+            legacy = [self.filename]
+        self._legacy_files = legacy
+        return legacy
+
+    def _read_snapshot(self, files: list):
+        """Чтение частей снимка в несколько потоков.
+
+        При LAZY_LOAD читаются только индексы смещений, а сами пользователи
+        разбираются при первом обращении (LazyUsers).
+        """
+        if LAZY_LOAD:
+            with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+                indexes = list(executor.map(load_index, files))
+            users = LazyUsers(on_load=migrate_user)
+            for file, offsets in zip(files, indexes):
+                users.relocate(file, offsets)
+            return users
+
+        def read(file):
+            with open(file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+            parts = list(executor.map(read, files))
+        if not all(isinstance(part, dict) for part in parts):
+            return None
+        data = {}
+        for part in parts:
+            data.update(part)
+        for user in data.values():
+            migrate_user(user)
+        return data
+
+    def _write_snapshot(self, filename: str, user_ids):
+        """Запись файла снимка: по одному пользователю в строке, с индексом смещений"""
+        if isinstance(self.users, LazyUsers):
+            values = self.users.raw_values(user_ids, self._encode_user)
+        else:
+            values = ((user_id,) + self._encode_user(user_id, self.users[user_id]) for user_id in user_ids)
+
+        # Создаем временный файл
+        temp_file = f"{filename}.tmp"
+        offsets = {}
+        with open(temp_file, 'wb') as f:
+            f.write(b'{')
+            separator = b'\n'
+            for user_id, raw, clicks in values:
+                f.write(separator + json.dumps(user_id, ensure_ascii=False).encode('utf-8') + b': ')
+                offsets[user_id] = (f.tell(), len(raw), clicks)
+                f.write(raw)
+                separator = b',\n'
+            f.write(b'\n}\n')
+
+        # Безопасно заменяем основной файл
+        if isinstance(self.users, LazyUsers):
+            self.users.replace(temp_file, filename, offsets)
+        else:
+            shutil.move(temp_file, filename)
+        write_index(filename, offsets)
+
+    def _encode_user(self, user_id: str, user: Dict[str, Any]) -> tuple:
+        """JSON пользователя и его клики для снимка. Читается под блокировкой
+        пользователя, поэтому в снимок не попадает наполовину выполненное изменение"""
+        with self._user_locks[self._stripe_of(user_id)]:
+            return json.dumps(user, ensure_ascii=False).encode('utf-8'), user.get('clicks', 0)
+
+    def save(self, user_ids=None):
+        """Безопасное сохранение данных.
+
+        При SNAPSHOT_SHARDS > 1 переписываются только части снимка,
+        в которые попадают пользователи `user_ids` (все части, если не указаны).
+        """
+        with self._save_lock:
+            try:
+                if self.shards == 1:
+                    self._write_snapshot(self.filename, list(self.users))
+                else:
+                    if user_ids is None:
+                        self._shard_members = [set() for _ in range(self.shards)]
+                        user_ids = list(self.users)
+                        shards = range(self.shards)
+                    else:
+                        shards = set()
+                    for user_id in user_ids:
+                        shard = self._shard_of(user_id)
+                        self._shard_members[shard].add(str(user_id))
+                        if isinstance(shards, set):
+                            shards.add(shard)
+                    for shard in shards:
+                        part = [user_id for user_id in self._shard_members[shard] if user_id in self.users]
+                        self._write_snapshot(self._shard_filename(shard), part)
+                self._save_windows()
+                print(f"Data saved successfully ({len(self.users)} users)")
+
+                # Снимок содержит все изменения - журнал можно очистить
+                if self.save_mode == 'journal':
+                    self._reset_journal()
+                return True
+            except Exception as e:
+                print(f"Error saving database: {e}")
+                return False
+
+    def mark_dirty(self, user_id: str, op: str = 'update', fields=None, pets=()):
+        """Отметить пользователя как измененного.
+
+        В режиме 'sync' данные сразу записываются на диск, в режиме
+        'write_behind' запись выполняет фоновый поток. В режиме 'journal'
+        в журнал дописываются новые значения полей `fields` (все поля,
+        если не указаны) и количество питомцев `pets` в инвентаре.
+        """
+        self._invalidate_derived(user_id, fields, pets)
+        # Внутри пачки рейтинг обновится при ее применении, откат его не затрагивает
+        if self._defer_dirty(user_id, fields, pets):
             return True
-        except Exception as e:
-            print(f"Error saving database: {e}")
+        if fields is None or 'clicks' in fields:
+            # Под блокировкой рейтинга: строящийся рейтинг не пропустит изменение
+            with self._leaderboard_lock:
+                if self._leaderboard is not None:
+                    self._leaderboard.update(str(user_id), self.users[str(user_id)]['clicks'])
+                elif self._leaderboard_changes is not None:
+                    self._leaderboard_changes[str(user_id)] = self.users[str(user_id)]['clicks']
+        if self.save_mode == 'journal':
+            with self._dirty_lock:
+                self._dirty.add(str(user_id))
+            return self._append_journal(str(user_id), op, fields, pets)
+        if self.save_mode != 'write_behind':
+            if getattr(self._op_state, 'depth', 0):
+                # Файл запишется после снятия блокировки пользователя
+                self._op_state.saves.add(str(user_id))
+                return True
+            return self._persist({str(user_id)})
+        with self._dirty_lock:
+            self._dirty.add(str(user_id))
+            dirty = len(self._dirty)
+        if dirty >= SAVE_MAX_DIRTY:
+            self._flush_event.set()
+        return True
+
+    def _defer_dirty(self, user_id: str, fields, pets) -> bool:
+        """Внутри apply_batch изменения копятся и записываются один раз в конце"""
+        pending = getattr(self._batch_state, 'pending', None)
+        if pending is None or pending['user_id'] != str(user_id):
             return False
+        pending['dirty'] = True
+        if fields is None:
+            pending['full'] = True
+        else:
+            pending['fields'].update(fields)
+        pending['pets'].update(pets)
+        return True
+
+    def _defer_earned(self, user_id: str, amount) -> bool:
+        """Внутри apply_batch заработок учитывается в рейтингах за окно, только если пачка применена"""
+        pending = getattr(self._batch_state, 'pending', None)
+        if pending is None or pending['user_id'] != str(user_id):
+            return False
+        pending['earned'] += amount
+        return True
+
+    def flush(self, force: bool = False) -> bool:
+        """Сохранить накопленные изменения, если они есть"""
+        with self._save_lock:
+            self._save_windows()
+            if self.save_mode == 'journal' and not force:
+                # Журнал уже на диске, снимок пересобираем только при его росте
+                if self._journal_records < JOURNAL_COMPACT_RECORDS:
+                    return True
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return True
+            if self.save(dirty):
+                return True
+            # Не удалось сохранить - вернем пользователей в очередь
+            with self._dirty_lock:
+                self._dirty |= dirty
+            return False
+
+    def close(self):
+        """Остановка фонового сохранения с финальной записью"""
+        if self.persister is not None:
+            self.persister.close()
+        self._stop_flusher()
+        with self._save_lock:
+            self.flush(force=True)
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+    def _append_journal(self, user_id: str, op: str, fields, pets) -> bool:
+        """Дописать изменение пользователя в журнал"""
+        user = self.users[user_id]
+        record = {'op': op, 'u': user_id}
+        if fields is None:
+            record['s'] = {key: value for key, value in user.items() if key not in DERIVED_FIELDS}
+        else:
+            record['s'] = {key: user[key] for key in fields}
+        if pets:
+            record['inv'] = {pet: user['inventory'][pet] for pet in pets}
+
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        # Очередь сохраняет порядок изменений одного пользователя, а пишет
+        # ее в файл уже поток без блокировки пользователя
+        with self._journal_lock:
+            self._journal_queue.append(line)
+        if getattr(self._op_state, 'depth', 0):
+            return True
+        return self._persist(set())
+
+    def _write_journal(self) -> bool:
+        """Запись очереди журнала одним вызовом write; записи других
+        потоков, накопленные к этому моменту, уходят вместе с ней"""
+        with self._save_lock:
+            with self._journal_lock:
+                lines, self._journal_queue = self._journal_queue, []
+            if not lines:
+                return True
+            try:
+                if self._journal is None:
+                    self._journal = open(self.journal_filename, 'a', encoding='utf-8')
+                self._journal.write(''.join(lines))
+                self._journal.flush()
+                if JOURNAL_FSYNC:
+                    os.fsync(self._journal.fileno())
+                self._journal_records += len(lines)
+            except Exception as e:
+                print(f"Error writing journal: {e}")
+                return False
+        if self._journal_records >= JOURNAL_COMPACT_RECORDS:
+            self._flush_event.set()
+        return True
+
+    def _replay_journal(self):
+        """Применение журнала поверх загруженного снимка"""
+        if not os.path.exists(self.journal_filename):
+            return
+        applied = 0
+        with open(self.journal_filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Недописанная запись при аварийном завершении
+                    print("Warning: skipping broken journal record")
+                    continue
+                self._apply_journal_record(record)
+                applied += 1
+        self._journal_records = applied
+        print(f"Replayed {applied} journal records")
+
+    def _apply_journal_record(self, record: Dict[str, Any]):
+        """Применение одной записи журнала.
+
+        Записи содержат итоговые значения, а не приращения, поэтому
+        повторное применение уже учтенной в снимке записи ничего не меняет.
+        """
+        user = self.users.setdefault(record['u'], {})
+        user.update(record.get('s', {}))
+        migrate_user(user)
+        for pet, count in record.get('inv', {}).items():
+            # В старых записях питомец указан именем
+            found = pet_id(pet)
+            if found:
+                user['inventory'][found] = count
+
+    def _reset_journal(self):
+        """Очистка журнала после записи снимка.
+
+        Записи из очереди могли не попасть в снимок, поэтому они
+        переносятся в новый журнал (повторное применение безопасно).
+        """
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self.journal_filename, 'w', encoding='utf-8')
+        self._journal_records = 0
+        self._write_journal()
+
+    def _start_flusher(self):
+        """Запуск фонового потока сохранения и хуков завершения процесса"""
+        self._flusher = threading.Thread(target=self._flush_loop, name='database-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+        self._install_signal_handler(signal.SIGTERM)
+
+    def _stop_flusher(self):
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._flusher and self._flusher.is_alive() and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=SAVE_INTERVAL + 5)
+
+    def _flush_loop(self):
+        """Сохранение по интервалу или по числу измененных пользователей"""
+        while not self._stop_event.is_set():
+            self._flush_event.wait(SAVE_INTERVAL)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in background save: {e}")
+
+    def _install_signal_handler(self, signum):
+        """Сохранение данных при SIGTERM с вызовом предыдущего обработчика"""
+        try:
+            previous = signal.getsignal(signum)
+
+            def handler(sig, frame):
+                self.flush()
+                if callable(previous):
+                    previous(sig, frame)
+                elif previous != signal.SIG_IGN:
+                    raise SystemExit(128 + sig)
+
+            signal.signal(signum, handler)
+        except ValueError:
+            # Обработчики сигналов можно ставить только из главного потока
+            pass
 
     def _create_backup(self):
         """Создание резервной копии при проблемах"""
-        if os.path.exists(self.filename):
-            backup_file = f"{self.filename}.backup"
-            shutil.copy2(self.filename, backup_file)
-            print(f"Created backup at {backup_file}")
+        files = [self.filename] + [self._shard_filename(i) for i in range(self.shards)] + self._legacy_files
+        for file in dict.fromkeys(files):
+            if os.path.exists(file):
+                backup_file = f"{file}.backup"
+                shutil.copy2(file, backup_file)
+                print(f"Created backup at {backup_file}")
+        if os.path.exists(self.journal_filename):
+            shutil.copy2(self.journal_filename, f"{self.journal_filename}.backup")
 
+    @_per_user
     def get_user_stats(self, user_id: str) -> Dict[str, Any]:
         """Получение статистики пользователя с актуальными множителями"""
         user_id = str(user_id)
@@ -88,171 +548,324 @@ class Database:
                 'clicks': 0,
                 'click_power': 1,
                 'passive_income': 0,
-                'inventory': [],
-                'equipped_pets': [],
-                'pet_counts': {}
+                'inventory': empty_inventory(),
+                'equipped_pets': empty_slots(),
+                'pet_levels': empty_levels(),
+                'last_save': time.time()
             }
-            self.save()
+            self.mark_dirty(user_id, 'create')
         
         user = self.users[user_id]
         
-        # Пересчитываем множители
-        click_mult, passive_mult = self.calculate_multipliers(user)
+        # Множители берем из кэша, пересчитываются они только после изменений
+        _, passive_mult = self._derived(user_id, user)
+
+        # Начисляем пассивный доход за время с прошлого обращения
+        clicks_before = user['clicks']
+        if self._accrue_passive(user, passive_mult):
+            self._record_earned(user_id, user['clicks'] - clicks_before)
+            self.mark_dirty(user_id, 'passive_income', ('clicks', 'last_save'))
         
-        # Обновляем текущие значения с учетом множителей
+        return user
+
+    @_per_user
+    def peek_user_stats(self, user_id: str):
+        """Копия статистики пользователя с пассивным доходом на текущий момент.
+
+        Ничего не записывает: доход только считается, а начисляется при
+        следующем изменении. None, если пользователя нет.
+        """
+        user_id = str(user_id)
+        user = self.users.get(user_id)
+        if user is None:
+            return None
+        _, passive_mult = self._derived(user_id, user)
+        snapshot = {key: list(value) if isinstance(value, list) else value for key, value in user.items()}
+        self._accrue_passive(snapshot, passive_mult)
+        return snapshot
+
+    def _derived(self, user_id: str, user: Dict) -> tuple:
+        """Множители питомцев и производные поля пользователя.
+
+        Пересчитываются только после _invalidate_derived, а также для
+        пользователя, заново прочитанного из хранилища.
+        """
+        user_id = str(user_id)
+        if user_id in self._derived_valid and 'passive_multiplier' in user:
+            return user['click_multiplier'], user['passive_multiplier']
+
+        click_mult, passive_mult = self.calculate_multipliers(user)
+        user['click_multiplier'] = click_mult
+        user['passive_multiplier'] = passive_mult
         user['current_click_power'] = round(user['click_power'] * click_mult, 1)
         user['current_passive_income'] = round(user['passive_income'] * passive_mult, 1)
         
-        # Обновляем счетчики питомцев
-        pet_counts = {}
-        for pet in user['inventory']:
-            pet_counts[pet] = pet_counts.get(pet, 0) + 1
-        user['pet_counts'] = pet_counts
-        
-        return user
+        # Счетчики питомцев по имени и точные стоимости следующих уровней для клиента
+        user['pet_counts'] = {PETS_BY_ID[pet]['name']: count
+                              for pet, count in enumerate(user['inventory']) if count}
+        user['click_cost'] = CLICK_UPGRADE_COSTS.cost(max(0, user['click_power'] - 1))
+        user['passive_cost'] = PASSIVE_UPGRADE_COSTS.cost(max(0, user['passive_income']))
+        self._derived_valid.add(user_id)
+        return click_mult, passive_mult
 
+    def _invalidate_derived(self, user_id: str, fields=None, pets=()):
+        """Сброс производных полей после изменения питомцев или уровней"""
+        if fields is None or pets or not DERIVED_SOURCES.isdisjoint(fields):
+            self._derived_valid.discard(str(user_id))
+
+    @staticmethod
+    def _accrue_passive(user: Dict, passive_mult: float) -> bool:
+        """Начисление пассивного дохода по времени последнего начисления (last_save).
+
+        Начисляются только целые клики, а last_save сдвигается ровно на
+        оплаченное время, поэтому дробный остаток переходит к следующему
+        обращению. Возвращает True, если пользователь изменился.
+        """
+        now = time.time()
+        last = user.get('last_save')
+        # В старом формате last_save - дата создания в ISO, а доход уже
+        # начислялся каждую секунду: отсчет начинается заново, без начисления
+        if not isinstance(last, (int, float)) or last > now:
+            user['last_save'] = now
+            return True
+
+        rate = user['passive_income'] * passive_mult
+        if rate <= 0:
+            return False
+        income = int((now - last) * rate)
+        if income <= 0:
+            return False
+        user['clicks'] += income
+        user['last_save'] = last + income / rate
+        return True
+
+    @_per_user
     def update_user(self, user_id: str, data: Dict[str, Any]) -> bool:
         """Безопасное обновление данных пользователя"""
         user_id = str(user_id)
         if user_id in self.users:
             self.users[user_id].update(data)
-            return self.save()
+            return self.mark_dirty(user_id, 'update', tuple(data))
         return False
 
-    def click(self, user_id: str) -> Dict[str, Any]:
-        """Обработка клика"""
+    @_per_user
+    def click(self, user_id: str, count: int = 1, seq: int = None) -> Dict[str, Any]:
+        """Обработка клика или пачки из count кликов"""
+        return self.click_batch(user_id, count, seq)[0]
+
+    @_per_user
+    def click_batch(self, user_id: str, count: int = 1, seq: int = None, session: str = None) -> tuple:
+        """Обработка пачки кликов от клиента.
+
+        Пачка с seq не больше последнего принятого считается повтором и
+        игнорируется. Номера пачек у каждой вкладки (session) свои: сервер
+        помнит последний принятый seq CLICK_SESSIONS последних вкладок
+        игрока в click_sessions, без session - общий click_seq.
+        Засчитывается не больше CLICK_MAX_PER_SECOND кликов за время с
+        прошлой пачки и не больше CLICK_MAX_BATCH за раз.
+        Возвращает пользователя и число засчитанных кликов.
+        """
         user = self.get_user_stats(user_id)
-        click_mult, _ = self.calculate_multipliers(user)
-        total_power = round(user['click_power'] * click_mult)
-        user['clicks'] += total_power
-        self.save()
-        return user
+        fields = ('clicks', 'last_click_at')
+        if seq is not None and session is None:
+            if seq <= user.get('click_seq', 0):
+                return user, 0
+            user['click_seq'] = seq
+            fields += ('click_seq',)
+        elif seq is not None:
+            sessions = user.setdefault('click_sessions', {})
+            if seq <= sessions.get(session, 0):
+                return user, 0
+            # Вкладка переносится в конец, при переполнении забывается самая давняя
+            sessions.pop(session, None)
+            sessions[session] = seq
+            while len(sessions) > CLICK_SESSIONS:
+                del sessions[next(iter(sessions))]
+            fields += ('click_sessions',)
 
+        now = time.time()
+        elapsed = now - user.get('last_click_at', 0)
+        allowed = max(1, min(CLICK_MAX_BATCH, math.ceil(elapsed * CLICK_MAX_PER_SECOND)))
+        accepted = max(0, min(count, allowed))
+
+        total_power = round(user['click_power'] * user['click_multiplier'])
+        user['clicks'] += total_power * accepted
+        user['last_click_at'] = now
+        self._record_earned(user_id, total_power * accepted)
+        self.mark_dirty(user_id, 'click', fields)
+        return user, accepted
+
+    @_per_user
     def upgrade_click(self, user_id: str) -> Dict[str, Any]:
         """Улучшение силы клика с автоматическим обновлением множителей"""
-        user = self.get_user_stats(user_id)
-        cost = int(50 * (1.5 ** (user['click_power'] - 1)))
-        
-        if user['clicks'] >= cost:
-            user['clicks'] -= cost
-            user['click_power'] += 1
-            
-            self.save()
-            return user
-        return None
+        result = self.buy_click_levels(user_id, 1)
+        return result['user_stats'] if result else None
 
+    @_per_user
     def upgrade_passive(self, user_id: str) -> Dict[str, Any]:
         """Улучшение пассивного дохода с автоматическим обновлением множителей"""
+        result = self.buy_passive_levels(user_id, 1)
+        return result['user_stats'] if result else None
+
+    @_per_user
+    def buy_click_levels(self, user_id: str, n: int = None) -> Dict[str, Any]:
+        """Покупка n уровней силы клика (все или ни одного), при n=None - сколько хватит кликов"""
         user = self.get_user_stats(user_id)
-        cost = int(100 * (1.5 ** user['passive_income']))
-        
-        if user['clicks'] >= cost:
-            user['clicks'] -= cost
-            user['passive_income'] += 1
-            
-            self.save()
-            return user
-        return None
+        bought, cost = self._buy_levels(CLICK_UPGRADE_COSTS, user['click_power'] - 1, user['clicks'], n)
+        if not bought:
+            return None
+
+        user['clicks'] -= cost
+        user['click_power'] += bought
+        self.mark_dirty(user_id, 'upgrade_click', ('clicks', 'click_power'))
+        self._derived(user_id, user)
+        return {'success': True, 'bought': bought, 'cost': cost, 'user_stats': user}
+
+    @_per_user
+    def buy_passive_levels(self, user_id: str, n: int = None) -> Dict[str, Any]:
+        """Покупка n уровней пассивного дохода (все или ни одного), при n=None - сколько хватит кликов"""
+        user = self.get_user_stats(user_id)
+        bought, cost = self._buy_levels(PASSIVE_UPGRADE_COSTS, user['passive_income'], user['clicks'], n)
+        if not bought:
+            return None
+
+        user['clicks'] -= cost
+        if user['passive_income'] == 0:
+            # Доход начисляется с момента покупки первого уровня
+            user['last_save'] = time.time()
+        user['passive_income'] += bought
+        self.mark_dirty(user_id, 'upgrade_passive', ('clicks', 'passive_income', 'last_save'))
+        self._derived(user_id, user)
+        return {'success': True, 'bought': bought, 'cost': cost, 'user_stats': user}
+
+    @staticmethod
+    def _buy_levels(costs, level: int, budget: int, n: int = None) -> tuple:
+        """Число покупаемых уровней и их суммарная стоимость (0, 0 - покупка невозможна)"""
+        if n is None:
+            n = costs.affordable(level, budget)
+        elif not isinstance(n, int) or n < 1 or n > costs.affordable(level, budget):
+            return 0, 0
+        return n, costs.total(level, n)
 
+    @_per_user
     def open_box(self, user_id: str) -> Dict[str, Any]:
         """Открытие бокса с питомцем"""
-        user = self.get_user_stats(user_id)
-        if user['clicks'] >= 500:
-            user['clicks'] -= 500
-            pet = random.choice(list(PETS.keys()))
-            user['inventory'].append(pet)
-            
-            # Обновляем счетчики питомцев
-            if 'pet_counts' not in user:
-                user['pet_counts'] = {}
-            user['pet_counts'][pet] = user['pet_counts'].get(pet, 0) + 1
-            
-            self.save()
+        result = self.open_boxes(user_id, 1)
+        if result:
             return {
                 'success': True,
-                'pet_info': PETS[pet],
-                'user_stats': user
+                'pet_info': PETS[next(iter(result['pets']))],
+                'user_stats': result['user_stats']
             }
         return None
 
+    @_per_user
+    def open_boxes(self, user_id: str, n: int = 1) -> Dict[str, Any]:
+        """Открытие n боксов за одну операцию: все или ни одного.
+
+        Питомцы выбираются по BOX_CHANCES таблицей псевдонимов.
+        Возвращает количество выпавших питомцев по имени.
+        """
+        if not isinstance(n, int) or n < 1 or n > BOX_MAX_BATCH:
+            return None
+        user = self.get_user_stats(user_id)
+        cost = BOX_COST * n
+        if user['clicks'] < cost:
+            return None
+
+        user['clicks'] -= cost
+        drawn = {}
+        for _ in range(n):
+            pet = BOX_SAMPLER.draw()
+            drawn[pet] = drawn.get(pet, 0) + 1
+        for pet, count in drawn.items():
+            user['inventory'][pet] += count
+        
+        self.mark_dirty(user_id, 'box', ('clicks',), pets=tuple(drawn))
+        self._derived(user_id, user)
+        return {
+            'success': True,
+            'opened': n,
+            'pets': {PETS_BY_ID[pet]['name']: count for pet, count in drawn.items()},
+            'user_stats': user
+        }
+
+    @_per_user
     def equip_pet(self, user_id: str, pet: str) -> Dict[str, Any]:
         """Экипировка питомца с обновлением множителей"""
         user = self.get_user_stats(user_id)
-        if pet in user['inventory'] and len(user['equipped_pets']) < MAX_EQUIPPED_PETS:
-            user['equipped_pets'].append(pet)
+        pet = pet_id(pet)
+        slots = user['equipped_pets']
+        if pet and user['inventory'][pet] > slots.count(pet) and 0 in slots:
+            slots[slots.index(0)] = pet
             
             # Пересчитываем множители сразу после экипировки
-            click_mult, passive_mult = self.calculate_multipliers(user)
-            user['current_click_power'] = round(user['click_power'] * click_mult, 1)
-            user['current_passive_income'] = round(user['passive_income'] * passive_mult, 1)
-            
-            self.save()
+            self.mark_dirty(user_id, 'equip', ('equipped_pets',))
+            self._derived(user_id, user)
             return user
         return None
 
+    @_per_user
     def equip_all_same(self, user_id: str, pet: str) -> Dict[str, Any]:
         """Экипировка всех одинаковых питомцев"""
         user = self.get_user_stats(user_id)
+        pet = pet_id(pet)
+        slots = user['equipped_pets']
+        if not pet:
+            return None
         
         # Сколько можно экипировать
-        available_slots = MAX_EQUIPPED_PETS - len(user['equipped_pets'])
+        available_slots = slots.count(0)
         if available_slots <= 0:
             return None
             
         # Сколько неэкипированных питомцев этого типа
-        total_count = user['inventory'].count(pet)
-        equipped_count = user['equipped_pets'].count(pet)
-        unequipped_count = total_count - equipped_count
+        unequipped_count = user['inventory'][pet] - slots.count(pet)
         
         # Экипируем максимально возможное количество
         to_equip = min(available_slots, unequipped_count)
         
         if to_equip > 0:
             for _ in range(to_equip):
-                user['equipped_pets'].append(pet)
-            self.save()
+                slots[slots.index(0)] = pet
+            self.mark_dirty(user_id, 'equip', ('equipped_pets',))
+            self._derived(user_id, user)
             return user
         return None
 
+    @_per_user
     def delete_pet(self, user_id: str, pet: str) -> Dict[str, Any]:
         """Удаление питомца из инвентаря"""
         user = self.get_user_stats(user_id)
-        if pet in user['inventory']:
+        pet = pet_id(pet)
+        if pet and user['inventory'][pet] > 0:
             # Если питомец экипирован, сначала снимаем его
-            if pet in user['equipped_pets']:
-                user['equipped_pets'].remove(pet)
+            slots = user['equipped_pets']
+            if pet in slots:
+                slots[slots.index(pet)] = 0
             
             # Удаляем из инвентаря
-            user['inventory'].remove(pet)
+            user['inventory'][pet] -= 1
             
             # Обновляем множители
-            click_mult, passive_mult = self.calculate_multipliers(user)
-            user['current_click_power'] = round(user['click_power'] * click_mult)
-            user['current_passive_income'] = round(user['passive_income'] * passive_mult)
-            
-            self.save()
+            self.mark_dirty(user_id, 'delete_pet', ('equipped_pets',), pets=(pet,))
+            self._derived(user_id, user)
             return user
         return None
 
+    @_per_user
     def passive_income(self, user_id: str) -> Dict[str, Any]:
-        """Начисление пассивного дохода с множителями"""
+        """Статистика с начисленным пассивным доходом.
+
+        Доход начисляется при любом обращении к пользователю
+        (get_user_stats), метод оставлен для совместимости со старыми клиентами.
+        """
         user = self.get_user_stats(user_id)
-        _, passive_mult = self.calculate_multipliers(user)
-        
         if user['passive_income'] > 0:
-            # Применяем множитель к пассивному доходу
-            income = round(user['passive_income'] * passive_mult)
-            user['clicks'] += income
-            
-            # Обновляем текущие значения
-            click_mult, _ = self.calculate_multipliers(user)
-            user['current_click_power'] = round(user['click_power'] * click_mult)
-            user['current_passive_income'] = income
-            
-            self.save()
             return user
         return None
 
+    @_per_user
     def create_user(self, user_id):
         str_id = str(user_id)
         if str_id not in self.users:
@@ -260,14 +873,138 @@ class Database:
                 'clicks': 0,
                 'click_power': 1,
                 'passive_income': 0,
-                'inventory': [],
-                'equipped_pets': [],
-                'pet_levels': {},
-                'last_save': datetime.now().isoformat()
+                'inventory': empty_inventory(),
+                'equipped_pets': empty_slots(),
+                'pet_levels': empty_levels(),
+                'achievements': {
+                    'clicks_made': 0,
+                    'boxes_opened': 0,
+                    'pets_collected': 0
+                },
+                'last_save': time.time()
             }
-            self.save()
+            self.mark_dirty(str_id, 'create')
         return self.users[str_id]
 
+    def _stripe_of(self, user_id: str) -> int:
+        return zlib.crc32(str(user_id).encode('utf-8')) % len(self._user_locks)
+
+    @contextmanager
+    def _user_operation(self, user_id: str):
+        """Изменение одного пользователя под его блокировкой.
+
+        Изменения других пользователей идут параллельно. Запись файла
+        (режим 'sync') и журнала ('journal') выполняется после снятия
+        блокировки, чтобы сохранение не ждало изменяющие потоки и наоборот.
+        """
+        depth = getattr(self._op_state, 'depth', 0)
+        if not depth:
+            self._op_state.saves = set()
+        with self._user_locks[self._stripe_of(user_id)]:
+            self._op_state.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._op_state.depth = depth
+        if not depth:
+            self._persist(self._op_state.saves)
+
+    def _persist(self, user_ids) -> bool:
+        """Запись изменений после операции: файл пользователей user_ids в
+        режиме 'sync' и очередь журнала в режиме 'journal'. Если задан
+        persister, запись выполняет его поток, а вызывающий не ждет диска."""
+        if not user_ids and not self._journal_queue:
+            return True
+        if self.persister is not None:
+            return self.persister.submit(user_ids)
+        return self._persist_now(user_ids)
+
+    def _persist_now(self, user_ids) -> bool:
+        saved = self.save(user_ids) if user_ids else True
+        if self._journal_queue:
+            saved = self._write_journal() and saved
+        return saved
+
+    @contextmanager
+    def _operation(self):
+        """Выполнение изменений сразу многих пользователей: берутся все
+        блокировки пользователей (после _save_lock, как и при сохранении)"""
+        with ExitStack() as stack:
+            for lock in self._user_locks:
+                stack.enter_context(lock)
+            yield
+
+    def apply_batch(self, user_id: str, actions: list) -> Dict[str, Any]:
+        """Применение списка действий одного пользователя с одной записью на диск.
+
+        Каждое действие - словарь {'action': имя из BATCH_ACTIONS, ...параметры}.
+        Неизвестное действие, неверный или недостающий параметр - ValueError
+        до применения любого из действий. Ошибка при выполнении действия
+        откатывает всю пачку и тоже дает ValueError. Возвращает результат
+        каждого действия и итоговую статистику пользователя.
+        """
+        user_id = str(user_id)
+        for action in actions:
+            if not isinstance(action, dict) or action.get('action') not in BATCH_ACTIONS:
+                raise ValueError(f"Unknown action: {action}")
+            for param in BATCH_ACTIONS[action['action']][1]:
+                value = action.get(param)
+                if value is None:
+                    if param in BATCH_REQUIRED_PARAMS:
+                        raise ValueError(f"Missing {param} for {action['action']}")
+                elif not isinstance(value, BATCH_PARAM_TYPES[param]) or isinstance(value, bool):
+                    raise ValueError(f"Invalid {param} for {action['action']}")
+
+        results = []
+        with self._user_operation(user_id):
+            user = self.get_user_stats(user_id)
+            # Копия для отката: пачка применяется целиком или не применяется
+            backup = copy.deepcopy(user)
+            self._batch_state.pending = {'user_id': user_id, 'dirty': False, 'full': False,
+                                         'fields': set(), 'pets': set(), 'earned': 0}
+            try:
+                for action in actions:
+                    method, params, error = BATCH_ACTIONS[action['action']]
+                    kwargs = {param: action[param] for param in params if action.get(param) is not None}
+                    result = getattr(self, method)(user_id, **kwargs)
+                    results.append(self._batch_result(action['action'], result, error))
+            except Exception as e:
+                self._batch_state.pending = None
+                user.clear()
+                user.update(backup)
+                self._invalidate_derived(user_id)
+                print(f"Batch for {user_id} rolled back: {e!r}")
+                raise ValueError(f"Batch failed: {e}") from e
+            pending = self._batch_state.pending
+            self._batch_state.pending = None
+            self._record_earned(user_id, pending['earned'])
+            if pending['dirty']:
+                fields = None if pending['full'] else tuple(pending['fields'])
+                self.mark_dirty(user_id, 'batch', fields, tuple(pending['pets']))
+            user = self.get_user_stats(user_id)
+
+        return {'results': results, 'user_stats': user}
+
+    @staticmethod
+    def _batch_result(name: str, result, error: str) -> Dict[str, Any]:
+        """Результат одного действия пачки"""
+        if name == 'click':
+            return {'action': name, 'success': True, 'accepted': result[1]}
+        if not result or 'error' in result:
+            return {'action': name, 'success': False, 'error': (result or {}).get('error', error)}
+        entry = {'action': name, 'success': True}
+        if 'pet_info' in result:
+            entry['pet_info'] = result['pet_info']
+        if 'pets' in result:
+            entry['pets'] = result['pets']
+        if 'new_level' in result:
+            entry['new_level'] = result['new_level']
+        return entry
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Счетчики кэша пользователей (пусто, если кэш не используется)"""
+        return {}
+
     def get_achievements(self, user_id):
         user = self.get_user_stats(user_id)
         return user.get('achievements', {})
@@ -280,80 +1017,272 @@ class Database:
                 backups.append(file)
         return sorted(backups, reverse=True)
 
+    def bulk_update(self, changes: Dict[str, tuple], user_ids=None) -> int:
+        """Изменение полей всех игроков (или user_ids) за один проход
+        с одним сохранением; формат changes - в bulk_ops. Возвращает
+        число измененных игроков."""
+        with self._save_lock, self._operation():
+            if user_ids is None:
+                targets = list(self.users)
+            else:
+                targets = [str(user_id) for user_id in user_ids if str(user_id) in self.users]
+            if 'passive_income' in changes:
+                self._settle_passive((user_id, self.users[user_id]) for user_id in targets)
+            for user_id in targets:
+                user = self.users[user_id]
+                for field, (op, value) in changes.items():
+                    user[field] = apply_value(user.get(field, 0), op, value)
+            self._reset_leaderboard()
+            self._derived_valid.clear()
+            self.save(None if user_ids is None else targets)
+        return len(targets)
+
+    def _settle_passive(self, users):
+        """Начисление пассивного дохода по прежней ставке перед массовым
+        изменением passive_income, чтобы время с last_save не оплачивалось
+        по новой. У игроков без дохода отсчет начинается с текущего момента."""
+        now = time.time()
+        for user_id, user in users:
+            _, passive_mult = self.calculate_multipliers(user)
+            clicks_before = user['clicks']
+            self._accrue_passive(user, passive_mult)
+            if user['passive_income'] * passive_mult <= 0:
+                user['last_save'] = now
+            self._record_earned(user_id, user['clicks'] - clicks_before)
+
+    def bulk_rederive(self) -> int:
+        """Пересчет множителей питомцев у игроков в памяти, например после
+        pets.set_pet_multipliers; остальные пересчитаются при чтении"""
+        self._derived_valid.clear()
+        users = self.users.resident() if isinstance(self.users, LazyUsers) else list(self.users.items())
+        for user_id, user in users:
+            self._derived(user_id, user)
+        return len(users)
+
     def restore_from_backup(self, backup_name):
         """Восстановить данные из бэкапа"""
         try:
             with open(backup_name, 'r') as f:
-                self.users = json.load(f)
-            self.save()
+                users = json.load(f)
+            for user in users.values():
+                migrate_user(user)
+            with self._save_lock, self._operation():
+                self.users = users
+                self._reset_leaderboard()
+                self._derived_valid.clear()
+                self.save()
             return True
         except:
             return False
 
-    def get_leaderboard(self, limit=50):
-        """Получаем топ игроков по кликам"""
+    def _get_leaderboard_index(self) -> Leaderboard:
+        """Рейтинг строится один раз при первом обращении, дальше его
+        обновляет mark_dirty при каждом изменении кликов.
+
+        Построение идет без блокировки рейтинга, чтобы клики не ждали
+        обхода всех игроков: изменения, пришедшие за это время, mark_dirty
+        копит в _leaderboard_changes, и они применяются к готовому рейтингу.
+        """
+        leaderboard = self._leaderboard
+        if leaderboard is not None:
+            return leaderboard
+        with self._leaderboard_build_lock:
+            while True:
+                with self._leaderboard_lock:
+                    if self._leaderboard is not None:
+                        return self._leaderboard
+                    changes = self._leaderboard_changes = {}
+                leaderboard = Leaderboard(self._leaderboard_players())
+                with self._leaderboard_lock:
+                    # Рейтинг сбросили (массовое изменение) - строим заново
+                    if self._leaderboard_changes is changes:
+                        for user_id, clicks in changes.items():
+                            leaderboard.update(user_id, clicks)
+                        self._leaderboard_changes = None
+                        self._leaderboard = leaderboard
+                        return leaderboard
+
+    def _leaderboard_players(self):
+        """Пары (user_id, клики) всех игроков для построения рейтинга"""
+        if isinstance(self.users, LazyUsers):
+            # Клики берем из индекса снимка, не читая самих пользователей
+            return [(user_id, self.users.clicks(user_id)) for user_id in self.users]
+        return [(user_id, data['clicks']) for user_id, data in list(self.users.items())]
+
+    def _reset_leaderboard(self):
+        """Рейтинг построится заново при следующем обращении"""
+        with self._leaderboard_lock:
+            self._leaderboard = None
+            self._leaderboard_changes = None
+
+    def get_leaderboard(self, limit=50, offset=0):
+        """Получаем игроков по кликам с места offset + 1"""
         players = []
-        for user_id, data in self.users.items():
+        for user_id, clicks in self._get_leaderboard_index().page(offset, limit):
+            data = self.users[user_id]
             players.append({
                 'user_id': user_id,
-                'clicks': data['clicks'],
-                'pets_count': len(data['equipped_pets']),
+                'clicks': clicks,
+                'pets_count': equipped_count(data['equipped_pets']),
                 'click_power': data['click_power']
             })
-        
-        # Сортируем по количеству кликов
-        sorted_players = sorted(players, key=lambda x: x['clicks'], reverse=True)
-        
-        return sorted_players[:limit]
+        return players
+
+    def _load_windows(self) -> WindowedLeaderboard:
+        """Корзины заработка из earned_dir или из общего файла earned_filename прежней версии"""
+        buckets = {}
+        legacy = False
+        try:
+            if os.path.isdir(self.earned_dir):
+                for name in os.listdir(self.earned_dir):
+                    if not name.endswith('.json'):
+                        continue
+                    with open(os.path.join(self.earned_dir, name), 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if data.get('bucket_seconds') == EARNED_BUCKET_SECONDS:
+                        buckets[name[:-len('.json')]] = data['earned']
+            elif os.path.exists(self.earned_filename):
+                with open(self.earned_filename, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('bucket_seconds') == EARNED_BUCKET_SECONDS:
+                    buckets = data['buckets']
+                legacy = True
+        except Exception as e:
+            print(f"Error loading earned clicks: {e}")
+        windows = WindowedLeaderboard(LEADERBOARD_WINDOWS, EARNED_BUCKET_SECONDS, buckets)
+        if legacy:
+            windows.mark_all_changed()
+        return windows
+
+    def _save_windows(self):
+        """Запись измененных корзин заработка и удаление вышедших из окон"""
+        windows = getattr(self, '_windows', None)
+        if windows is None or not windows.changed:
+            return
+        changed, removed = windows.take_changes()
+        os.makedirs(self.earned_dir, exist_ok=True)
+        for bucket, earned in changed.items():
+            filename = os.path.join(self.earned_dir, f"{bucket}.json")
+            with open(f"{filename}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({'bucket_seconds': EARNED_BUCKET_SECONDS, 'earned': earned}, f,
+                          ensure_ascii=False, separators=(',', ':'))
+            os.replace(f"{filename}.tmp", filename)
+        for bucket in removed:
+            try:
+                os.remove(os.path.join(self.earned_dir, f"{bucket}.json"))
+            except FileNotFoundError:
+                pass
+        if os.path.exists(self.earned_filename):
+            os.remove(self.earned_filename)
+
+    def _record_earned(self, user_id: str, amount):
+        """Учет заработанных кликов для рейтингов за сутки и неделю"""
+        if amount > 0 and not self._defer_earned(user_id, amount):
+            self._windows.add(str(user_id), amount)
+
+    def get_window_leaderboard(self, window: str, limit=50, offset=0):
+        """Игроки по кликам, заработанным за окно window, с места offset + 1"""
+        return [{'user_id': user_id, 'earned': earned}
+                for user_id, earned in self._windows.page(window, offset, limit)]
+
+    def get_window_rank(self, window: str, user_id: str):
+        """Место игрока в рейтинге за окно window или None"""
+        found = self._windows.rank(window, str(user_id))
+        if found is None:
+            return None
+        rank, earned = found
+        total = self._windows.count(window)
+        return {
+            'user_id': str(user_id),
+            'rank': rank,
+            'total': total,
+            'earned': earned,
+            'percentile': round(100 * (total - rank) / total, 2)
+        }
+
+    def leaderboard_size(self, window: str = 'all') -> int:
+        """Число игроков в рейтинге: всех или заработавших за окно window"""
+        if window == 'all':
+            return len(self._get_leaderboard_index())
+        return self._windows.count(window)
+
+    def count_ahead(self, window: str, score, user_id: str) -> int:
+        """Сколько игроков в рейтинге window стоят выше результата score
+        игрока user_id; игрок может быть в другой базе (cluster.py)"""
+        if window == 'all':
+            return self._get_leaderboard_index().count_ahead(score, str(user_id))
+        return self._windows.count_ahead(window, score, str(user_id))
 
+    def get_rank(self, user_id: str):
+        """Место игрока в рейтинге или None, если игрока нет"""
+        leaderboard = self._get_leaderboard_index()
+        rank = leaderboard.rank(str(user_id))
+        if rank is None:
+            return None
+        total = len(leaderboard)
+        return {
+            'user_id': str(user_id),
+            'rank': rank,
+            'total': total,
+            'clicks': self.users[str(user_id)]['clicks'],
+            # Доля игроков, которых обогнал пользователь
+            'percentile': round(100 * (total - rank) / total, 2)
+        }
+
+    @_per_user
     def upgrade_pet(self, user_id: str, pet: str) -> Dict[str, Any]:
         """Улучшение питомца"""
         user = self.get_user_stats(user_id)
-        if pet not in user['inventory']:
+        pet = pet_id(pet)
+        if not pet or user['inventory'][pet] == 0:
             return None
             
-        current_level = user['pet_levels'].get(pet, 1)
-        if current_level >= PETS[pet]['max_level']:
+        levels = user['pet_levels']
+        current_level = levels[pet]
+        upgrade_cost = PET_UPGRADE_COSTS[pet * PET_LEVEL_STRIDE + current_level]
+        if not upgrade_cost:
             return {'error': 'Достигнут максимальный уровень'}
             
-        upgrade_cost = PETS[pet]['upgrade_cost'] * current_level
         if user['clicks'] < upgrade_cost:
             return {'error': 'Недостаточно кликов'}
             
         user['clicks'] -= upgrade_cost
-        user['pet_levels'][pet] = current_level + 1
-        self.save()
+        levels[pet] = current_level + 1
+        self.mark_dirty(user_id, 'upgrade_pet', ('clicks', 'pet_levels'))
+        self._derived(user_id, user)
         
         return {
             'success': True,
             'new_level': current_level + 1,
+            'cost': upgrade_cost,
             'user_stats': user
         }
 
+    @_per_user
     def unequip_pet(self, user_id: str, pet: str) -> Dict[str, Any]:
         """Снятие питомца с обновлением множителей"""
         user = self.get_user_stats(user_id)
-        if pet in user['equipped_pets']:
-            user['equipped_pets'].remove(pet)
+        pet = pet_id(pet)
+        slots = user['equipped_pets']
+        if pet and pet in slots:
+            slots[slots.index(pet)] = 0
             
             # Пересчитываем множители сразу после снятия
-            click_mult, passive_mult = self.calculate_multipliers(user)
-            user['current_click_power'] = round(user['click_power'] * click_mult, 1)
-            user['current_passive_income'] = round(user['passive_income'] * passive_mult, 1)
-            
-            self.save()
+            self.mark_dirty(user_id, 'unequip', ('equipped_pets',))
+            self._derived(user_id, user)
             return user
         return None
 
     def calculate_multipliers(self, user: Dict) -> tuple:
-        """Расчет множителей от питомцев"""
+        """Расчет множителей от питомцев с учетом их уровней"""
         click_multiplier = 1.0
         passive_multiplier = 1.0
+        levels = user['pet_levels']
         
-        if 'equipped_pets' in user:
-            for pet in user['equipped_pets']:
-                if pet in PETS:
-                    click_multiplier *= PETS[pet]['click_multiplier']
-                    passive_multiplier *= PETS[pet]['passive_multiplier']
+        for pet in user.get('equipped_pets', ()):
+            if pet:
+                index = pet * PET_LEVEL_STRIDE + levels[pet]
+                click_multiplier *= PET_CLICK_MULTIPLIERS[index]
+                passive_multiplier *= PET_PASSIVE_MULTIPLIERS[index]
         
         return click_multiplier, passive_multiplier 
\ No newline at end of file
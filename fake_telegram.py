@@ -0,0 +1,254 @@
+"""Заменитель сервера Telegram Bot API для локальной проверки бота.
+
+Запуск: python fake_telegram.py [обновлений] [игроков]
+
+Сервер слушает 127.0.0.1:8081 и отвечает на методы, которые вызывает
+бот (getMe, setWebhook, deleteWebhook, getUpdates, sendMessage и т.д.).
+Бот запускается отдельно с TELEGRAM_API_URL=http://127.0.0.1:8081, в
+режиме вебхука (BOT_MODE=webhook, WEBHOOK_URL=http://127.0.0.1:5000)
+или опроса. Дождавшись бота, сервер присылает заданное число команд
+/click от разных игроков так же, как Telegram: на вебхук не больше
+max_connections запросов сразу, иначе - через getUpdates. После ответов
+на все команды печатается пропускная способность.
+
+python fake_telegram.py serve - только отвечать на запросы бота, например
+при проверке рассылки (broadcast.py). Как и Telegram, сервер отвечает 429
+с retry_after, если бот отправляет больше SEND_LIMIT сообщений в секунду
+или больше одного в секунду одному чату, и 403 на отправку игрокам с
+user_id, кратным BLOCKED_EVERY (они "заблокировали бота").
+"""
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, Any
+from aiohttp import web, ClientSession, ClientError
+
+HOST = '127.0.0.1'
+PORT = 8081
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Clicker', 'username': 'clicker_test_bot'}
+
+# Ограничения отправки в режиме serve
+SEND_LIMIT = 30
+BLOCKED_EVERY = 97
+
+
+class TooManyRequests(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+
+class Forbidden(Exception):
+    pass
+
+
+class FakeTelegram:
+    """Состояние сервера: вебхук, очередь для опроса и отправленные сообщения"""
+
+    def __init__(self):
+        self.webhook = None
+        self.updates = []
+        self.update_id = 0
+        self.sent = []
+        self._new_updates = asyncio.Condition()
+        self._sent_changed = asyncio.Condition()
+        # Бот готов принимать обновления: установил вебхук или начал опрос
+        self.ready = asyncio.Event()
+        self.session = None
+        # Ограничения отправки включаются в режиме serve
+        self.limits = False
+        self._sends = []
+        self._last_send = {}
+        self.rejected = 0
+
+    async def api(self, request: web.Request) -> web.Response:
+        """POST /bot<токен>/<метод>: параметры приходят формой, сложные - в JSON"""
+        params = dict(await request.post())
+        params.update(request.query)
+        method = getattr(self, f"method_{request.match_info['method']}", None)
+        if method is None:
+            return web.json_response({'ok': True, 'result': True})
+        try:
+            result = await method(params)
+        except ValueError as e:
+            return web.json_response({'ok': False, 'error_code': 409, 'description': f"Conflict: {e}"}, status=409)
+        except TooManyRequests as e:
+            return web.json_response({'ok': False, 'error_code': 429,
+                                      'description': f"Too Many Requests: retry after {e.retry_after}",
+                                      'parameters': {'retry_after': e.retry_after}}, status=429)
+        except Forbidden as e:
+            return web.json_response({'ok': False, 'error_code': 403, 'description': f"Forbidden: {e}"}, status=403)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def method_getMe(self, params):
+        return BOT_USER
+
+    async def method_setWebhook(self, params):
+        self.webhook = {
+            'url': params['url'],
+            'secret_token': params.get('secret_token', ''),
+            'max_connections': int(params.get('max_connections', 40)),
+            'slots': asyncio.Semaphore(int(params.get('max_connections', 40)))
+        }
+        print(f"Webhook set: {params['url']}")
+        self.ready.set()
+        # Накопленные для опроса обновления теперь доставляются на вебхук
+        pending, self.updates = self.updates, []
+        for update in pending:
+            asyncio.create_task(self._post(update))
+        return True
+
+    async def method_deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    async def method_getWebhookInfo(self, params):
+        hook = self.webhook or {}
+        return {'url': hook.get('url', ''), 'has_custom_certificate': False, 'pending_update_count': len(self.updates),
+                'max_connections': hook.get('max_connections')}
+
+    async def method_getUpdates(self, params):
+        if self.webhook:
+            raise ValueError("can't use getUpdates method while webhook is active")
+        self.ready.set()
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            async with self._new_updates:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self.updates[:int(params.get('limit', 100))]
+
+    def _check_limits(self, chat_id: int):
+        """Ограничения Telegram: SEND_LIMIT сообщений за секунду и одно в секунду одному чату"""
+        now = time.monotonic()
+        self._sends = [sent_at for sent_at in self._sends if now - sent_at < 1]
+        if len(self._sends) >= SEND_LIMIT or now - self._last_send.get(chat_id, -1) < 1:
+            self.rejected += 1
+            raise TooManyRequests(1)
+        if chat_id % BLOCKED_EVERY == 0:
+            raise Forbidden("bot was blocked by the user")
+        self._sends.append(now)
+        self._last_send[chat_id] = now
+
+    async def method_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        if self.limits:
+            self._check_limits(chat_id)
+        message = {
+            'message_id': len(self.sent) + 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', '')
+        }
+        async with self._sent_changed:
+            self.sent.append(message)
+            self._sent_changed.notify_all()
+        return message
+
+    def command(self, user_id: int, text: str) -> Dict[str, Any]:
+        """Обновление с сообщением text от игрока user_id"""
+        self.update_id += 1
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"Player {user_id}"}
+        return {
+            'update_id': self.update_id,
+            'message': {
+                'message_id': self.update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': user,
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            }
+        }
+
+    async def deliver(self, update: Dict[str, Any]):
+        """Доставка обновления боту: на вебхук или в очередь getUpdates"""
+        if self.webhook:
+            await self._post(update)
+            return
+        async with self._new_updates:
+            self.updates.append(update)
+            self._new_updates.notify_all()
+
+    async def _post(self, update: Dict[str, Any]):
+        """Запрос на вебхук; как и Telegram, повторяем при ошибке"""
+        hook = self.webhook
+        async with hook['slots']:
+            while True:
+                try:
+                    async with self.session.post(hook['url'], json=update,
+                                                 headers={'X-Telegram-Bot-Api-Secret-Token': hook['secret_token']}) as response:
+                        if response.status == 200:
+                            return
+                        print(f"Webhook answered {response.status} to update {update['update_id']}")
+                except ClientError as e:
+                    print(f"Webhook error for update {update['update_id']}: {e}")
+                await asyncio.sleep(1)
+
+    async def wait_sent(self, count: int):
+        async with self._sent_changed:
+            await self._sent_changed.wait_for(lambda: len(self.sent) >= count)
+
+
+async def serve():
+    """Только ответы на запросы бота, с ограничениями отправки"""
+    telegram = FakeTelegram()
+    telegram.limits = True
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', telegram.api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    print(f"Fake Telegram listening on http://{HOST}:{PORT} with send limits")
+    try:
+        while True:
+            sent = len(telegram.sent)
+            await asyncio.sleep(5)
+            if len(telegram.sent) != sent:
+                chats = len({message['chat']['id'] for message in telegram.sent})
+                print(f"Sent {len(telegram.sent)} messages to {chats} chats, rejected {telegram.rejected} with 429")
+    finally:
+        await runner.cleanup()
+
+
+async def run(updates: int, players: int):
+    telegram = FakeTelegram()
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', telegram.api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    print(f"Fake Telegram listening on http://{HOST}:{PORT}, waiting for the bot")
+    telegram.session = ClientSession()
+    try:
+        await telegram.ready.wait()
+        mode = 'webhook' if telegram.webhook else 'polling'
+
+        sent_before = len(telegram.sent)
+        start = time.perf_counter()
+        await asyncio.gather(*(telegram.deliver(telegram.command(100000 + i % players, '/click'))
+                               for i in range(updates)))
+        await telegram.wait_sent(sent_before + updates)
+        seconds = time.perf_counter() - start
+        print(f"{updates} updates from {players} players answered in {seconds:.2f}s "
+              f"({updates / seconds:.0f} updates/s, {mode})")
+        last = {}
+        for message in telegram.sent:
+            last[message['chat']['id']] = message['text']
+        print("Sample reply:", json.dumps(next(iter(last.values()), ''), ensure_ascii=False))
+    finally:
+        await telegram.session.close()
+        await runner.cleanup()
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['serve']:
+    asyncio.run(serve())
+elif __name__ == '__main__':
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+                    int(sys.argv[2]) if len(sys.argv) > 2 else 50))
@@ -1,5 +1,6 @@
 from aiogram.types import WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
 from config import WEBAPP_URL
+from pets import PETS_BY_ID
 
 def get_webapp_keyboard():
     """Создает клавиатуру с кнопкой для открытия веб-приложения"""
@@ -12,14 +13,17 @@ def get_webapp_keyboard():
     return keyboard
 
 def get_inventory_keyboard(inventory, equipped_pets):
-    """Создает клавиатуру для инвентаря питомцев"""
+    """Создает клавиатуру для инвентаря питомцев.
+
+    inventory - количество питомцев по id, equipped_pets - id питомцев в слотах
+    """
     keyboard = []
-    for i, pet_type in enumerate(set(inventory), 1):
-        count = inventory.count(pet_type)
-        status = "🟢" if pet_type in equipped_pets else "⚪"
+    owned = [pet for pet, count in enumerate(inventory) if count]
+    for i, pet in enumerate(owned, 1):
+        status = "🟢" if pet in equipped_pets else "⚪"
         keyboard.append([
             InlineKeyboardButton(
-                text=f"{status} {i}. {pets[pet_type]['name']} (x{count})",
+                text=f"{status} {i}. {PETS_BY_ID[pet]['name']} (x{inventory[pet]})",
                 callback_data=f"equip_{i-1}"
             )
         ])
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+import threading
+from json.decoder import WHITESPACE
+from typing import Dict
+
+# Версия формата индекса: при несовпадении индекс строится заново
+INDEX_VERSION = 2
+
+
+def index_filename(filename: str) -> str:
+    return f"{filename}.idx"
+
+
+def build_index(filename: str) -> Dict[str, tuple]:
+    """Смещения значений верхнего уровня JSON-объекта:
+    user_id -> (начало, длина в байтах, клики).
+
+    Файл читается как latin-1, чтобы позиция символа совпадала с позицией
+    байта: все служебные символы JSON однобайтовые, а байты многобайтовых
+    символов UTF-8 не совпадают с ними.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    text = data.decode('latin-1')
+    decoder = json.JSONDecoder()
+    offsets = {}
+
+    pos = WHITESPACE.match(text, 0).end()
+    if text[pos:pos + 1] != '{':
+        raise ValueError(f"{filename} is not a JSON object")
+    pos = WHITESPACE.match(text, pos + 1).end()
+    if text[pos:pos + 1] == '}':
+        return offsets
+
+    while True:
+        key_start = pos
+        _, pos = decoder.raw_decode(text, pos)
+        user_id = json.loads(data[key_start:pos].decode('utf-8'))
+        pos = WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] != ':':
+            raise ValueError(f"Expected ':' at byte {pos} of {filename}")
+        start = WHITESPACE.match(text, pos + 1).end()
+        user, pos = decoder.raw_decode(text, start)
+        offsets[user_id] = (start, pos - start, user.get('clicks', 0))
+        pos = WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] == ',':
+            pos = WHITESPACE.match(text, pos + 1).end()
+        elif text[pos:pos + 1] == '}':
+            return offsets
+        else:
+            raise ValueError(f"Expected ',' or '}}' at byte {pos} of {filename}")
+
+
+def write_index(filename: str, offsets: Dict[str, tuple]):
+    """Запись индекса рядом с файлом снимка"""
+    stat = os.stat(filename)
+    index = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'offsets': offsets}
+    temp_file = f"{index_filename(filename)}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_file, index_filename(filename))
+
+
+def load_index(filename: str) -> Dict[str, tuple]:
+    """Индекс файла снимка: готовый, если он актуален, иначе построенный заново"""
+    try:
+        with open(index_filename(filename), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        stat = os.stat(filename)
+        if (index.get('version') == INDEX_VERSION and index['size'] == stat.st_size
+                and index['mtime_ns'] == stat.st_mtime_ns):
+            return index['offsets']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    offsets = build_index(filename)
+    write_index(filename, offsets)
+    print(f"Built index for {len(offsets)} users in {filename}")
+    return offsets
+
+
+class LazyUsers:
+    """Словарь пользователей, которые читаются из файла снимка при первом обращении.
+
+    `offsets` хранит для каждого пользователя файл, диапазон байтов его
+    записи и клики на момент записи (для построения рейтинга без разбора
+    JSON). Незагруженные пользователи при сохранении копируются из старого
+    файла без разбора JSON. `on_load` вызывается для каждого прочитанного
+    пользователя, например для перевода старого формата записи.
+    """
+
+    def __init__(self, offsets: Dict[str, tuple] = None, on_load=None):
+        self._offsets = offsets or {}
+        self._loaded = {}
+        self._on_load = on_load
+        self._lock = threading.Lock()
+
+    def __getitem__(self, user_id):
+        user = self._loaded.get(user_id)
+        if user is not None:
+            return user
+        with self._lock:
+            # Файл открывается под блокировкой, чтобы replace не подменил его
+            # между чтением смещения и открытием
+            if user_id not in self._offsets:
+                raise KeyError(user_id)
+            filename, start, length = self._offsets[user_id][:3]
+            f = open(filename, 'rb')
+        with f:
+            f.seek(start)
+            user = json.loads(f.read(length).decode('utf-8'))
+        if self._on_load:
+            self._on_load(user)
+        # Если другой поток прочитал пользователя раньше, возвращаем его объект
+        return self._loaded.setdefault(user_id, user)
+
+    def __setitem__(self, user_id, user):
+        self._loaded[user_id] = user
+
+    def __delitem__(self, user_id):
+        found = self._loaded.pop(user_id, None) is not None
+        found = self._offsets.pop(user_id, None) is not None or found
+        if not found:
+            raise KeyError(user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self._loaded or user_id in self._offsets
+
+    def __iter__(self):
+        # Копии ключей: словари могут пополняться из других потоков
+        yield from list(self._offsets)
+        for user_id in list(self._loaded):
+            if user_id not in self._offsets:
+                yield user_id
+
+    def __len__(self):
+        return len(self._offsets) + sum(1 for user_id in list(self._loaded) if user_id not in self._offsets)
+
+    def get(self, user_id, default=None):
+        try:
+            return self[user_id]
+        except KeyError:
+            return default
+
+    def setdefault(self, user_id, default=None):
+        if user_id not in self:
+            self[user_id] = default
+        return self[user_id]
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return (self[user_id] for user_id in self)
+
+    def items(self):
+        return ((user_id, self[user_id]) for user_id in self)
+
+    @property
+    def loaded_count(self) -> int:
+        return len(self._loaded)
+
+    def resident(self) -> list:
+        """Уже прочитанные пользователи: пары (user_id, пользователь)"""
+        return list(self._loaded.items())
+
+    def clicks(self, user_id) -> int:
+        """Клики пользователя без чтения его записи из файла"""
+        user = self._loaded.get(user_id)
+        if user is not None:
+            return user.get('clicks', 0)
+        return self._offsets[user_id][3]
+
+    def raw_values(self, user_ids, encode=None):
+        """Тройки (user_id, JSON в байтах, клики) для записи снимка.
+
+        `encode(user_id, user)` возвращает JSON и клики прочитанного пользователя.
+        """
+        handles = {}
+        try:
+            for user_id in user_ids:
+                user = self._loaded.get(user_id)
+                if user is not None:
+                    if encode:
+                        yield (user_id,) + encode(user_id, user)
+                    else:
+                        yield user_id, json.dumps(user, ensure_ascii=False).encode('utf-8'), user.get('clicks', 0)
+                    continue
+                filename, start, length, clicks = self._offsets[user_id]
+                if filename not in handles:
+                    handles[filename] = open(filename, 'rb')
+                handles[filename].seek(start)
+                yield user_id, handles[filename].read(length), clicks
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def relocate(self, filename: str, offsets: Dict[str, tuple]):
+        """Новые смещения после записи файла снимка"""
+        for user_id, (start, length, clicks) in offsets.items():
+            self._offsets[user_id] = (filename, start, length, clicks)
+
+    def replace(self, temp_file: str, filename: str, offsets: Dict[str, tuple]):
+        """Замена файла снимка новым и переход на его смещения одним шагом
+        для потоков, читающих пользователей"""
+        with self._lock:
+            shutil.move(temp_file, filename)
+            self.relocate(filename, offsets)
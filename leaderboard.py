@@ -0,0 +1,334 @@
+import random
+import threading
+import time
+from typing import Dict
+
+MAX_LEVEL = 16
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next = [None] * level
+        # width[i] - на сколько позиций в списке ведет ссылка next[i]
+        self.width = [1] * level
+
+
+class RankedSkipList:
+    """Упорядоченный список с вставкой, удалением, поиском позиции
+    ключа и ключа по позиции за O(log n) в среднем.
+
+    Пустая ссылка считается ведущей на позицию после последнего элемента.
+    """
+
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    @classmethod
+    def from_sorted(cls, keys) -> 'RankedSkipList':
+        """Построение за O(n) из уже отсортированных ключей"""
+        skiplist = cls()
+        last = [skiplist.head] * MAX_LEVEL
+        last_position = [0] * MAX_LEVEL
+        for position, key in enumerate(keys, 1):
+            level = cls._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].next[i] = node
+                last[i].width[i] = position - last_position[i]
+                last[i] = node
+                last_position[i] = position
+            skiplist.level = max(skiplist.level, level)
+            skiplist.size = position
+        for i in range(skiplist.level):
+            last[i].width[i] = skiplist.size + 1 - last_position[i]
+        return skiplist
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.25:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [None] * MAX_LEVEL
+        rank = [0] * MAX_LEVEL
+        node = self.head
+        position = 0
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+            update[i] = node
+            rank[i] = position
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                update[i] = self.head
+                rank[i] = 0
+                self.head.width[i] = self.size + 1
+            self.level = level
+
+        new = _Node(key, level)
+        for i in range(level):
+            new.next[i] = update[i].next[i]
+            update[i].next[i] = new
+            new.width[i] = update[i].width[i] - (rank[0] - rank[i])
+            update[i].width[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        update = [None] * MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(self.level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        self.size -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+
+    def index(self, key) -> int:
+        """Позиция ключа (с нуля)"""
+        node = self.head
+        position = 0
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+        if node.next[0] is None or node.next[0].key != key:
+            raise KeyError(key)
+        return position
+
+    def bisect(self, key) -> int:
+        """Сколько ключей меньше key (ключ может отсутствовать в списке)"""
+        node = self.head
+        position = 0
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+        return position
+
+    def slice(self, offset: int, limit: int) -> list:
+        """Ключи с позиции offset, не больше limit штук"""
+        if offset < 0 or offset >= self.size or limit <= 0:
+            return []
+        node = self.head
+        position = 0
+        target = offset + 1
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and position + node.width[i] <= target:
+                position += node.width[i]
+                node = node.next[i]
+
+        keys = []
+        while node is not None and len(keys) < limit:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """Рейтинг игроков по кликам, обновляемый при каждом изменении кликов.
+
+    При равенстве кликов выше стоит меньший user_id.
+    """
+
+    def __init__(self, players=()):
+        self._lock = threading.Lock()
+        self._keys = {user_id: (-clicks, user_id) for user_id, clicks in players}
+        self._list = RankedSkipList.from_sorted(sorted(self._keys.values()))
+
+    def __len__(self):
+        return len(self._list)
+
+    def update(self, user_id: str, clicks):
+        key = (-clicks, user_id)
+        with self._lock:
+            old = self._keys.get(user_id)
+            if old == key:
+                return
+            if old is not None:
+                self._list.remove(old)
+            self._list.insert(key)
+            self._keys[user_id] = key
+
+    def remove(self, user_id: str):
+        with self._lock:
+            old = self._keys.pop(user_id, None)
+            if old is not None:
+                self._list.remove(old)
+
+    def page(self, offset: int = 0, limit: int = 50) -> list:
+        """Пары (user_id, clicks) с места offset + 1"""
+        with self._lock:
+            return [(user_id, -clicks) for clicks, user_id in self._list.slice(offset, limit)]
+
+    def rank(self, user_id: str):
+        """Место игрока (с единицы) или None, если его нет в рейтинге"""
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is None:
+                return None
+            return self._list.index(key) + 1
+
+    def count_ahead(self, clicks, user_id: str) -> int:
+        """Сколько игроков стоят выше игрока с clicks кликами, даже если его нет в рейтинге"""
+        with self._lock:
+            return self._list.bisect((-clicks, user_id))
+
+
+class WindowedLeaderboard:
+    """Рейтинги по заработанным кликам за скользящие окна (сутки, неделя).
+
+    Заработанное копится в корзинах по bucket_seconds секунд. Для каждого
+    окна хранится сумма игрока по корзинам внутри окна и рейтинг по ней;
+    когда корзина выходит из окна, ее суммы вычитаются. Корзины старше
+    самого длинного окна удаляются.
+    """
+
+    def __init__(self, windows: Dict[str, int], bucket_seconds: int = 3600, buckets=None, now: float = None):
+        self.bucket_seconds = bucket_seconds
+        # Длина окна в корзинах
+        self.windows = {name: max(1, seconds // bucket_seconds) for name, seconds in windows.items()}
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._current = self._bucket(time.time() if now is None else now)
+        self._starts = {name: self._current - size + 1 for name, size in self.windows.items()}
+        self._totals = {name: {} for name in self.windows}
+        # Корзины, измененные и удаленные с последнего take_changes
+        self._changed_buckets = set()
+        self._removed_buckets = set()
+
+        for bucket, earned in (buckets or {}).items():
+            bucket = int(bucket)
+            if bucket < min(self._starts.values()) or bucket > self._current:
+                continue
+            self._buckets[bucket] = dict(earned)
+            for name, start in self._starts.items():
+                if bucket >= start:
+                    totals = self._totals[name]
+                    for user_id, amount in earned.items():
+                        totals[user_id] = totals.get(user_id, 0) + amount
+        self._boards = {name: Leaderboard(totals.items()) for name, totals in self._totals.items()}
+
+    def _bucket(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    def _add_total(self, name: str, user_id: str, amount):
+        totals = self._totals[name]
+        total = totals.get(user_id, 0) + amount
+        if total > 0:
+            totals[user_id] = total
+            self._boards[name].update(user_id, total)
+        else:
+            totals.pop(user_id, None)
+            self._boards[name].remove(user_id)
+
+    def _advance(self, now: float):
+        """Вычитание корзин, которые вышли из окон к моменту now"""
+        bucket = self._bucket(now)
+        if bucket <= self._current:
+            return
+        self._current = bucket
+        for name, size in self.windows.items():
+            start = bucket - size + 1
+            for old in sorted(b for b in self._buckets if self._starts[name] <= b < start):
+                for user_id, amount in self._buckets[old].items():
+                    self._add_total(name, user_id, -amount)
+            self._starts[name] = start
+        oldest = min(self._starts.values())
+        for old in [b for b in self._buckets if b < oldest]:
+            del self._buckets[old]
+            self._changed_buckets.discard(old)
+            self._removed_buckets.add(old)
+
+    def add(self, user_id: str, amount, now: float = None):
+        """Учесть заработанные игроком клики"""
+        if amount <= 0:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._advance(now)
+            # Запоздавшее начисление попадает только в окна, которые его еще включают
+            bucket = min(self._bucket(now), self._current)
+            earned = self._buckets.setdefault(bucket, {})
+            earned[user_id] = earned.get(user_id, 0) + amount
+            for name, start in self._starts.items():
+                if bucket >= start:
+                    self._add_total(name, user_id, amount)
+            self._changed_buckets.add(bucket)
+
+    def remove(self, user_id: str):
+        with self._lock:
+            for bucket, earned in self._buckets.items():
+                if earned.pop(user_id, None) is not None:
+                    self._changed_buckets.add(bucket)
+            for name in self.windows:
+                self._totals[name].pop(user_id, None)
+                self._boards[name].remove(user_id)
+
+    def count(self, window: str, now: float = None) -> int:
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            return len(self._boards[window])
+
+    def page(self, window: str, offset: int = 0, limit: int = 50, now: float = None) -> list:
+        """Пары (user_id, заработано за окно) с места offset + 1"""
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            return self._boards[window].page(offset, limit)
+
+    def rank(self, window: str, user_id: str, now: float = None):
+        """Место игрока в окне и его заработок или None, если он ничего не заработал"""
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            rank = self._boards[window].rank(user_id)
+            if rank is None:
+                return None
+            return rank, self._totals[window][user_id]
+
+    def count_ahead(self, window: str, earned, user_id: str, now: float = None) -> int:
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            return self._boards[window].count_ahead(earned, user_id)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self._changed_buckets or self._removed_buckets)
+
+    def mark_all_changed(self):
+        """Все корзины будут записаны при следующем сохранении"""
+        with self._lock:
+            self._changed_buckets = set(self._buckets)
+
+    def take_changes(self) -> tuple:
+        """Копии корзин, измененных с прошлого вызова, и номера удаленных корзин"""
+        with self._lock:
+            changed = {bucket: dict(self._buckets[bucket]) for bucket in self._changed_buckets}
+            removed = sorted(self._removed_buckets)
+            self._changed_buckets = set()
+            self._removed_buckets = set()
+            return changed, removed
@@ -1,81 +1,46 @@
 import asyncio
-import json
-import random
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 import os
 from dotenv import load_dotenv
 from keyboards import get_webapp_keyboard
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-from database import Database
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from database import open_database
+from async_database import AsyncDatabase
+from config import (BOX_COST, BOX_MAX_BATCH, MAX_EQUIPPED_PETS, RARITY_COLORS, ADMIN_IDS, CLUSTER_ROUTER_URL,
+                    TELEGRAM_API_URL)
+from bulk_ops import run_command
+from broadcast import Broadcaster
+import api
+import aiohttp
+from pets import PETS, PETS_BY_ID, PET_LEVEL_STRIDE, PET_CLICK_MULTIPLIERS, equipped_count
 
 load_dotenv()
 
-bot = Bot(token=os.getenv('BOT_TOKEN'))
+# TELEGRAM_API_URL - свой сервер Bot API или fake_telegram.py для локальной проверки
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=os.getenv('BOT_TOKEN'), session=session)
 dp = Dispatcher()
-db = Database()
+db = open_database()
+# Обработчики ждут только изменения в памяти, запись на диск идет в отдельном потоке
+adb = AsyncDatabase(db)
+# Рассылки идут в фоне и продолжаются после перезапуска бота
+broadcaster = Broadcaster(bot)
 
-# Загрузка данных пользователей
-try:
-    with open('users.json', 'r') as f:
-        users = json.load(f)
-except FileNotFoundError:
-    users = {}
+@dp.startup()
+async def on_startup():
+    broadcaster.start()
 
-# Питомцы и их характеристики
-pets = {
-    'cat': {'name': 'Кот', 'click_power': 2, 'passive_income': 1, 'rarity': 'common'},
-    'dog': {'name': 'Собака', 'click_power': 3, 'passive_income': 2, 'rarity': 'common'},
-    'dragon': {'name': 'Дракон', 'click_power': 5, 'passive_income': 3, 'rarity': 'rare'},
-    'unicorn': {'name': 'Единорог', 'click_power': 7, 'passive_income': 4, 'rarity': 'rare'},
-    'phoenix': {'name': 'Феникс', 'click_power': 10, 'passive_income': 5, 'rarity': 'epic'}
-}
-
-# Шансы выпадения питомцев из боксов
-box_chances = {
-    'common': 0.7,
-    'rare': 0.25,
-    'epic': 0.05
-}
-
-BOX_COST = 500
-
-# Константы для питомцев
-PETS = {
-    'Котенок': {'name': 'Котенок', 'click_power': 1, 'rarity': 'Обычный'},
-    'Щенок': {'name': 'Щенок', 'click_power': 1, 'rarity': 'Обычный'},
-    'Хомяк': {'name': 'Хомяк', 'click_power': 2, 'rarity': 'Редкий'},
-    'Попугай': {'name': 'Попугай', 'click_power': 2, 'rarity': 'Редкий'},
-    'Единорог': {'name': 'Единорог', 'click_power': 3, 'rarity': 'Эпический'},
-    'Дракон': {'name': 'Дракон', 'click_power': 5, 'rarity': 'Легендарный'}
-}
-
-def save_users():
-    with open('users.json', 'w') as f:
-        json.dump(users, f)
-
-def create_user(user_id):
-    """Создает нового пользователя, если его нет в базе"""
-    if str(user_id) not in db.users:
-        db.users[str(user_id)] = {
-            'clicks': 0,
-            'click_power': 1,
-            'passive_income': 0,
-            'equipped_pets': [],
-            'inventory': [],
-            'achievements': {
-                'clicks_made': 0,
-                'boxes_opened': 0,
-                'pets_collected': 0
-            },
-            'last_save': None
-        }
-        db.save()
+@dp.shutdown()
+async def on_shutdown():
+    await broadcaster.stop()
 
 @dp.message(Command('start'))
 async def cmd_start(message: types.Message):
     user_id = str(message.from_user.id)
-    create_user(user_id)
+    await adb.create_user(user_id)
     
     # Добавляем user_id в URL
     webapp_url = f"{os.getenv('WEBAPP_URL')}?user_id={user_id}"
@@ -108,128 +73,153 @@ async def cmd_help(message: types.Message):
         "Команды:\n"
         "/start - Начать игру\n"
         "/help - Показать эту справку\n"
-        "/stats - Показать статистику"
+        "/stats - Показать статистику\n"
+        "/top - Топ-10 игроков (/top day, /top week - за сутки и неделю)\n"
+        "/rank - Ваше место в рейтинге\n"
+        "/petup N - Улучшить питомца номер N из инвентаря"
     )
     await message.answer(help_text)
 
 @dp.message(Command('click'))
 async def cmd_click(message: types.Message):
     user_id = str(message.from_user.id)
-    create_user(user_id)
-    
-    # Подсчет силы клика с учетом питомцев
-    click_power = users[user_id]['click_power']
-    for pet_type in users[user_id]['equipped_pets']:
-        click_power += pets[pet_type]['click_power']
+    await adb.create_user(user_id)
     
-    users[user_id]['clicks'] += click_power
-    save_users()
+    # Сила клика с учетом питомцев
+    user, accepted = await adb.click_batch(user_id)
+    click_power = round(user['click_power'] * user['click_multiplier']) * accepted
     
-    await message.answer(f"Клик! +{click_power}\nВсего: {users[user_id]['clicks']} кликов")
+    await message.answer(f"Клик! +{click_power}\nВсего: {user['clicks']} кликов")
 
 @dp.message(Command('box'))
 async def cmd_box(message: types.Message):
     user_id = str(message.from_user.id)
-    create_user(user_id)
+    await adb.create_user(user_id)
     
-    if users[user_id]['clicks'] < BOX_COST:
-        await message.answer(f"Недостаточно кликов! Нужно {BOX_COST}")
+    # /box N - открыть сразу N боксов
+    args = message.text.split()
+    try:
+        n = int(args[1]) if len(args) > 1 else 1
+    except ValueError:
+        n = 0
+    if n < 1 or n > BOX_MAX_BATCH:
+        await message.answer(f"Используйте: /box [количество от 1 до {BOX_MAX_BATCH}]")
         return
     
-    users[user_id]['clicks'] -= BOX_COST
-    
-    # Определяем редкость питомца
-    rarity = random.choices(
-        list(box_chances.keys()),
-        list(box_chances.values())
-    )[0]
-    
-    # Выбираем случайного питомца этой редкости
-    possible_pets = [pet_type for pet_type, pet in pets.items() if pet['rarity'] == rarity]
-    pet_type = random.choice(possible_pets)
+    result = await adb.open_boxes(user_id, n)
+    if not result:
+        await message.answer(f"Недостаточно кликов! Нужно {BOX_COST * n}")
+        return
     
-    # Добавляем питомца в инвентарь
-    users[user_id]['inventory'].append(pet_type)
-    save_users()
+    if n > 1:
+        text = f"🎉 Открыто боксов: {n}\n\n"
+        for name, count in sorted(result['pets'].items(), key=lambda item: PETS[item[0]]['id']):
+            text += f"{RARITY_COLORS[PETS[name]['tier']]} {name} x{count}\n"
+        await message.answer(text)
+        return
     
+    pet = PETS[next(iter(result['pets']))]
     await message.answer(
-        f"🎉 Вы получили питомца: {pets[pet_type]['name']}!\n"
-        f"Редкость: {rarity}\n"
-        f"Клик: +{pets[pet_type]['click_power']}\n"
-        f"Пассив: +{pets[pet_type]['passive_income']}"
+        f"🎉 Вы получили питомца: {pet['name']}!\n"
+        f"Редкость: {RARITY_COLORS[pet['tier']]} {pet['rarity']}\n"
+        f"Клик: x{pet['click_multiplier']}\n"
+        f"Пассив: x{pet['passive_multiplier']}"
     )
 
+def owned_pets(user) -> list:
+    """id питомцев игрока в порядке каталога - по ним нумеруется инвентарь"""
+    return [pet for pet, count in enumerate(user['inventory']) if count]
+
 @dp.message(Command('inventory'))
 async def cmd_inventory(message: types.Message):
     user_id = message.from_user.id
-    user = db.get_user_stats(user_id)
+    user = await adb.get_user_stats(user_id)
     
-    if not user or not user.get('inventory'):
+    if not user or not any(user['inventory']):
         await message.answer("У вас пока нет питомцев!")
         return
     
     pets_text = "Ваши питомцы:\n"
-    for pet in user['inventory']:
-        pet_info = pets[pet]
-        pets_text += f"• {pet_info['name']} (Сила: +{pet_info['click_power']})\n"
+    for i, pet in enumerate(owned_pets(user), 1):
+        index = pet * PET_LEVEL_STRIDE + user['pet_levels'][pet]
+        pets_text += (f"{i}. {PETS_BY_ID[pet]['name']} x{user['inventory'][pet]} "
+                      f"(ур. {user['pet_levels'][pet]}, клик: x{PET_CLICK_MULTIPLIERS[index]})\n")
     
     await message.answer(pets_text)
 
 @dp.message(Command('equip'))
 async def cmd_equip(message: types.Message):
     user_id = str(message.from_user.id)
-    create_user(user_id)
+    await adb.create_user(user_id)
+    user = await adb.get_user_stats(user_id)
     
     try:
         pet_index = int(message.text.split()[1]) - 1
-        available_pets = list(set(users[user_id]['inventory']))
-        pet_type = available_pets[pet_index]
+        pet = owned_pets(user)[pet_index]
     except:
         await message.answer("Используйте: /equip [номер питомца из инвентаря]")
         return
     
-    if len(users[user_id]['equipped_pets']) >= 2:
-        await message.answer("Уже экипировано максимальное количество питомцев (2)!")
+    if equipped_count(user['equipped_pets']) >= MAX_EQUIPPED_PETS:
+        await message.answer(f"Уже экипировано максимальное количество питомцев ({MAX_EQUIPPED_PETS})!")
         return
     
-    if pet_type in users[user_id]['equipped_pets']:
-        await message.answer(f"{pets[pet_type]['name']} уже экипирован!")
+    if not await adb.equip_pet(user_id, pet):
+        await message.answer(f"Все {PETS_BY_ID[pet]['name']} уже экипированы!")
         return
     
-    users[user_id]['equipped_pets'].append(pet_type)
-    save_users()
-    
-    await message.answer(f"Вы экипировали {pets[pet_type]['name']}!")
+    await message.answer(f"Вы экипировали {PETS_BY_ID[pet]['name']}!")
 
 @dp.message(Command('unequip'))
 async def cmd_unequip(message: types.Message):
     user_id = str(message.from_user.id)
-    create_user(user_id)
+    await adb.create_user(user_id)
+    user = await adb.get_user_stats(user_id)
     
     try:
         pet_index = int(message.text.split()[1]) - 1
-        pet_type = users[user_id]['equipped_pets'][pet_index]
+        pet = [pet for pet in user['equipped_pets'] if pet][pet_index]
     except:
         await message.answer("Используйте: /unequip [номер экипированного питомца]")
         return
     
-    users[user_id]['equipped_pets'].remove(pet_type)
-    save_users()
+    await adb.unequip_pet(user_id, pet)
+    
+    await message.answer(f"Вы сняли {PETS_BY_ID[pet]['name']}!")
+
+@dp.message(Command('petup'))
+async def cmd_petup(message: types.Message):
+    user_id = str(message.from_user.id)
+    await adb.create_user(user_id)
+    user = await adb.get_user_stats(user_id)
+    
+    try:
+        pet_index = int(message.text.split()[1]) - 1
+        pet = owned_pets(user)[pet_index]
+    except:
+        await message.answer("Используйте: /petup [номер питомца из инвентаря]")
+        return
+    
+    result = await adb.upgrade_pet(user_id, pet)
+    if not result or 'error' in result:
+        await message.answer((result or {}).get('error', "Не удалось улучшить питомца"))
+        return
     
-    await message.answer(f"Вы сняли {pets[pet_type]['name']}!")
+    await message.answer(f"{PETS_BY_ID[pet]['name']} теперь {result['new_level']} уровня! "
+                         f"Потрачено {result['cost']} кликов")
 
 @dp.message(Command('stats'))
 async def cmd_stats(message: types.Message):
     user_id = str(message.from_user.id)
-    if user_id in db.users:
-        user = db.users[user_id]
+    user = await adb.run(db.users.get, user_id)
+    if user:
         stats_text = (
             "📊 Ваша статистика:\n\n"
             f"💰 Клики: {user['clicks']}\n"
             f"💪 Сила клика: {user['click_power']}\n"
             f"⚡️ Пассивный доход: {user['passive_income']}/сек\n"
-            f"🐾 Питомцев: {len(user['inventory'])}\n"
-            f"👥 Экипировано: {len(user['equipped_pets'])}\n\n"
+            f"🐾 Питомцев: {sum(user['inventory'])}\n"
+            f"👥 Экипировано: {equipped_count(user['equipped_pets'])}\n\n"
             f"🏆 Достижения:\n"
             f"👆 Всего кликов: {user['achievements']['clicks_made']}\n"
             f"📦 Боксов открыто: {user['achievements']['boxes_opened']}\n"
@@ -239,19 +229,49 @@ async def cmd_stats(message: types.Message):
     else:
         await message.answer("❌ Вы еще не начали игру! Используйте /start")
 
+TOP_TITLES = {
+    'all': 'Топ-10 игроков',
+    'day': 'Топ-10 за сутки',
+    'week': 'Топ-10 за неделю'
+}
+
+async def fetch_leaderboard(window: str = 'all', limit: int = 10, user_id: str = None) -> dict:
+    """Рейтинг в формате /api/leaderboard: из своей базы или, в кластере
+    (cluster.py), общий для всех воркеров через маршрутизатор"""
+    params = {'window': window, 'limit': limit}
+    if user_id:
+        params['user_id'] = user_id
+    if not CLUSTER_ROUTER_URL:
+        # Первое построение рейтинга обходит всех игроков - не в цикле событий
+        result, _ = await asyncio.to_thread(api.leaderboard, db, params)
+        return result
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{CLUSTER_ROUTER_URL}/api/leaderboard", params=params) as response:
+            return await response.json()
+
 @dp.message(Command('top'))
 async def cmd_top(message: types.Message):
-    leaderboard = db.get_leaderboard(limit=10)  # Получаем топ-10 игроков
+    # /top day и /top week - по кликам, заработанным за сутки или неделю
+    args = message.text.split()
+    window = args[1] if len(args) > 1 else 'all'
+    if window not in TOP_TITLES:
+        await message.answer("Используйте /top, /top day или /top week")
+        return
+
+    leaderboard = (await fetch_leaderboard(window, limit=10))['players']  # Получаем топ-10 игроков
     
     if not leaderboard:
         await message.answer("Пока никто не играл! Будьте первым! 🎮")
         return
     
-    text = "🏆 Топ-10 игроков:\n\n"
+    text = f"🏆 {TOP_TITLES[window]}:\n\n"
     for i, player in enumerate(leaderboard, 1):
         # Добавляем эмодзи для первых трех мест
         medal = {1: '🥇', 2: '🥈', 3: '🥉'}.get(i, '•')
         
+        if window != 'all':
+            text += f"{medal} {i}. ID: {player['user_id']}\n   📈 Заработано: {player['earned']}\n\n"
+            continue
         text += (
             f"{medal} {i}. ID: {player['user_id']}\n"
             f"   💰 Баланс: {player['clicks']}\n"
@@ -261,18 +281,74 @@ async def cmd_top(message: types.Message):
     
     await message.answer(text)
 
-# Пассивный доход
-async def passive_income():
-    while True:
-        for user_id in users:
-            passive = users[user_id]['passive_income']
-            for pet_type in users[user_id]['equipped_pets']:
-                passive += pets[pet_type]['passive_income']
-            users[user_id]['clicks'] += passive
-        save_users()
-        await asyncio.sleep(1)
+@dp.message(Command('rank'))
+async def cmd_rank(message: types.Message):
+    rank = (await fetch_leaderboard(limit=1, user_id=str(message.from_user.id)))['me']
+    if rank is None:
+        await message.answer("❌ Вы еще не начали игру! Используйте /start")
+        return
+
+    await message.answer(
+        f"🏆 Ваше место: {rank['rank']} из {rank['total']}\n"
+        f"💰 Баланс: {rank['clicks']}\n"
+        f"📈 Вы обогнали {rank['percentile']}% игроков"
+    )
+
+@dp.message(Command('bulk'))
+async def cmd_bulk(message: types.Message):
+    """Массовые операции для админов: /bulk grant 1000, /bulk adjust passive_income 100, /bulk reset"""
+    if str(message.from_user.id) not in ADMIN_IDS:
+        return
+    
+    try:
+        # Операция над всеми игроками не должна останавливать обработку сообщений
+        result = await asyncio.to_thread(run_command, db, message.text.split()[1:])
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    await message.answer(f"✅ {result['changes']}: {result['users']} игроков за {result['seconds'] * 1000:.1f} мс")
+
+@dp.message(Command('broadcast'))
+async def cmd_broadcast(message: types.Message):
+    """Рассылка всем игрокам для админов: /broadcast текст"""
+    if str(message.from_user.id) not in ADMIN_IDS:
+        return
+    
+    if CLUSTER_ROUTER_URL:
+        # Воркер кластера видит только свою часть игроков
+        await message.answer("❌ Рассылка недоступна в режиме кластера")
+        return
+    
+    text = message.text.partition(' ')[2].strip()
+    if not text:
+        await message.answer("❌ Укажите текст: /broadcast текст")
+        return
+    
+    broadcast = await broadcaster.create(db, text)
+    await message.answer(f"📨 Рассылка {broadcast.id} поставлена в очередь: {len(broadcast.recipients)} игроков")
+
+@dp.message(Command('broadcast_status'))
+async def cmd_broadcast_status(message: types.Message):
+    if str(message.from_user.id) not in ADMIN_IDS:
+        return
+    
+    status = await broadcaster.status()
+    if not status:
+        await message.answer("Рассылок еще не было")
+        return
+    
+    await message.answer(
+        f"📨 Рассылка {status['id']}\n"
+        f"✅ Отправлено: {status['sent']} из {status['recipients']}\n"
+        f"⏳ Осталось: {status['pending']}\n"
+        f"🚫 Заблокировали бота: {status['blocked']}\n"
+        f"❌ Ошибки: {status['failed']}"
+    )
 
 async def main():
+    # Опрос не работает, пока установлен вебхук (BOT_MODE=webhook в server.py)
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+import json
+import os
+import random
+from typing import Dict, Any
+from config import PET_CATALOG, MAX_EQUIPPED_PETS, BOX_CHANCES, PET_LEVEL_BONUS
+
+# Питомцы по имени - в API и командах бота питомец передается именем
+PETS = {pet['name']: pet for pet in PET_CATALOG}
+
+# Питомцы по id; нулевой элемент не используется
+PETS_BY_ID = [None] * (max(pet['id'] for pet in PET_CATALOG) + 1)
+for _pet in PET_CATALOG:
+    PETS_BY_ID[_pet['id']] = _pet
+
+# Длина списка счетчиков инвентаря: inventory[id] - сколько у игрока питомцев с этим id
+INVENTORY_SIZE = len(PETS_BY_ID)
+
+# Таблицы по уровням питомцев: значение для питомца pet на уровне level
+# лежит в элементе pet * PET_LEVEL_STRIDE + level
+PET_LEVEL_STRIDE = max(pet['max_level'] for pet in PET_CATALOG) + 1
+
+
+def level_multiplier(base: float, level: int) -> float:
+    """Множитель питомца на уровне level: каждый уровень добавляет
+    PET_LEVEL_BONUS от бонуса первого уровня"""
+    return round(1 + (base - 1) * (1 + PET_LEVEL_BONUS * (level - 1)), 4)
+
+
+def _level_table(value) -> list:
+    table = [1.0] * (INVENTORY_SIZE * PET_LEVEL_STRIDE)
+    for pet in PET_CATALOG:
+        for level in range(1, pet['max_level'] + 1):
+            table[pet['id'] * PET_LEVEL_STRIDE + level] = value(pet, level)
+    return table
+
+
+PET_CLICK_MULTIPLIERS = _level_table(lambda pet, level: level_multiplier(pet['click_multiplier'], level))
+PET_PASSIVE_MULTIPLIERS = _level_table(lambda pet, level: level_multiplier(pet['passive_multiplier'], level))
+# Стоимость улучшения с уровня level на следующий; 0 - улучшать некуда
+PET_UPGRADE_COSTS = _level_table(
+    lambda pet, level: pet['upgrade_cost'] * level if level < pet['max_level'] else 0)
+
+
+# Множители, измененные командой rebalance (bulk_ops.py): config.py не меняется,
+# а каждый процесс при запуске читает их из этого файла
+PET_OVERRIDES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pet_overrides.json')
+
+
+def set_pet_multipliers(pet: int, click_multiplier: float, passive_multiplier: float, save: bool = True):
+    """Изменение множителей питомца; при save - с записью в PET_OVERRIDES_FILE.
+
+    Таблицы обновляются на месте, поэтому импортированные ссылки на них
+    остаются верными; пересчитать множители игроков - Database.bulk_rederive.
+    """
+    if save:
+        overrides = _read_overrides()
+        overrides[str(pet)] = [click_multiplier, passive_multiplier]
+        os.makedirs(os.path.dirname(PET_OVERRIDES_FILE), exist_ok=True)
+        temp_file = f"{PET_OVERRIDES_FILE}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(overrides, f)
+        os.replace(temp_file, PET_OVERRIDES_FILE)
+    info = PETS_BY_ID[pet]
+    info['click_multiplier'] = click_multiplier
+    info['passive_multiplier'] = passive_multiplier
+    for level in range(1, info['max_level'] + 1):
+        PET_CLICK_MULTIPLIERS[pet * PET_LEVEL_STRIDE + level] = level_multiplier(click_multiplier, level)
+        PET_PASSIVE_MULTIPLIERS[pet * PET_LEVEL_STRIDE + level] = level_multiplier(passive_multiplier, level)
+
+
+def _read_overrides() -> Dict[str, list]:
+    try:
+        with open(PET_OVERRIDES_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_pet_overrides():
+    """Применение сохраненных множителей питомцев"""
+    try:
+        overrides = _read_overrides()
+    except (OSError, ValueError) as e:
+        print(f"Error loading pet overrides: {e}")
+        return
+    for pet, (click_multiplier, passive_multiplier) in overrides.items():
+        pet = int(pet)
+        if 0 < pet < len(PETS_BY_ID) and PETS_BY_ID[pet]:
+            set_pet_multipliers(pet, click_multiplier, passive_multiplier, save=False)
+
+
+load_pet_overrides()
+
+
+class AliasSampler:
+    """Выбор элемента с заданными весами за O(1) (метод псевдонимов Уолкера - Воуза).
+
+    Таблица строится один раз за O(n): в каждой ячейке лежит элемент,
+    вероятность оставить его и элемент-псевдоним на оставшуюся долю.
+    """
+
+    def __init__(self, weights: Dict[Any, float]):
+        items = [item for item, weight in weights.items() if weight > 0]
+        if not items:
+            raise ValueError("No items with positive weight")
+        total = sum(weights[item] for item in items)
+        size = len(items)
+        scaled = [weights[item] * size / total for item in items]
+        self.items = items
+        self.prob = [1.0] * size
+        self.alias = list(range(size))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Остатки из-за погрешности округления считаются полными ячейками
+
+    def draw(self, rng=random):
+        column = rng.randrange(len(self.items))
+        if rng.random() < self.prob[column]:
+            return self.items[column]
+        return self.items[self.alias[column]]
+
+
+def _box_weights() -> Dict[int, float]:
+    """Шанс каждого питомца: шанс его редкости поровну между питомцами редкости"""
+    tiers = {}
+    for pet in PET_CATALOG:
+        tiers.setdefault(pet['tier'], []).append(pet['id'])
+    return {pet: BOX_CHANCES.get(tier, 0) / len(pets) for tier, pets in tiers.items() for pet in pets}
+
+
+# Выпадение питомцев из бокса: id питомца по BOX_CHANCES
+BOX_SAMPLER = AliasSampler(_box_weights())
+
+
+def pet_id(pet) -> int:
+    """id питомца по имени или id (в том числе строкой); None, если такого нет"""
+    if isinstance(pet, str):
+        if pet in PETS:
+            return PETS[pet]['id']
+        if not pet.isdigit():
+            return None
+        pet = int(pet)
+    if isinstance(pet, int) and not isinstance(pet, bool) and 0 < pet < INVENTORY_SIZE and PETS_BY_ID[pet]:
+        return pet
+    return None
+
+
+def empty_inventory() -> list:
+    return [0] * INVENTORY_SIZE
+
+
+def empty_slots() -> list:
+    """Слоты экипировки: id питомца или 0 для пустого слота"""
+    return [0] * MAX_EQUIPPED_PETS
+
+
+def empty_levels() -> list:
+    """Уровни питомцев: pet_levels[id] - уровень питомца с этим id"""
+    return [1] * INVENTORY_SIZE
+
+
+def equipped_count(slots: list) -> int:
+    return sum(1 for pet in slots if pet)
+
+
+def migrate_user(user: Dict[str, Any]) -> bool:
+    """Перевод питомцев пользователя из списков имен в счетчики и слоты по id.
+
+    Вызывается для каждого пользователя, прочитанного из хранилища.
+    Возвращает True, если пользователь изменился.
+    """
+    changed = False
+    inventory = user.get('inventory')
+    if not isinstance(inventory, list) or not inventory or any(not isinstance(count, int) for count in inventory):
+        # Старый формат: список имен, по одному элементу на питомца
+        counts = empty_inventory()
+        for pet in inventory or ():
+            found = pet_id(pet)
+            if found:
+                counts[found] += 1
+        user['inventory'] = counts
+        changed = True
+    elif len(inventory) < INVENTORY_SIZE:
+        # В каталоге появились новые питомцы
+        inventory.extend([0] * (INVENTORY_SIZE - len(inventory)))
+        changed = True
+
+    slots = user.get('equipped_pets')
+    if not isinstance(slots, list) or len(slots) != MAX_EQUIPPED_PETS or any(not isinstance(pet, int) for pet in slots):
+        equipped = [pet_id(pet) for pet in slots or () if pet]
+        equipped = [pet for pet in equipped if pet][:MAX_EQUIPPED_PETS]
+        user['equipped_pets'] = equipped + [0] * (MAX_EQUIPPED_PETS - len(equipped))
+        changed = True
+
+    levels = user.get('pet_levels')
+    if not isinstance(levels, list):
+        # Старый формат: словарь по имени или id питомца
+        converted = empty_levels()
+        for pet, level in (levels or {}).items():
+            found = pet_id(pet)
+            if found and isinstance(level, int):
+                converted[found] = max(1, min(level, PETS_BY_ID[found]['max_level']))
+        user['pet_levels'] = converted
+        changed = True
+    elif len(levels) < INVENTORY_SIZE:
+        levels.extend([1] * (INVENTORY_SIZE - len(levels)))
+        changed = True
+    return changed
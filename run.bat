@@ -1,4 +1,2 @@
 @echo off
-start cmd /k "python app.py"
-timeout /t 2
-start cmd /k "python main.py"
\ No newline at end of file
+start cmd /k "python server.py"
\ No newline at end of file
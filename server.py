@@ -0,0 +1,117 @@
+"""Бот и веб-API в одном процессе и одном цикле событий над одной базой.
+
+Запуск: python server.py. Без BOT_TOKEN работает только веб-API.
+При BOT_MODE=webhook обновления бота приходят на тот же сервер (webhook.py),
+иначе бот опрашивает Telegram.
+"""
+import asyncio
+import gc
+import json
+import os
+import signal
+from aiohttp import web
+from api import ROUTES
+from config import BOT_TOKEN, WEB_HOST, WEB_PORT, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH
+from webhook import WebhookHandler
+from stream import StatStream
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def aiohttp_view(db, handler):
+    """Обработчик из api.py в виде обработчика aiohttp"""
+    async def view(request: web.Request) -> web.Response:
+        if request.method == 'GET':
+            data = dict(request.query)
+        else:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                return web.json_response({'error': 'Invalid request'}, status=400)
+
+        def call():
+            # Ответ сериализуется в том же потоке, пока другие запросы не меняют пользователя
+            result, status = handler(db, data)
+            return json.dumps(result), status
+
+        # Методы Database блокируют поток (блокировки, запись файлов) - выполняем их вне цикла событий
+        body, status = await asyncio.to_thread(call)
+        return web.Response(text=body, status=status, content_type='application/json')
+    return view
+
+
+async def index(request: web.Request):
+    """Главная страница"""
+    if not request.query.get('user_id'):
+        return web.Response(text='Требуется user_id')
+    return web.FileResponse(os.path.join(BASE_DIR, 'templates', 'index.html'))
+
+
+def create_app(db) -> web.Application:
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_static('/static', os.path.join(BASE_DIR, 'static'))
+    for method, path, handler in ROUTES:
+        app.router.add_route(method, path, aiohttp_view(db, handler))
+    # Изменения статистики вместо опроса /api/stats - только здесь, Flask держать соединения не умеет
+    app.router.add_get('/api/stream', StatStream(db).handle)
+    return app
+
+
+async def serve(db, bot=None, dp=None):
+    """Веб-сервер и, если передан бот, его вебхук или опрос Telegram до остановки процесса"""
+    app = create_app(db)
+    webhook = None
+    if dp is not None and BOT_MODE == 'webhook':
+        if WEBHOOK_URL:
+            webhook = WebhookHandler(bot, dp)
+            app.router.add_post(WEBHOOK_PATH, webhook.handle)
+        else:
+            print("WEBHOOK_URL is not set, falling back to polling")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+    print(f"Web API listening on {WEB_HOST}:{WEB_PORT}")
+    try:
+        if webhook is not None:
+            stop = asyncio.Event()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+            await webhook.start()
+            await stop.wait()
+        elif dp is not None:
+            # Пока установлен вебхук, Telegram не отдает обновления опросом
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if webhook is not None:
+            await webhook.stop()
+            await bot.session.close()
+
+
+def main():
+    if BOT_TOKEN:
+        # main.py создает бота, диспетчер с командами и базу - веб-API работает с той же базой
+        from main import bot, dp, db
+    else:
+        from database import open_database
+        print("BOT_TOKEN is not set, starting web API only")
+        bot, dp, db = None, None, open_database()
+    # Загруженные игроки живут до конца работы: сборщик мусора не обходит
+    # их при каждой полной сборке, которая держит GIL и останавливает цикл событий
+    gc.freeze()
+    try:
+        asyncio.run(serve(db, bot, dp))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
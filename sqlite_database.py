@@ -0,0 +1,667 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+import time
+from config import SAVE_MAX_DIRTY, EARNED_BUCKET_SECONDS
+from database import Database, DATA_DIR, DERIVED_FIELDS, LEADERBOARD_WINDOWS
+from pets import pet_id, empty_inventory, equipped_count, migrate_user
+from user_cache import LRUUsers
+
+# Поля, которые хранятся в отдельных колонках таблицы users
+COLUMNS = ('clicks', 'click_power', 'passive_income')
+
+# Питомцы игрока: id питомца из каталога и их количество
+CREATE_PETS = """
+CREATE TABLE IF NOT EXISTS pets (
+    user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+    pet INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, pet)
+) WITHOUT ROWID;
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    click_power INTEGER NOT NULL DEFAULT 1,
+    passive_income INTEGER NOT NULL DEFAULT 0,
+    equipped_pets TEXT NOT NULL DEFAULT '[]',
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+DROP INDEX IF EXISTS idx_users_clicks;
+CREATE INDEX IF NOT EXISTS idx_users_rank ON users (clicks DESC, user_id);
+""" + CREATE_PETS + """
+CREATE TABLE IF NOT EXISTS earned_clicks (
+    bucket INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    clicks INTEGER NOT NULL,
+    PRIMARY KEY (bucket, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS window_totals (
+    name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    earned INTEGER NOT NULL,
+    PRIMARY KEY (name, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_window_rank ON window_totals (name, earned DESC, user_id);
+CREATE TABLE IF NOT EXISTS window_starts (
+    name TEXT PRIMARY KEY,
+    start INTEGER NOT NULL
+);
+"""
+
+# Запросы с параметрами - sqlite3 кэширует подготовленные выражения по тексту
+SELECT_USER = 'SELECT clicks, click_power, passive_income, equipped_pets, extra FROM users WHERE user_id = ?'
+SELECT_PETS = 'SELECT pet, count FROM pets WHERE user_id = ? ORDER BY pet'
+USER_EXISTS = 'SELECT 1 FROM users WHERE user_id = ?'
+UPSERT_USER = (
+    'INSERT INTO users (user_id, clicks, click_power, passive_income, equipped_pets, extra) '
+    'VALUES (?, ?, ?, ?, ?, ?) '
+    'ON CONFLICT (user_id) DO UPDATE SET clicks = excluded.clicks, click_power = excluded.click_power, '
+    'passive_income = excluded.passive_income, equipped_pets = excluded.equipped_pets, extra = excluded.extra'
+)
+DELETE_USER = 'DELETE FROM users WHERE user_id = ?'
+DELETE_PETS = 'DELETE FROM pets WHERE user_id = ?'
+DELETE_PET = 'DELETE FROM pets WHERE user_id = ? AND pet = ?'
+UPSERT_PET = (
+    'INSERT INTO pets (user_id, pet, count) VALUES (?, ?, ?) '
+    'ON CONFLICT (user_id, pet) DO UPDATE SET count = excluded.count'
+)
+UPDATE_EQUIPPED = 'UPDATE users SET equipped_pets = ? WHERE user_id = ?'
+UPDATE_EXTRA = 'UPDATE users SET extra = ? WHERE user_id = ?'
+# Массовые изменения (bulk_update): одна инструкция на поле для всех строк
+BULK_COLUMN_SQL = {
+    'set': 'UPDATE users SET {field} = ?',
+    'add': 'UPDATE users SET {field} = {field} + ?',
+    'scale': 'UPDATE users SET {field} = CAST({field} * ? AS INTEGER)'
+}
+BULK_EQUIPPED = 'UPDATE users SET equipped_pets = ?'
+BULK_LEVELS = "UPDATE users SET extra = json_set(extra, '$.pet_levels', json(?))"
+BULK_DELETE_PETS = 'DELETE FROM pets'
+BULK_INSERT_PETS = 'INSERT INTO pets (user_id, pet, count) SELECT user_id, ?, ? FROM users'
+SELECT_LEADERBOARD = (
+    'SELECT user_id, clicks, click_power, equipped_pets FROM users '
+    'ORDER BY clicks DESC, user_id LIMIT ? OFFSET ?'
+)
+SELECT_CLICKS = 'SELECT clicks FROM users WHERE user_id = ?'
+COUNT_AHEAD = 'SELECT COUNT(*) FROM users WHERE clicks > ? OR (clicks = ? AND user_id < ?)'
+COUNT_USERS = 'SELECT COUNT(*) FROM users'
+UPSERT_EARNED = (
+    'INSERT INTO earned_clicks (bucket, user_id, clicks) VALUES (?, ?, ?) '
+    'ON CONFLICT (bucket, user_id) DO UPDATE SET clicks = clicks + excluded.clicks'
+)
+DELETE_OLD_EARNED = 'DELETE FROM earned_clicks WHERE bucket < ?'
+# Суммы игроков за окна (window_totals) обновляются при записи заработка, а
+# корзины, вышедшие из окна (window_starts - первая корзина окна), вычитаются
+UPSERT_WINDOW_TOTAL = (
+    'INSERT INTO window_totals (name, user_id, earned) VALUES (?, ?, ?) '
+    'ON CONFLICT (name, user_id) DO UPDATE SET earned = earned + excluded.earned'
+)
+SELECT_WINDOW_STARTS = 'SELECT name, start FROM window_starts'
+UPSERT_WINDOW_START = (
+    'INSERT INTO window_starts (name, start) VALUES (?, ?) '
+    'ON CONFLICT (name) DO UPDATE SET start = excluded.start'
+)
+EXPIRE_WINDOW_TOTALS = (
+    'UPDATE window_totals SET earned = earned - expired.clicks '
+    'FROM (SELECT user_id, SUM(clicks) AS clicks FROM earned_clicks WHERE bucket >= ? AND bucket < ? '
+    'GROUP BY user_id) AS expired '
+    'WHERE window_totals.name = ? AND window_totals.user_id = expired.user_id'
+)
+DELETE_EMPTY_WINDOW_TOTALS = 'DELETE FROM window_totals WHERE name = ? AND earned <= 0'
+DELETE_WINDOW_TOTALS = 'DELETE FROM window_totals WHERE name = ?'
+INSERT_WINDOW_TOTALS = (
+    'INSERT INTO window_totals (name, user_id, earned) '
+    'SELECT ?, user_id, SUM(clicks) FROM earned_clicks WHERE bucket >= ? GROUP BY user_id'
+)
+SELECT_WINDOW_LEADERBOARD = (
+    'SELECT user_id, earned FROM window_totals WHERE name = ? ORDER BY earned DESC, user_id LIMIT ? OFFSET ?'
+)
+COUNT_WINDOW_USERS = 'SELECT COUNT(*) FROM window_totals WHERE name = ?'
+SELECT_WINDOW_EARNED = 'SELECT earned FROM window_totals WHERE name = ? AND user_id = ?'
+COUNT_WINDOW_AHEAD = (
+    'SELECT COUNT(*) FROM window_totals WHERE name = ? AND (earned > ? OR (earned = ? AND user_id < ?))'
+)
+
+
+class SQLiteUsers:
+    """Словарь пользователей поверх таблиц SQLite.
+
+    Внутри транзакции один и тот же пользователь возвращается одним
+    объектом, поэтому изменения методов Database видны mark_dirty.
+    """
+
+    def __init__(self, db: 'SQLiteDatabase'):
+        self.db = db
+
+    def __getitem__(self, user_id):
+        user_id = str(user_id)
+        identity = self.db._identity()
+        if identity is not None and user_id in identity:
+            return identity[user_id]
+        user = self.db._read_user(user_id)
+        if user is None:
+            raise KeyError(user_id)
+        if identity is not None:
+            identity[user_id] = user
+        return user
+
+    def __setitem__(self, user_id, user):
+        user_id = str(user_id)
+        identity = self.db._identity()
+        if identity is not None:
+            identity[user_id] = user
+        self.db._write_user(user_id, user)
+
+    def __delitem__(self, user_id):
+        user_id = str(user_id)
+        identity = self.db._identity()
+        if identity is not None:
+            identity.pop(user_id, None)
+        self.db._connection().execute(DELETE_USER, (user_id,))
+
+    def __contains__(self, user_id):
+        return self.db._has_user(str(user_id))
+
+    def __iter__(self):
+        return iter(self.db._user_ids())
+
+    def __len__(self):
+        return self.db._count_users()
+
+    def get(self, user_id, default=None):
+        try:
+            return self[user_id]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return ((user_id, self[user_id]) for user_id in self)
+
+
+class SQLiteDatabase(Database):
+    """Хранилище в SQLite с тем же набором методов, что и Database.
+
+    Каждый пользователь - строка таблицы users, питомцы - строки таблицы
+    pets. Изменение затрагивает только строки одного пользователя, а режим
+    WAL позволяет нескольким процессам gunicorn работать с одним файлом.
+
+    При cache_size или cache_bytes в памяти держатся только недавно
+    активные пользователи (LRUUsers), а изменения записываются фоновым
+    потоком и при вытеснении. Такой режим рассчитан на один процесс.
+
+    Пустая база при import_legacy переносит data/database.json, после
+    чего файл переименовывается в database.json.imported. Части кластера
+    открываются с import_legacy=False.
+    """
+
+    # Каждое изменение - транзакция с записью на диск
+    in_memory = False
+
+    def __init__(self, filename: str = 'database.db', cache_size: int = 0, cache_bytes: int = 0,
+                 import_legacy: bool = True):
+        self.data_dir = DATA_DIR
+        self.filename = os.path.join(self.data_dir, filename)
+        self.import_legacy = import_legacy
+        self.save_mode = 'sqlite'
+        self._local = threading.local()
+        self.cached = bool(cache_size or cache_bytes)
+        self._cache_lock = threading.RLock()
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flusher = None
+        self._batch_state = threading.local()
+        self._derived_valid = set()
+        # В режиме кэша заработок копится в памяти до записи кэша
+        self._earned_pending = {}
+        self._expired_bucket = None
+
+        # Создаем директорию для данных, если её нет
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+        if self.cached:
+            self.save_mode = 'sqlite+cache'
+            self.users = LRUUsers(self, cache_size, cache_bytes)
+        else:
+            self.users = SQLiteUsers(self)
+        self.load()
+        if self.cached:
+            self._start_flusher()
+        print(f"Database initialized at {self.filename} (save mode: {self.save_mode})")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Отдельное соединение для каждого потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.identity = None
+        return conn
+
+    def _identity(self):
+        return getattr(self._local, 'identity', None)
+
+    @contextmanager
+    def _operation(self):
+        """Атомарное выполнение метода: транзакция SQLite или блокировка кэша"""
+        if self.cached:
+            with self._cache_lock:
+                yield
+        else:
+            with self.transaction():
+                yield
+
+    def _user_operation(self, user_id: str):
+        """Чтение и изменение пользователя выполняются атомарно, в том числе
+        между несколькими процессами: транзакция вместо блокировки в памяти"""
+        return self._operation()
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция с блокировкой записи; вложенные вызовы используют внешнюю"""
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        self._local.identity = {}
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+            self._local.identity = None
+
+    def load(self):
+        """Создание схемы и перенос данных из database.json при первом запуске"""
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        self._migrate_pets()
+        count = len(self.users)
+        json_file = os.path.join(self.data_dir, 'database.json')
+        if count == 0 and self.import_legacy and os.path.exists(json_file):
+            try:
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._import_users(data)
+                # Перенесенный файл не импортируется повторно другими базами
+                os.replace(json_file, f"{json_file}.imported")
+                print(f"Imported {len(data)} users from {json_file}")
+            except Exception as e:
+                print(f"Error importing {json_file}: {e}")
+        else:
+            print(f"Loaded data for {count} users")
+
+    def _migrate_pets(self):
+        """Перевод таблицы pets с имен питомцев на их id"""
+        with self.transaction() as conn:
+            columns = {name: kind for _, name, kind, *_ in conn.execute('PRAGMA table_info(pets)')}
+            if columns['pet'].upper() == 'INTEGER':
+                return
+            rows = [(user_id, pet_id(pet), count)
+                    for user_id, pet, count in conn.execute('SELECT user_id, pet, count FROM pets')]
+            conn.execute('ALTER TABLE pets RENAME TO pets_by_name')
+            conn.execute(CREATE_PETS)
+            conn.executemany(UPSERT_PET, [row for row in rows if row[1]])
+            conn.execute('DROP TABLE pets_by_name')
+        print(f"Migrated {len(rows)} pet rows to pet ids")
+
+    def _import_users(self, data: Dict[str, Any]):
+        with self.transaction():
+            for user_id, user in data.items():
+                self._write_user(str(user_id), user)
+
+    def _has_user(self, user_id: str) -> bool:
+        return self._connection().execute(USER_EXISTS, (user_id,)).fetchone() is not None
+
+    def _user_ids(self) -> list:
+        return [row[0] for row in self._connection().execute('SELECT user_id FROM users')]
+
+    def _count_users(self) -> int:
+        return self._connection().execute(COUNT_USERS).fetchone()[0]
+
+    def _write_users(self, users: Dict[str, Dict[str, Any]]):
+        """Запись пачки пользователей одной транзакцией"""
+        with self.transaction():
+            for user_id, user in users.items():
+                self._write_user(user_id, user)
+
+    def _read_user(self, user_id: str):
+        conn = self._connection()
+        row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+        if row is None:
+            return None
+        clicks, click_power, passive_income, equipped_pets, extra = row
+        user = json.loads(extra)
+        user['clicks'] = clicks
+        user['click_power'] = click_power
+        user['passive_income'] = passive_income
+        user['equipped_pets'] = json.loads(equipped_pets)
+        inventory = empty_inventory()
+        for pet, count in conn.execute(SELECT_PETS, (user_id,)):
+            if pet < len(inventory):
+                inventory[pet] = count
+        user['inventory'] = inventory
+        # Слоты экипировки в старом формате хранят имена питомцев
+        migrate_user(user)
+        return user
+
+    def _write_user(self, user_id: str, user: Dict[str, Any]):
+        """Полная запись пользователя с его питомцами"""
+        migrate_user(user)
+        conn = self._connection()
+        conn.execute(UPSERT_USER, (
+            user_id,
+            user.get('clicks', 0),
+            user.get('click_power', 1),
+            user.get('passive_income', 0),
+            json.dumps(user.get('equipped_pets', []), ensure_ascii=False),
+            json.dumps(self._extra(user), ensure_ascii=False),
+        ))
+        conn.execute(DELETE_PETS, (user_id,))
+        conn.executemany(UPSERT_PET, [(user_id, pet, count)
+                                      for pet, count in enumerate(user['inventory']) if count])
+
+    @staticmethod
+    def _extra(user: Dict[str, Any]) -> Dict[str, Any]:
+        """Поля пользователя, для которых нет отдельных колонок"""
+        skip = COLUMNS + DERIVED_FIELDS + ('inventory', 'equipped_pets')
+        return {key: value for key, value in user.items() if key not in skip}
+
+    def mark_dirty(self, user_id: str, op: str = 'update', fields=None, pets=()):
+        """Запись измененных полей пользователя в его строки таблиц"""
+        user_id = str(user_id)
+        self._invalidate_derived(user_id, fields, pets)
+        if self._defer_dirty(user_id, fields, pets):
+            return True
+        if self.cached:
+            # Запись выполнит фоновый поток или вытеснение из кэша
+            self.users.mark_dirty(user_id)
+            if len(self.users._dirty) >= SAVE_MAX_DIRTY:
+                self._flush_event.set()
+            return True
+        try:
+            with self.transaction() as conn:
+                user = self.users[user_id]
+                if fields is None:
+                    self._write_user(user_id, user)
+                    return True
+
+                columns = [field for field in fields if field in COLUMNS]
+                if columns:
+                    assignments = ', '.join(f"{column} = ?" for column in columns)
+                    conn.execute(f"UPDATE users SET {assignments} WHERE user_id = ?",
+                                 [user[column] for column in columns] + [user_id])
+                if 'equipped_pets' in fields:
+                    conn.execute(UPDATE_EQUIPPED, (json.dumps(user['equipped_pets'], ensure_ascii=False), user_id))
+                if any(field not in COLUMNS and field not in ('equipped_pets', 'inventory') for field in fields):
+                    conn.execute(UPDATE_EXTRA, (json.dumps(self._extra(user), ensure_ascii=False), user_id))
+                if 'inventory' in fields:
+                    pets = set(pets) | {pet for pet, count in enumerate(user['inventory']) if count}
+                    conn.execute(DELETE_PETS, (user_id,))
+                for pet in pets:
+                    count = user['inventory'][pet]
+                    if count:
+                        conn.execute(UPSERT_PET, (user_id, pet, count))
+                    else:
+                        conn.execute(DELETE_PET, (user_id, pet))
+            return True
+        except Exception as e:
+            print(f"Error saving user {user_id}: {e}")
+            return False
+
+    def save(self):
+        """Без кэша каждое изменение уже записано в своей транзакции"""
+        return self.flush()
+
+    def flush(self, force: bool = False) -> bool:
+        """Запись измененных пользователей из кэша"""
+        if not self.cached:
+            return True
+        try:
+            with self._cache_lock:
+                if self._earned_pending:
+                    with self.transaction() as conn:
+                        self._write_earned(conn, self._earned_pending)
+                    self._earned_pending = {}
+                return self.users.flush()
+        except Exception as e:
+            print(f"Error saving database: {e}")
+            return False
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.users.stats() if self.cached else {}
+
+    def close(self):
+        """Финальная запись кэша и закрытие соединения текущего потока"""
+        if self.cached:
+            self._stop_flusher()
+            self.flush()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _create_backup(self):
+        """Резервная копия через SQLite backup API"""
+        backup_file = f"{self.filename}.backup"
+        target = sqlite3.connect(backup_file)
+        try:
+            self._connection().backup(target)
+        finally:
+            target.close()
+        print(f"Created backup at {backup_file}")
+
+    def bulk_update(self, changes: Dict[str, Any], user_ids=None) -> int:
+        """Массовое изменение одной транзакцией: по инструкции UPDATE на поле
+        для всей таблицы или, если заданы user_ids, для их строк"""
+        with self._operation():
+            if self.cached:
+                self.users.flush()
+            with self.transaction() as conn:
+                targets = None
+                if user_ids is not None:
+                    targets = [str(user_id) for user_id in user_ids if self._has_user(str(user_id))]
+                if 'passive_income' in changes:
+                    settled = {user_id: self._read_user(user_id)
+                               for user_id in (self._user_ids() if targets is None else targets)}
+                    self._settle_passive(settled.items())
+                    self._write_users(settled)
+                for field, (op, value) in changes.items():
+                    if field in COLUMNS:
+                        statements = [(BULK_COLUMN_SQL[op].format(field=field), (value,))]
+                    elif field == 'equipped_pets':
+                        statements = [(BULK_EQUIPPED, (json.dumps(value),))]
+                    elif field == 'pet_levels':
+                        statements = [(BULK_LEVELS, (json.dumps(value),))]
+                    else:
+                        statements = [(BULK_DELETE_PETS, ())]
+                        statements += [(BULK_INSERT_PETS, (pet, count)) for pet, count in enumerate(value) if count]
+                    for sql, params in statements:
+                        if targets is None:
+                            conn.execute(sql, params)
+                        else:
+                            conn.executemany(f'{sql} WHERE user_id = ?', [params + (user_id,) for user_id in targets])
+                count = self._count_users() if targets is None else len(targets)
+            if self.cached:
+                self.users = LRUUsers(self, self.users.max_users, self.users.max_bytes)
+        self._derived_valid.clear()
+        return count
+
+    def bulk_rederive(self) -> int:
+        """Пересчет множителей пользователей в кэше; без кэша они
+        пересчитываются при каждом чтении"""
+        self._derived_valid.clear()
+        users = self.users.resident() if self.cached else []
+        for user_id, user in users:
+            self._derived(user_id, user)
+        return len(users)
+
+    def restore_from_backup(self, backup_name):
+        """Восстановить данные из JSON-бэкапа"""
+        try:
+            with open(backup_name, 'r') as f:
+                data = json.load(f)
+            with self._operation(), self.transaction() as conn:
+                conn.execute('DELETE FROM pets')
+                conn.execute('DELETE FROM users')
+                self._import_users(data)
+                if self.cached:
+                    self.users = LRUUsers(self, self.users.max_users, self.users.max_bytes)
+            return True
+        except:
+            return False
+
+    def get_leaderboard(self, limit=50, offset=0):
+        """Игроки по кликам с места offset + 1 по индексу idx_users_rank"""
+        self.flush()
+        players = []
+        rows = self._connection().execute(SELECT_LEADERBOARD, (limit, offset))
+        for user_id, clicks, click_power, equipped_pets in rows:
+            players.append({
+                'user_id': user_id,
+                'clicks': clicks,
+                'pets_count': equipped_count(json.loads(equipped_pets)),
+                'click_power': click_power
+            })
+        return players
+
+    @staticmethod
+    def _earned_bucket(now: float = None) -> int:
+        return int((time.time() if now is None else now) // EARNED_BUCKET_SECONDS)
+
+    def _write_earned(self, conn: sqlite3.Connection, earned: Dict[tuple, int]):
+        """Запись заработка по корзинам и в суммы окон, которые еще включают его корзину"""
+        self._advance_windows(conn)
+        conn.executemany(UPSERT_EARNED, [(bucket, user_id, clicks) for (bucket, user_id), clicks in earned.items()])
+        for window in LEADERBOARD_WINDOWS:
+            start = self._window_start(window)
+            conn.executemany(UPSERT_WINDOW_TOTAL, [(window, user_id, clicks)
+                                                   for (bucket, user_id), clicks in earned.items() if bucket >= start])
+
+    def _advance_windows(self, conn: sqlite3.Connection):
+        """Вычитание корзин, вышедших из окон, и удаление корзин старше самого длинного окна.
+
+        Начала окон хранятся в базе, поэтому несколько процессов не вычтут
+        одну корзину дважды. Без сохраненного начала суммы окна строятся
+        из корзин один раз (база от прежней версии).
+        """
+        bucket = self._earned_bucket()
+        if bucket == self._expired_bucket:
+            return
+        starts = dict(conn.execute(SELECT_WINDOW_STARTS).fetchall())
+        for window in LEADERBOARD_WINDOWS:
+            start = self._window_start(window)
+            old = starts.get(window)
+            if old is None:
+                conn.execute(DELETE_WINDOW_TOTALS, (window,))
+                conn.execute(INSERT_WINDOW_TOTALS, (window, start))
+            elif old < start:
+                conn.execute(EXPIRE_WINDOW_TOTALS, (old, start, window))
+                conn.execute(DELETE_EMPTY_WINDOW_TOTALS, (window,))
+            else:
+                continue
+            conn.execute(UPSERT_WINDOW_START, (window, start))
+        oldest = bucket - max(LEADERBOARD_WINDOWS.values()) // EARNED_BUCKET_SECONDS + 1
+        conn.execute(DELETE_OLD_EARNED, (oldest,))
+        self._expired_bucket = bucket
+
+    def _current_windows(self) -> sqlite3.Connection:
+        """Соединение для чтения сумм окон, сдвинутых к текущей корзине"""
+        self.flush()
+        if self._earned_bucket() != self._expired_bucket:
+            with self.transaction() as conn:
+                self._advance_windows(conn)
+        return self._connection()
+
+    def _record_earned(self, user_id: str, amount):
+        """Заработок пишется в таблицу earned_clicks в транзакции действия"""
+        if amount <= 0 or self._defer_earned(user_id, amount):
+            return
+        key = (self._earned_bucket(), str(user_id))
+        if self.cached:
+            self._earned_pending[key] = self._earned_pending.get(key, 0) + amount
+            return
+        with self.transaction() as conn:
+            self._write_earned(conn, {key: amount})
+
+    def _window_start(self, window: str) -> int:
+        return self._earned_bucket() - LEADERBOARD_WINDOWS[window] // EARNED_BUCKET_SECONDS + 1
+
+    def get_window_leaderboard(self, window: str, limit=50, offset=0):
+        """Игроки по кликам, заработанным за окно window, с места offset + 1"""
+        rows = self._current_windows().execute(SELECT_WINDOW_LEADERBOARD, (window, limit, offset))
+        return [{'user_id': user_id, 'earned': earned} for user_id, earned in rows]
+
+    def leaderboard_size(self, window: str = 'all') -> int:
+        """Число игроков в рейтинге: всех или заработавших за окно window"""
+        self.flush()
+        if window == 'all':
+            return self._count_users()
+        return self._current_windows().execute(COUNT_WINDOW_USERS, (window,)).fetchone()[0]
+
+    def get_window_rank(self, window: str, user_id: str):
+        """Место игрока в рейтинге за окно window или None"""
+        user_id = str(user_id)
+        conn = self._current_windows()
+        row = conn.execute(SELECT_WINDOW_EARNED, (window, user_id)).fetchone()
+        if row is None:
+            return None
+        earned = row[0]
+        rank = conn.execute(COUNT_WINDOW_AHEAD, (window, earned, earned, user_id)).fetchone()[0] + 1
+        total = conn.execute(COUNT_WINDOW_USERS, (window,)).fetchone()[0]
+        return {
+            'user_id': str(user_id),
+            'rank': rank,
+            'total': total,
+            'earned': earned,
+            'percentile': round(100 * (total - rank) / total, 2)
+        }
+
+    def count_ahead(self, window: str, score, user_id: str) -> int:
+        """Сколько игроков в рейтинге window стоят выше результата score"""
+        self.flush()
+        user_id = str(user_id)
+        if window == 'all':
+            return self._connection().execute(COUNT_AHEAD, (score, score, user_id)).fetchone()[0]
+        return self._current_windows().execute(COUNT_WINDOW_AHEAD, (window, score, score, user_id)).fetchone()[0]
+
+    def get_rank(self, user_id: str):
+        """Место игрока: число игроков выше него по индексу idx_users_rank"""
+        self.flush()
+        user_id = str(user_id)
+        with self.transaction() as conn:
+            row = conn.execute(SELECT_CLICKS, (user_id,)).fetchone()
+            if row is None:
+                return None
+            clicks = row[0]
+            rank = conn.execute(COUNT_AHEAD, (clicks, clicks, user_id)).fetchone()[0] + 1
+            total = conn.execute(COUNT_USERS).fetchone()[0]
+        return {
+            'user_id': user_id,
+            'rank': rank,
+            'total': total,
+            'clicks': clicks,
+            'percentile': round(100 * (total - rank) / total, 2)
+        }
@@ -3,6 +3,7 @@ const clickButton = document.getElementById('click-button');
 const clicksElement = document.getElementById('clicks');
 const clickPowerElement = document.getElementById('click-power');
 const passiveIncomeElement = document.getElementById('passive-income');
+const rankElement = document.getElementById('rank');
 const inventoryButton = document.getElementById('toggle-inventory');
 const inventoryContainer = document.getElementById('inventory');
 
@@ -25,6 +26,53 @@ async function sendAction(action, data = {}) {
     }
 }
 
+// Клики копятся и отправляются пачкой раз в CLICK_FLUSH_INTERVAL мс.
+// Номера пачек у каждой вкладки свои: сервер помнит их по clickSession
+const CLICK_FLUSH_INTERVAL = 300;
+const clickSession = window.crypto && crypto.randomUUID
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+let pendingClicks = 0;
+let clickSeq = 0;
+let unsentBatch = null;
+let clickRequestActive = false;
+
+async function flushClicks() {
+    if (clickRequestActive) return;
+    if (!unsentBatch) {
+        if (pendingClicks === 0) return;
+        unsentBatch = { count: pendingClicks, seq: ++clickSeq, session: clickSession };
+        pendingClicks = 0;
+    }
+
+    clickRequestActive = true;
+    const result = await sendAction('click', unsentBatch);
+    clickRequestActive = false;
+
+    // Без ответа повторяем ту же пачку с тем же seq - сервер не засчитает ее дважды
+    if (!result) return;
+    const known = (result.click_sessions || {})[clickSession] || 0;
+    if (result.error || result.accepted > 0 || known >= unsentBatch.seq) {
+        unsentBatch = null;
+    } else {
+        // Пачка не засчитана и не была засчитана раньше - отправим ее с новым номером
+        clickSeq = Math.max(clickSeq, known);
+        unsentBatch = { ...unsentBatch, seq: ++clickSeq };
+    }
+}
+
+setInterval(flushClicks, CLICK_FLUSH_INTERVAL);
+
+// При закрытии вкладки отправляем остаток
+window.addEventListener('pagehide', () => {
+    const batch = unsentBatch
+        || (pendingClicks > 0 ? { count: pendingClicks, seq: ++clickSeq, session: clickSession } : null);
+    if (batch) {
+        const body = new Blob([JSON.stringify({ user_id: userId, ...batch })], { type: 'application/json' });
+        navigator.sendBeacon('/api/click', body);
+    }
+});
+
 // Обработка клика
 clickButton.addEventListener('click', () => {
     const currentClicks = parseInt(clicksElement.textContent) || 0;
@@ -33,8 +81,8 @@ clickButton.addEventListener('click', () => {
     // Мгновенное обновление
     clicksElement.textContent = currentClicks + clickPower;
     
-    // Отправка на сервер
-    sendAction('click');
+    // Отправка на сервер пачкой
+    pendingClicks++;
 });
 
 // Улучшение силы клика
@@ -47,8 +95,7 @@ document.getElementById('upgrade-click').addEventListener('click', async () => {
         if (result && !result.error) {
             clicksElement.textContent = result.clicks;
             clickPowerElement.textContent = result.click_power;
-            document.getElementById('click-cost').textContent = 
-                Math.floor(50 * Math.pow(1.5, result.click_power - 1));
+            updateCosts(result);
         }
     }
 });
@@ -63,8 +110,7 @@ document.getElementById('upgrade-passive').addEventListener('click', async () =>
         if (result && !result.error) {
             clicksElement.textContent = result.clicks;
             passiveIncomeElement.textContent = result.passive_income;
-            document.getElementById('passive-cost').textContent = 
-                Math.floor(100 * Math.pow(1.5, result.passive_income));
+            updateCosts(result);
         }
     }
 });
@@ -104,7 +150,18 @@ async function deletePet(pet) {
     const result = await sendAction('delete_pet', { pet });
     if (result && !result.error) {
         updateInventory(result);
-        loadStats();
+        // Множители после удаления пришлет поток
+        if (!streamActive) loadStats();
+    }
+}
+
+async function upgradePet(pet) {
+    const result = await sendAction('upgrade_pet', { pet });
+    if (result && result.success) {
+        updateInventory(result.user_stats);
+        updateStats(result.user_stats);
+    } else if (result && result.error) {
+        alert(result.error);
     }
 }
 
@@ -124,57 +181,75 @@ async function equipAllSame(pet) {
     }
 }
 
-// Обновление инвентаря
-function updateInventory(data) {
+// Каталог питомцев по id, загружается один раз
+let petsById = null;
+
+async function loadPets() {
+    if (!petsById) {
+        const response = await fetch('/api/pets');
+        const pets = await response.json();
+        petsById = {};
+        Object.values(pets).forEach(petInfo => { petsById[petInfo.id] = petInfo; });
+    }
+    return petsById;
+}
+
+// Обновление инвентаря: inventory[id] - количество питомцев, equipped_pets - id в слотах (0 - пусто)
+async function updateInventory(data) {
     if (!data || !data.inventory) return;
     
+    const catalog = await loadPets();
     const petsElement = document.getElementById('equipped-pets');
     const equippedCount = document.getElementById('equipped-count');
     petsElement.innerHTML = '';
     
-    equippedCount.textContent = data.equipped_pets ? data.equipped_pets.length : 0;
+    const equipped = (data.equipped_pets || []).filter(id => id);
+    const freeSlots = (data.equipped_pets || []).length - equipped.length;
+    equippedCount.textContent = equipped.length;
     
-    // Создаем список уникальных питомцев
-    const uniquePets = [...new Set(data.inventory)];
-    
-    uniquePets.forEach(pet => {
+    data.inventory.forEach((totalCount, id) => {
+        const petInfo = catalog[id];
+        if (!totalCount || !petInfo) return;
+        const pet = petInfo.name;
+
         const petCard = document.createElement('div');
         petCard.className = 'pet-card';
         petCard.dataset.pet = pet;
         
-        const totalCount = data.pet_counts[pet];
-        const equippedCount = data.equipped_pets.filter(p => p === pet).length;
-        const canEquip = totalCount > equippedCount && data.equipped_pets.length < 2;
+        const equippedCount = equipped.filter(p => p === id).length;
+        const canEquip = totalCount > equippedCount && freeSlots > 0;
+        const level = (data.pet_levels || [])[id] || 1;
+        const canUpgrade = level < petInfo.max_level;
         
         if (equippedCount > 0) petCard.classList.add('equipped');
         
-        fetch('/api/pets')
-            .then(response => response.json())
-            .then(pets => {
-                const petInfo = pets[pet];
-                petCard.innerHTML = `
-                    <div class="pet-info">
-                        🐾 ${pet} ${totalCount > 1 ? `<span class="pet-count">x${totalCount}</span>` : ''}
-                        <div class="pet-stats">
-                            Множитель клика: x${petInfo.click_multiplier}
-                            Множитель дохода: x${petInfo.passive_multiplier}
-                            Редкость: ${petInfo.rarity}
-                            ${equippedCount > 0 ? `<br>Экипировано: ${equippedCount}` : ''}
-                        </div>
-                    </div>
-                    <div class="pet-buttons">
-                        ${equippedCount > 0 ? 
-                            `<button onclick="unequipPet('${pet}')">Снять</button>` :
-                            `<button onclick="equipPet('${pet}')" ${!canEquip ? 'disabled' : ''}>Экипировать</button>`
-                        }
-                        ${totalCount > 1 && equippedCount < totalCount ? 
-                            `<button onclick="equipAllSame('${pet}')" ${!canEquip ? 'disabled' : ''}>Экипировать всех</button>` : 
-                            ''
-                        }
-                        <button class="delete-button" onclick="deletePet('${pet}')">Удалить</button>
-                    </div>
-                `;
-            });
+        petCard.innerHTML = `
+            <div class="pet-info">
+                🐾 ${pet} ${totalCount > 1 ? `<span class="pet-count">x${totalCount}</span>` : ''}
+                <div class="pet-stats">
+                    Множитель клика: x${petInfo.click_multiplier}
+                    Множитель дохода: x${petInfo.passive_multiplier}
+                    Редкость: ${petInfo.rarity}
+                    <br>Уровень: ${level}/${petInfo.max_level}
+                    ${equippedCount > 0 ? `<br>Экипировано: ${equippedCount}` : ''}
+                </div>
+            </div>
+            <div class="pet-buttons">
+                ${equippedCount > 0 ? 
+                    `<button onclick="unequipPet('${pet}')">Снять</button>` :
+                    `<button onclick="equipPet('${pet}')" ${!canEquip ? 'disabled' : ''}>Экипировать</button>`
+                }
+                ${totalCount > 1 && equippedCount < totalCount ? 
+                    `<button onclick="equipAllSame('${pet}')" ${!canEquip ? 'disabled' : ''}>Экипировать всех</button>` : 
+                    ''
+                }
+                ${canUpgrade ?
+                    `<button onclick="upgradePet('${pet}')">Улучшить (${petInfo.upgrade_cost * level})</button>` :
+                    ''
+                }
+                <button class="delete-button" onclick="deletePet('${pet}')">Удалить</button>
+            </div>
+        `;
         
         petsElement.appendChild(petCard);
     });
@@ -185,13 +260,14 @@ inventoryButton.addEventListener('click', () => {
     inventoryContainer.classList.toggle('active');
 });
 
-// Пассивный доход
+// Без потока пассивный доход начисляет сервер при следующем действии,
+// здесь только обновляем отображение
 setInterval(() => {
-    const passiveIncome = parseInt(passiveIncomeElement.textContent) || 0;
+    if (streamActive) return;
+    const passiveIncome = parseFloat(passiveIncomeElement.textContent) || 0;
     if (passiveIncome > 0) {
         const currentClicks = parseInt(clicksElement.textContent) || 0;
-        clicksElement.textContent = currentClicks + passiveIncome;
-        sendAction('passive_income');
+        clicksElement.textContent = Math.floor(currentClicks + passiveIncome);
     }
 }, 1000);
 
@@ -213,6 +289,12 @@ function updateStats(data) {
     clickPowerElement.textContent = `${currentClickPower} (${baseClickPower} × ${multiplier.toFixed(1)})`;
 }
 
+// Стоимости считает сервер по точным таблицам (upgrades.CostTable)
+function updateCosts(data) {
+    if ('click_cost' in data) document.getElementById('click-cost').textContent = data.click_cost;
+    if ('passive_cost' in data) document.getElementById('passive-cost').textContent = data.passive_cost;
+}
+
 // Обновляем функцию загрузки статистики
 async function loadStats() {
     try {
@@ -221,16 +303,53 @@ async function loadStats() {
         if (data) {
             updateStats(data);
             updateInventory(data);
-            
-            document.getElementById('click-cost').textContent = 
-                Math.floor(50 * Math.pow(1.5, data.click_power - 1));
-            document.getElementById('passive-cost').textContent = 
-                Math.floor(100 * Math.pow(1.5, data.passive_income));
+            updateCosts(data);
         }
     } catch (error) {
         console.error('Error loading stats:', error);
     }
 }
 
+// Поток изменений статистики с сервера (server.py): сначала вся статистика,
+// потом только изменившиеся поля, не чаще раза в STREAM_INTERVAL
+const INVENTORY_FIELDS = ['inventory', 'equipped_pets', 'pet_levels'];
+let streamActive = false;
+let streamStats = {};
+
+function applyStreamUpdate(update) {
+    Object.assign(streamStats, update);
+
+    // Клики, которые еще не дошли до сервера, остаются на экране
+    const power = Math.round(streamStats.current_click_power) || 1;
+    const unsent = pendingClicks + (unsentBatch ? unsentBatch.count : 0);
+    updateStats({ ...streamStats, clicks: streamStats.clicks + unsent * power });
+    updateCosts(streamStats);
+
+    if (INVENTORY_FIELDS.some(field => field in update)) updateInventory(streamStats);
+    if ('rank' in update || 'total' in update) {
+        rankElement.textContent = streamStats.rank ? `${streamStats.rank} из ${streamStats.total}` : '-';
+    }
+}
+
+function startStream() {
+    const source = new EventSource(`/api/stream?user_id=${encodeURIComponent(userId)}`);
+    source.onmessage = (event) => {
+        streamActive = true;
+        applyStreamUpdate(JSON.parse(event.data));
+    };
+    source.onerror = () => {
+        // После обрыва EventSource переподключается сам. Закрытый поток -
+        // сервер его не поддерживает (app.py): загружаем статистику запросами
+        if (source.readyState === EventSource.CLOSED) {
+            streamActive = false;
+            loadStats();
+        }
+    };
+}
+
 // Загружаем статистику при старте
-loadStats(); 
\ No newline at end of file
+if (window.EventSource) {
+    startStream();
+} else {
+    loadStats();
+}
\ No newline at end of file
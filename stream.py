@@ -0,0 +1,156 @@
+"""Поток изменений статистики игрока в веб-приложение (Server-Sent Events).
+
+GET /api/stream?user_id=... держит соединение открытым и присылает события
+`data: {поля}`: сначала всю статистику, затем только изменившиеся поля -
+баланс с начисленным пассивным доходом, улучшения, питомцев после открытия
+бокса, место в рейтинге. Изменения проверяются раз в STREAM_INTERVAL секунд
+одним чтением на игрока без записи в базу, сколько бы вкладок он ни открыл;
+место в рейтинге - раз в STREAM_RANK_INTERVAL секунд. Если клиент не
+успевает читать, непрочитанные изменения объединяются в одно событие.
+
+Поток есть только в server.py (aiohttp). С Flask (app.py) клиент
+загружает статистику запросами, как раньше.
+"""
+import asyncio
+import json
+import time
+from typing import Dict
+from aiohttp import web
+from config import STREAM_INTERVAL, STREAM_KEEPALIVE, STREAM_RANK_INTERVAL, CLUSTER_ROUTER_URL
+
+# Поля статистики, которые получает клиент
+STREAM_FIELDS = ('clicks', 'click_power', 'current_click_power', 'passive_income', 'current_passive_income',
+                 'click_cost', 'passive_cost', 'inventory', 'equipped_pets', 'pet_levels')
+
+
+def read_stats(db, user_ids, ranks: Dict[str, tuple] = None) -> Dict[str, Dict[str, str]]:
+    """Поля статистики игроков в JSON: user_id -> {поле: JSON значения}.
+
+    Статистика читается без записи (peek_user_stats), сравнивать с
+    прошлой можно строками. Место в рейтинге пересчитывается не чаще
+    раза в STREAM_RANK_INTERVAL секунд: ranks хранит user_id ->
+    (время расчета, поля места) между вызовами.
+    """
+    result = {}
+    now = time.monotonic()
+    for user_id in user_ids:
+        user = db.peek_user_stats(user_id)
+        if user is None:
+            continue
+        stats = {field: json.dumps(user.get(field)) for field in STREAM_FIELDS}
+        # Воркер кластера знает место игрока только в своей части
+        if not CLUSTER_ROUTER_URL:
+            cached = ranks.get(user_id) if ranks is not None else None
+            if cached is None or now - cached[0] >= STREAM_RANK_INTERVAL:
+                rank = db.get_rank(user_id)
+                cached = (now, {'rank': json.dumps(rank['rank'] if rank else None),
+                                'total': json.dumps(rank['total'] if rank else None)})
+                if ranks is not None:
+                    ranks[user_id] = cached
+            stats.update(cached[1])
+        result[user_id] = stats
+    return result
+
+
+class StreamClient:
+    """Одно открытое соединение и изменения, еще не отправленные в него"""
+
+    def __init__(self):
+        self.pending = {}
+        self.changed = asyncio.Event()
+
+    def push(self, fields: Dict[str, str]):
+        self.pending.update(fields)
+        self.changed.set()
+
+    def take(self) -> str:
+        fields, self.pending = self.pending, {}
+        self.changed.clear()
+        return '{' + ','.join(f"{json.dumps(name)}:{value}" for name, value in fields.items()) + '}'
+
+
+class StatStream:
+    """Открытые потоки игроков и проверка их изменений"""
+
+    def __init__(self, db, interval: float = STREAM_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self._clients = {}
+        self._last = {}
+        self._ranks = {}
+        self._task = None
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        user_id = request.query.get('user_id')
+        if not user_id:
+            return web.json_response({'error': 'No user_id provided'}, status=400)
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            # Иначе nginx копит ответ в буфере
+            'X-Accel-Buffering': 'no'
+        })
+        await response.prepare(request)
+        client = StreamClient()
+        self._clients.setdefault(user_id, set()).add(client)
+        try:
+            await self._subscribe(user_id, client)
+            while True:
+                try:
+                    await asyncio.wait_for(client.changed.wait(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await response.write(b': keepalive\n\n')
+                    continue
+                await response.write(f"data: {client.take()}\n\n".encode('utf-8'))
+        except ConnectionResetError:
+            pass
+        finally:
+            self._unsubscribe(user_id, client)
+        return response
+
+    async def _subscribe(self, user_id: str, client: StreamClient):
+        """Вся статистика новому клиенту и запуск проверки изменений"""
+        stats = await asyncio.to_thread(read_stats, self.db, [user_id], self._ranks)
+        if user_id in self._clients and user_id in stats:
+            self._publish(user_id, stats[user_id], client)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _unsubscribe(self, user_id: str, client: StreamClient):
+        clients = self._clients.get(user_id)
+        if clients is None:
+            return
+        clients.discard(client)
+        if not clients:
+            del self._clients[user_id]
+            self._last.pop(user_id, None)
+            self._ranks.pop(user_id, None)
+
+    def _publish(self, user_id: str, stats: Dict[str, str], new_client: StreamClient = None):
+        """Изменившиеся поля - клиентам игрока, все поля - новому клиенту"""
+        last = self._last.get(user_id, {})
+        changed = {field: value for field, value in stats.items() if last.get(field) != value}
+        self._last[user_id] = stats
+        for client in self._clients[user_id]:
+            if client is new_client:
+                client.push(stats)
+            elif changed:
+                client.push(changed)
+
+    async def _run(self):
+        """Проверка изменений игроков с открытыми потоками, пока такие есть"""
+        try:
+            while self._clients:
+                await asyncio.sleep(self.interval)
+                try:
+                    # Все игроки одним вызовом: базу не нагружают тысячи отдельных задач
+                    stats = await asyncio.to_thread(read_stats, self.db, list(self._clients), self._ranks)
+                except Exception as e:
+                    print(f"Error reading stats for streams: {e}")
+                    continue
+                for user_id, user_stats in stats.items():
+                    if user_id in self._clients:
+                        self._publish(user_id, user_stats)
+        finally:
+            self._task = None
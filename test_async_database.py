@@ -0,0 +1,29 @@
+"""Проверки асинхронного доступа к базе.
+
+Запуск: python -m pytest -q
+"""
+import asyncio
+import pytest
+import database
+from async_database import AsyncDatabase
+from database import Database
+
+
+@pytest.mark.parametrize('save_mode', ['sync', 'journal'])
+def test_writes_persisted_by_background_thread(monkeypatch, save_mode):
+    monkeypatch.setattr(database, 'SAVE_MODE', save_mode)
+    adb = AsyncDatabase(Database())
+
+    async def clicks():
+        await asyncio.gather(*(adb.click(str(i % 10)) for i in range(200)))
+    asyncio.run(clicks())
+    persister = adb.db.persister
+    adb.close()
+    # Запросы на запись объединяются: записей меньше, чем изменений
+    assert persister.writes < persister.requests
+
+    restored = Database()
+    try:
+        assert sum(restored.get_user_stats(str(i))['clicks'] for i in range(10)) == 200
+    finally:
+        restored.close()
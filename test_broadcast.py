@@ -0,0 +1,79 @@
+"""Проверки рассылки с заменителем бота вместо Telegram.
+
+Запуск: python -m pytest -q
+"""
+import asyncio
+import pytest
+import broadcast
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from broadcast import Broadcast, Broadcaster, load_broadcasts
+
+
+class FakeBot:
+    """Бот, который запоминает отправленное; ответы задаются по chat_id"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str):
+        error = self.errors.get(chat_id)
+        if isinstance(error, list):
+            error = error.pop(0) if error else None
+        if error is not None:
+            raise error
+        self.sent.append(chat_id)
+
+
+@pytest.fixture(autouse=True)
+def broadcast_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(broadcast, 'BROADCAST_DIR', str(tmp_path))
+    return tmp_path
+
+
+def run(bot, senders: int = 2):
+    broadcaster = Broadcaster(bot, rate=1000, chat_rate=1000, senders=senders)
+    asyncio.run(asyncio.wait_for(broadcaster.run(forever=False), 10))
+    return broadcaster
+
+
+def test_retry_after_pauses_and_resends():
+    Broadcast.create('hi', ['1', '2'])
+    bot = FakeBot({1: [TelegramRetryAfter(None, 'Too Many Requests', 0)]})
+    broadcaster = run(bot, senders=1)
+    assert sorted(bot.sent) == [1, 2]
+    assert broadcaster.retry_after == 1
+
+
+def test_resume_sends_only_pending():
+    created = Broadcast.create('hi', ['1', '2', '3'])
+    created.record('1', 'sent')
+    created.close()
+    bot = FakeBot()
+    run(bot)
+    assert sorted(bot.sent) == [2, 3]
+    assert load_broadcasts()[-1].pending() == []
+
+
+def test_results_recorded_per_recipient():
+    Broadcast.create('hi', ['1', '2', '3'])
+    bot = FakeBot({3: TelegramForbiddenError(None, 'blocked')})
+    run(bot)
+    status = load_broadcasts()[-1].status()
+    assert (status['sent'], status['blocked'], status['failed'], status['pending']) == (2, 1, 0, 0)
+
+
+def test_non_numeric_ids_skipped():
+    created = Broadcast.create('hi', ['abc', 'def', '1', '-2', 3])
+    assert created.recipients == ['1', '-2', '3']
+    bot = FakeBot()
+    run(bot)
+    assert sorted(bot.sent) == [-2, 1, 3]
+
+
+def test_unexpected_error_recorded_as_failed():
+    Broadcast.create('hi', ['1', '2', '3', '4'])
+    bot = FakeBot({2: RuntimeError('boom'), 3: TelegramForbiddenError(None, 'blocked')})
+    run(bot)
+    status = load_broadcasts()[-1].status()
+    assert (status['sent'], status['blocked'], status['failed'], status['pending']) == (2, 1, 1, 0)
@@ -0,0 +1,119 @@
+"""Проверки кластера: раскладка игроков по частям и маршрутизатор.
+
+Запуск: python -m pytest -q
+"""
+import asyncio
+import json
+import pytest
+from aiohttp import web, ClientSession
+from aiohttp.test_utils import TestServer, TestClient
+import cluster
+import server
+from cluster import Router, partition_of, partition_url, prepare_partitions, partition_leaderboard
+from database import Database, open_database
+
+
+@pytest.fixture(autouse=True)
+def cluster_file(data_dir, monkeypatch):
+    monkeypatch.setattr(cluster, 'CLUSTER_FILE', str(data_dir / 'cluster.json'))
+
+
+def test_partition_url():
+    assert partition_url('json:///database.json', 1, 4) == 'json:///database.p1-of-4.json'
+    assert partition_url('sqlite:///game.db', 0, 2) == 'sqlite:///game.p0-of-2.db'
+
+
+def test_players_split_between_partitions():
+    db = Database()
+    for i in range(30):
+        db.click(str(i))
+    db.close()
+
+    prepare_partitions('json:///database.json', 3)
+    seen = []
+    for partition in range(3):
+        part = open_database(partition_url('json:///database.json', partition, 3))
+        try:
+            assert all(partition_of(user_id, 3) == partition for user_id in part.users)
+            seen.extend(part.users)
+        finally:
+            part.close()
+    assert sorted(seen) == sorted(str(i) for i in range(30))
+
+
+def test_legacy_json_imported_once_into_sqlite_partitions(data_dir):
+    users = {str(i): {'clicks': i, 'click_power': 1, 'passive_income': 0, 'inventory': [], 'equipped_pets': []}
+             for i in range(30)}
+    (data_dir / 'database.json').write_text(json.dumps(users), encoding='utf-8')
+
+    prepare_partitions('sqlite:///database.db', 2)
+    assert (data_dir / 'database.json.imported').exists()
+    seen = []
+    for partition in range(2):
+        part = open_database(partition_url('sqlite:///database.db', partition, 2))
+        try:
+            seen.extend(part.users)
+        finally:
+            part.close()
+    # Каждый игрок ровно в одной части
+    assert sorted(seen) == sorted(users)
+
+
+async def route(partitions: list, requests):
+    """Маршрутизатор над воркерами с базами partitions; requests(client) - запросы к нему"""
+    workers = []
+    for db in partitions:
+        app = server.create_app(db)
+        app.router.add_post('/internal/leaderboard', server.aiohttp_view(db, partition_leaderboard))
+        workers.append(TestServer(app))
+    router = Router(len(partitions))
+    router.urls = []
+    for worker in workers:
+        await worker.start_server()
+        router.urls.append(str(worker.make_url('')).rstrip('/'))
+    router.session = ClientSession()
+    app = web.Application()
+    app.router.add_get('/api/leaderboard', router.leaderboard)
+    app.router.add_route('*', '/api/{tail:.*}', router.forward)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        return await requests(client)
+    finally:
+        await client.close()
+        await router.session.close()
+        for worker in workers:
+            await worker.close()
+
+
+def test_router_merges_partition_leaderboards():
+    partitions = [Database(f"part{i}.json") for i in range(3)]
+    everyone = Database('everyone.json')
+    try:
+        for i in range(40):
+            user_id = str(i)
+            clicks = (i * 7) % 13
+            for db in (partitions[partition_of(user_id, 3)], everyone):
+                db.get_user_stats(user_id)
+                db.update_user(user_id, {'clicks': clicks})
+
+        async def requests(client):
+            click = await client.post('/api/click', data=json.dumps({'user_id': '5'}))
+            assert click.status == 200
+            page = await (await client.get('/api/leaderboard', params={'offset': 3, 'limit': 10})).json()
+            me = await (await client.get('/api/leaderboard', params={'limit': 1, 'user_id': '12'})).json()
+            return page, me
+
+        page, me = asyncio.run(route(partitions, requests))
+        # Клик пришел только в часть владельца игрока
+        everyone.click('5')
+        assert partitions[partition_of('5', 3)].users['5']['clicks'] == everyone.users['5']['clicks']
+        assert all('5' not in db.users for i, db in enumerate(partitions) if i != partition_of('5', 3))
+
+        expected = everyone.get_leaderboard(10, offset=3)
+        assert [player['user_id'] for player in page['players']] == [player['user_id'] for player in expected]
+        assert page['total'] == 40
+        assert me['me']['rank'] == everyone.get_rank('12')['rank']
+    finally:
+        for db in partitions + [everyone]:
+            db.close()
@@ -0,0 +1,61 @@
+"""Проверки колоночного хранилища.
+
+Запуск: python -m pytest -q
+"""
+import json
+from columnar_database import ColumnarStore, ColumnarDatabase
+from pets import empty_inventory, empty_slots, empty_levels
+
+
+def make_user(i: int) -> dict:
+    inventory = empty_inventory()
+    inventory[1] = i
+    return {'clicks': i * 10, 'click_power': 1 + i % 3, 'passive_income': i % 2, 'last_save': 1000.5 + i,
+            'inventory': inventory, 'equipped_pets': empty_slots(), 'pet_levels': empty_levels()}
+
+
+def test_store_round_trip(tmp_path):
+    users = {str(i): make_user(i) for i in range(50)}
+    # Значения, которые не помещаются в колонки, хранятся отдельно
+    users['3']['clicks'] = 10.5
+    users['4']['nickname'] = 'Игрок'
+    users['5']['achievements'] = {'unknown': True}
+    store = ColumnarStore()
+    store.import_users(users)
+    store.write(str(tmp_path / 'users.columns'))
+
+    restored = ColumnarStore()
+    restored.read(str(tmp_path / 'users.columns'))
+    assert len(restored) == 50
+    for user_id, user in users.items():
+        assert restored._read_user(user_id) == user
+    assert sorted(restored.clicks_items()) == sorted((user_id, user['clicks']) for user_id, user in users.items())
+
+
+def test_database_round_trip(data_dir):
+    db = ColumnarDatabase(hot_users=4)
+    for i in range(20):
+        db.click(str(i))
+    db.update_user('7', {'clicks': 500})
+    db.upgrade_click('7')
+    db.close()
+
+    restored = ColumnarDatabase(hot_users=4)
+    try:
+        assert len(restored.store) == 20
+        user = restored.get_user_stats('7')
+        assert (user['clicks'], user['click_power']) == (450, 2)
+        assert restored.get_leaderboard(1)[0]['user_id'] == '7'
+    finally:
+        restored.close()
+
+
+def test_json_database_imported(data_dir):
+    users = {str(i): make_user(i) for i in range(5)}
+    (data_dir / 'database.json').write_text(json.dumps(users), encoding='utf-8')
+    db = ColumnarDatabase('database.columns')
+    try:
+        assert db.get_user_stats('4')['clicks'] == 40
+        assert (data_dir / 'database.json.backup').exists()
+    finally:
+        db.close()
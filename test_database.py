@@ -0,0 +1,433 @@
+"""Проверки базы игроков.
+
+Запуск: python -m pytest -q
+Данные пишутся во временную директорию pytest, не в data.
+"""
+import json
+import random
+import sys
+import threading
+import time
+import pytest
+import database
+from database import Database
+from sqlite_database import SQLiteDatabase
+from columnar_database import ColumnarDatabase
+from upgrades import CLICK_UPGRADE_COSTS, PASSIVE_UPGRADE_COSTS
+from pets import PETS, empty_inventory, empty_slots
+
+BACKENDS = {
+    'json': lambda: Database('database.json'),
+    'sqlite': lambda: SQLiteDatabase('database.db'),
+    'columns': lambda: ColumnarDatabase('database.columns'),
+}
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def db(request):
+    db = BACKENDS[request.param]()
+    yield db
+    db.close()
+
+
+def give_clicks(db, user_id: str, clicks: int):
+    db.get_user_stats(user_id)
+    db.update_user(user_id, {'clicks': clicks})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменяемое время: clock.now сдвигается вручную"""
+    class Clock:
+        now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: Clock.now)
+    return Clock
+
+
+@pytest.fixture
+def journal_mode(monkeypatch):
+    monkeypatch.setattr(database, 'SAVE_MODE', 'journal')
+
+
+def test_journal_replayed_after_crash(data_dir, journal_mode):
+    db = Database()
+    db.get_user_stats('1')
+    db.update_user('1', {'clicks': 100})
+    db.upgrade_click('1')
+    db.click('1')
+    db.click('2')
+    expected = {user_id: dict(db.users[user_id]) for user_id in ('1', '2')}
+    # Снимок не переписан - после сбоя изменения есть только в журнале
+    assert (data_dir / 'database.journal').stat().st_size > 0
+
+    restored = Database()
+    try:
+        for user_id, user in expected.items():
+            stats = restored.get_user_stats(user_id)
+            for field in ('clicks', 'click_power', 'inventory'):
+                assert stats[field] == user[field]
+    finally:
+        restored.close()
+        db.close()
+
+
+def test_journal_compacted_into_snapshot(data_dir, journal_mode, monkeypatch):
+    monkeypatch.setattr(database, 'JOURNAL_COMPACT_RECORDS', 5)
+    db = Database()
+    for _ in range(5):
+        db.click('1')
+    db.flush()
+    assert (data_dir / 'database.journal').stat().st_size == 0
+    db.close()
+
+    restored = Database()
+    try:
+        assert restored.get_user_stats('1')['clicks'] == 5
+    finally:
+        restored.close()
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    monkeypatch.setattr(database, 'SNAPSHOT_SHARDS', 4)
+    return 4
+
+
+def test_shards_round_trip(data_dir, shards):
+    db = Database()
+    for i in range(40):
+        db.click(str(i))
+    db.save()
+    db.close()
+    for shard in range(shards):
+        part = json.loads((data_dir / f"database.{shard}-of-{shards}.json").read_text(encoding='utf-8'))
+        assert all(db._shard_of(user_id) == shard for user_id in part)
+
+    restored = Database()
+    try:
+        assert sorted(restored.users) == sorted(str(i) for i in range(40))
+    finally:
+        restored.close()
+
+
+def test_save_rewrites_only_touched_shards(data_dir, shards):
+    db = Database()
+    try:
+        for i in range(40):
+            db.click(str(i))
+        db.save()
+        files = [data_dir / f"database.{shard}-of-{shards}.json" for shard in range(shards)]
+        inodes = [file.stat().st_ino for file in files]
+        db.click('7')
+        db.save(['7'])
+        changed = [shard for shard, file in enumerate(files) if file.stat().st_ino != inodes[shard]]
+        assert changed == [db._shard_of('7')]
+    finally:
+        db.close()
+
+
+def test_single_file_migrated_to_shards(data_dir, shards):
+    users = {str(i): {'clicks': i, 'click_power': 1, 'passive_income': 0, 'inventory': [], 'equipped_pets': []}
+             for i in range(10)}
+    (data_dir / 'database.json').write_text(json.dumps(users), encoding='utf-8')
+    db = Database()
+    try:
+        assert db.get_user_stats('9')['clicks'] == 9
+        assert (data_dir / 'database.json.backup').exists()
+        assert not (data_dir / 'database.json').exists()
+    finally:
+        db.close()
+
+
+def test_passive_income_accrues_whole_clicks(clock):
+    db = Database()
+    try:
+        db.get_user_stats('1')
+        db.update_user('1', {'passive_income': 4, 'last_save': clock.now})
+        clock.now += 1.5
+        assert db.get_user_stats('1')['clicks'] == 6
+        clock.now += 0.375
+        assert db.get_user_stats('1')['clicks'] == 7
+        # Дробный остаток не теряется: за 2 секунды ровно 8 кликов
+        clock.now += 0.125
+        assert db.get_user_stats('1')['clicks'] == 8
+    finally:
+        db.close()
+
+
+def test_passive_income_restarts_from_future_last_save(clock):
+    db = Database()
+    try:
+        db.get_user_stats('1')
+        db.update_user('1', {'passive_income': 10, 'last_save': clock.now + 3600})
+        assert db.get_user_stats('1')['clicks'] == 0
+        assert db.users['1']['last_save'] == clock.now
+        clock.now += 2
+        assert db.get_user_stats('1')['clicks'] == 20
+    finally:
+        db.close()
+
+
+def test_peek_user_stats_writes_nothing(db, clock):
+    db.get_user_stats('1')
+    db.update_user('1', {'passive_income': 10, 'last_save': clock.now})
+    clock.now += 5
+
+    def written(*args, **kwargs):
+        raise AssertionError('peek_user_stats wrote the user')
+    db.mark_dirty = written
+    try:
+        assert db.peek_user_stats('1')['clicks'] == 50
+        assert db.peek_user_stats('missing') is None
+    finally:
+        del db.mark_dirty
+    assert 'missing' not in db.users
+    # Доход начисляется при следующем обращении
+    assert db.get_user_stats('1')['clicks'] == 50
+
+
+def test_legacy_iso_last_save_not_paid_out(clock):
+    db = Database()
+    try:
+        db.get_user_stats('1')
+        db.update_user('1', {'passive_income': 10, 'last_save': '2020-01-01T00:00:00'})
+        # Старый формат: доход уже начислялся ежесекундно, повторно не платим
+        assert db.get_user_stats('1')['clicks'] == 0
+        clock.now += 2
+        assert db.get_user_stats('1')['clicks'] == 20
+    finally:
+        db.close()
+
+
+def test_bulk_passive_change_pays_idle_time_at_old_rate(db, clock):
+    db.get_user_stats('1')
+    db.update_user('1', {'passive_income': 10, 'last_save': clock.now})
+    db.get_user_stats('2')
+    clock.now += 100
+    assert db.bulk_update({'passive_income': ('set', 20)}) == 2
+    assert db.get_user_stats('1')['clicks'] == 1000
+    # Игрок без дохода не получает его задним числом
+    assert db.get_user_stats('2')['clicks'] == 0
+    clock.now += 1
+    assert [db.get_user_stats(user_id)['clicks'] for user_id in ('1', '2')] == [1020, 20]
+
+
+def test_click_seq_kept_per_session(db, monkeypatch):
+    monkeypatch.setattr(database, 'CLICK_SESSIONS', 2)
+    assert db.click_batch('1', 1, seq=1, session='a')[1] == 1
+    # Вторая вкладка начинает со своего первого номера
+    assert db.click_batch('1', 1, seq=1, session='b')[1] == 1
+    # Повтор уже засчитанной пачки
+    assert db.click_batch('1', 1, seq=1, session='a')[1] == 0
+    assert db.click_batch('1', 1, seq=2, session='a')[1] == 1
+    db.click_batch('1', 1, seq=1, session='c')
+    assert list(db.get_user_stats('1')['click_sessions']) == ['a', 'c']
+    assert db.get_user_stats('1')['clicks'] == 4
+
+
+def test_stats_carry_exact_upgrade_costs(db):
+    give_clicks(db, '1', 0)
+    db.update_user('1', {'click_power': 101, 'passive_income': 90})
+    user = db.get_user_stats('1')
+    assert user['click_cost'] == 50 * 3 ** 100 // 2 ** 100
+    assert user['passive_cost'] == PASSIVE_UPGRADE_COSTS.cost(90)
+    assert db.buy_click_levels('1', 1) is None
+
+
+def test_batch_applies_actions(db):
+    give_clicks(db, '1', 1000)
+    result = db.apply_batch('1', [{'action': 'click', 'count': 1}, {'action': 'upgrade_click'},
+                                  {'action': 'box'}, {'action': 'box'}])
+    assert [entry['success'] for entry in result['results']] == [True, True, True, False]
+    assert result['results'][0]['accepted'] == 1
+    assert result['user_stats']['click_power'] == 2
+    assert sum(result['user_stats']['inventory']) == 1
+
+
+@pytest.mark.parametrize('actions', [
+    [{'action': 'upgrade_click'}, {'action': 'fly'}],
+    [{'action': 'upgrade_click'}, {'action': 'click', 'count': 'many'}],
+    [{'action': 'click', 'count': True}],
+    [{'action': 'upgrade_click'}, {'action': 'equip_pet'}],
+])
+def test_batch_rejects_invalid_actions(db, actions):
+    give_clicks(db, '1', 1000)
+    with pytest.raises(ValueError):
+        db.apply_batch('1', actions)
+    # Ни одно действие пачки не применено
+    user = db.get_user_stats('1')
+    assert (user['clicks'], user['click_power']) == (1000, 1)
+
+
+def test_batch_rolls_back_on_failure(db, monkeypatch):
+    give_clicks(db, '1', 10 ** 6)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(db, 'open_box', broken)
+    with pytest.raises(ValueError):
+        db.apply_batch('1', [{'action': 'click', 'count': 1}, {'action': 'upgrade_click'}, {'action': 'box'}])
+    user = db.get_user_stats('1')
+    assert (user['clicks'], user['click_power']) == (10 ** 6, 1)
+    # Клики отменённой пачки не попадают в окна
+    assert db.get_window_leaderboard('day') == []
+
+
+def test_batch_rollback_restores_leaderboard(db, monkeypatch):
+    give_clicks(db, '1', 10 ** 6)
+    give_clicks(db, '2', 900000)
+    # Рейтинг уже построен и обновляется по изменениям
+    assert db.get_rank('1')['rank'] == 1
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(db, 'open_box', broken)
+    with pytest.raises(ValueError):
+        db.apply_batch('1', [{'action': 'buy_click', 'n': 20}, {'action': 'box'}])
+    assert [(player['user_id'], player['clicks']) for player in db.get_leaderboard(2)] == \
+        [('1', 10 ** 6), ('2', 900000)]
+    assert db.get_rank('1')['rank'] == 1
+
+
+def test_batch_written_as_one_journal_record(data_dir, journal_mode):
+    db = Database()
+    try:
+        give_clicks(db, '1', 1000)
+        before = (data_dir / 'database.journal').read_text(encoding='utf-8').count('\n')
+        db.apply_batch('1', [{'action': 'upgrade_click'}, {'action': 'upgrade_click'}, {'action': 'box'}])
+        after = (data_dir / 'database.journal').read_text(encoding='utf-8').count('\n')
+        assert after - before == 1
+    finally:
+        db.close()
+
+
+def test_get_rank_follows_clicks(db):
+    for i in range(20):
+        give_clicks(db, str(i), i + 1)
+    assert [player['user_id'] for player in db.get_leaderboard(3)] == ['19', '18', '17']
+    assert [player['user_id'] for player in db.get_leaderboard(2, offset=18)] == ['1', '0']
+    rank = db.get_rank('5')
+    assert (rank['rank'], rank['total']) == (15, 20)
+    give_clicks(db, '5', 100)
+    assert db.get_rank('5')['rank'] == 1
+    assert db.get_rank('missing') is None
+
+
+def test_leaderboard_counts_equipped_pets(db):
+    give_clicks(db, '1', 10)
+    assert db.get_leaderboard(1)[0]['pets_count'] == 0
+    inventory, slots = empty_inventory(), empty_slots()
+    inventory[PETS['Котенок']['id']] = 1
+    slots[0] = PETS['Котенок']['id']
+    db.update_user('1', {'inventory': inventory, 'equipped_pets': slots})
+    assert db.get_leaderboard(1)[0]['pets_count'] == 1
+
+
+def test_window_leaderboards_expire(db, clock):
+    for i in range(3):
+        for _ in range(i + 1):
+            db.click(str(i))
+            clock.now += 1
+    assert db.get_window_leaderboard('day') == [{'user_id': '2', 'earned': 3}, {'user_id': '1', 'earned': 2},
+                                                {'user_id': '0', 'earned': 1}]
+    assert db.get_window_rank('day', '1')['rank'] == 2
+    clock.now += 2 * 24 * 3600
+    db.click('0')
+    assert db.get_window_leaderboard('day') == [{'user_id': '0', 'earned': 1}]
+    assert [player['user_id'] for player in db.get_window_leaderboard('week')] == ['2', '0', '1']
+    assert db.leaderboard_size('week') == 3
+
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_window_earnings_kept_after_restart(clock, backend):
+    db = BACKENDS[backend]()
+    db.click('1')
+    db.click('2')
+    db.close()
+    restored = BACKENDS[backend]()
+    try:
+        assert restored.get_window_leaderboard('week') == [{'user_id': '1', 'earned': 1},
+                                                           {'user_id': '2', 'earned': 1}]
+    finally:
+        restored.close()
+
+
+def test_save_rewrites_only_changed_buckets(data_dir, clock):
+    db = Database()
+    try:
+        db.click('1')
+        db.save()
+        files = list((data_dir / 'database.earned').iterdir())
+        assert len(files) == 1
+        inode = files[0].stat().st_ino
+        clock.now += database.EARNED_BUCKET_SECONDS
+        db.click('1')
+        db.save()
+        assert len(list((data_dir / 'database.earned').iterdir())) == 2
+        assert files[0].stat().st_ino == inode
+    finally:
+        db.close()
+
+
+def test_legacy_earned_file_split_into_buckets(data_dir, clock):
+    bucket = int(clock.now // database.EARNED_BUCKET_SECONDS)
+    legacy = {'bucket_seconds': database.EARNED_BUCKET_SECONDS, 'buckets': {str(bucket): {'1': 5}}}
+    (data_dir / 'database.earned.json').write_text(json.dumps(legacy), encoding='utf-8')
+    db = Database()
+    try:
+        assert db.get_window_leaderboard('day') == [{'user_id': '1', 'earned': 5}]
+        db.save()
+        assert not (data_dir / 'database.earned.json').exists()
+        assert (data_dir / 'database.earned' / f"{bucket}.json").exists()
+    finally:
+        db.close()
+
+
+def test_striped_locks_lose_no_updates(db):
+    """Потоки кликают и покупают улучшения у общих игроков: ни клики,
+    ни списания за покупки не теряются"""
+    clickers = [str(i) for i in range(8)]
+    buyers = [str(i) for i in range(8, 16)]
+    budget = 10 ** 9
+    for user_id in buyers:
+        give_clicks(db, user_id, budget)
+    accepted = {user_id: 0 for user_id in clickers}
+    bought = {user_id: 0 for user_id in buyers}
+    totals_lock = threading.Lock()
+    start = threading.Barrier(16)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        clicks = {user_id: 0 for user_id in clickers}
+        levels = {user_id: 0 for user_id in buyers}
+        start.wait()
+        for _ in range(300):
+            user_id = rng.choice(clickers)
+            clicks[user_id] += db.click_batch(user_id, 1)[1]
+            user_id = rng.choice(buyers)
+            if db.buy_click_levels(user_id, 1):
+                levels[user_id] += 1
+        with totals_lock:
+            for user_id, count in clicks.items():
+                accepted[user_id] += count
+            for user_id, count in levels.items():
+                bought[user_id] += count
+
+    interval = sys.getswitchinterval()
+    # Частое переключение потоков делает гонки заметными
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    for user_id in clickers:
+        assert db.get_user_stats(user_id)['clicks'] == accepted[user_id]
+    for user_id in buyers:
+        user = db.get_user_stats(user_id)
+        assert user['click_power'] == 1 + bought[user_id]
+        assert user['clicks'] == budget - CLICK_UPGRADE_COSTS.total(0, bought[user_id])
@@ -0,0 +1,75 @@
+"""Проверки ленивой загрузки снимка по индексу смещений.
+
+Запуск: python -m pytest -q
+"""
+import json
+from database import Database
+from lazy_users import LazyUsers, build_index, load_index, index_filename
+
+USERS = {
+    '1': {'clicks': 10, 'name': 'Игрок "один"', 'inventory': ['Кот', 'Пёс']},
+    '22': {'clicks': 0, 'nested': {'a': [1, {'b': '}'}]}},
+    'ключ': {'clicks': 3},
+}
+
+
+def test_index_points_at_each_user(tmp_path):
+    filename = tmp_path / 'users.json'
+    filename.write_text(json.dumps(USERS, ensure_ascii=False, indent=2), encoding='utf-8')
+    data = filename.read_bytes()
+    offsets = build_index(str(filename))
+    assert sorted(offsets) == sorted(USERS)
+    for user_id, (start, length, clicks) in offsets.items():
+        assert json.loads(data[start:start + length].decode('utf-8')) == USERS[user_id]
+        assert clicks == USERS[user_id]['clicks']
+
+
+def test_stale_index_rebuilt(tmp_path):
+    filename = tmp_path / 'users.json'
+    filename.write_text(json.dumps(USERS, ensure_ascii=False), encoding='utf-8')
+    load_index(str(filename))
+    assert (tmp_path / 'users.json.idx').exists()
+
+    changed = dict(USERS, **{'333': {'clicks': 1}})
+    filename.write_text(json.dumps(changed, ensure_ascii=False), encoding='utf-8')
+    assert sorted(load_index(str(filename))) == sorted(changed)
+    index = json.loads((tmp_path / index_filename('users.json')).read_text(encoding='utf-8'))
+    assert sorted(index['offsets']) == sorted(changed)
+
+
+def test_users_read_on_first_access(tmp_path):
+    filename = tmp_path / 'users.json'
+    filename.write_text(json.dumps(USERS, ensure_ascii=False), encoding='utf-8')
+    offsets = {user_id: (str(filename),) + entry for user_id, entry in build_index(str(filename)).items()}
+    users = LazyUsers(offsets)
+    assert len(users) == 3 and users.loaded_count == 0
+    assert users.clicks('1') == 10 and users.loaded_count == 0
+    assert users['ключ'] == USERS['ключ']
+    assert users.loaded_count == 1
+    users['4'] = {'clicks': 4}
+    assert sorted(users) == sorted(list(USERS) + ['4'])
+
+
+def test_database_loads_players_lazily():
+    db = Database()
+    for i in range(20):
+        db.click(str(i))
+    db.click('5')
+    db.close()
+
+    restored = Database()
+    try:
+        assert isinstance(restored.users, LazyUsers)
+        assert len(restored.users) == 20 and restored.users.loaded_count == 0
+        assert restored.get_user_stats('5')['clicks'] == 2
+        restored.click('6')
+        restored.save()
+    finally:
+        restored.close()
+
+    # Непрочитанные игроки скопированы в новый снимок без изменений
+    again = Database()
+    try:
+        assert [again.get_user_stats(str(i))['clicks'] for i in range(8)] == [1, 1, 1, 1, 1, 2, 2, 1]
+    finally:
+        again.close()
@@ -0,0 +1,90 @@
+"""Проверки рейтинга на skip list против сортировки всего списка.
+
+Запуск: python -m pytest -q
+"""
+import random
+import pytest
+from leaderboard import RankedSkipList, Leaderboard, WindowedLeaderboard
+
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(1)
+    skiplist = RankedSkipList.from_sorted(sorted(rng.sample(range(10000), 500)))
+    keys = sorted(skiplist.slice(0, 1000))
+    for _ in range(2000):
+        key = rng.randrange(10000)
+        if key in keys:
+            skiplist.remove(key)
+            keys.remove(key)
+        else:
+            skiplist.insert(key)
+            keys.append(key)
+            keys.sort()
+    assert len(skiplist) == len(keys)
+    assert skiplist.slice(0, len(keys)) == keys
+    assert skiplist.slice(100, 10) == keys[100:110]
+    for key in keys[::17]:
+        assert skiplist.index(key) == keys.index(key)
+    for key in range(-1, 10001, 97):
+        assert skiplist.bisect(key) == sum(1 for k in keys if k < key)
+    with pytest.raises(KeyError):
+        skiplist.remove(10001)
+
+
+def test_leaderboard_matches_brute_force():
+    rng = random.Random(2)
+    clicks = {str(i): rng.randrange(50) for i in range(300)}
+    leaderboard = Leaderboard(clicks.items())
+    for _ in range(1000):
+        user_id = str(rng.randrange(350))
+        clicks[user_id] = rng.randrange(50)
+        leaderboard.update(user_id, clicks[user_id])
+    leaderboard.remove('0')
+    del clicks['0']
+
+    # При равенстве кликов выше меньший user_id
+    expected = sorted(clicks.items(), key=lambda item: (-item[1], item[0]))
+    assert leaderboard.page(0, len(expected)) == expected
+    for position, (user_id, user_clicks) in enumerate(expected, 1):
+        assert leaderboard.rank(user_id) == position
+        assert leaderboard.count_ahead(user_clicks, user_id) == position - 1
+    assert leaderboard.rank('0') is None
+
+
+def window_totals(events, bucket_seconds: int, size: int, now: float) -> list:
+    """Заработок за последние size корзин, отсортированный как в рейтинге"""
+    start = int(now // bucket_seconds) - size + 1
+    totals = {}
+    for moment, user_id, amount in events:
+        if int(moment // bucket_seconds) >= start:
+            totals[user_id] = totals.get(user_id, 0) + amount
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+
+def test_windows_match_brute_force():
+    rng = random.Random(3)
+    windows = {'day': 24 * 3600, 'week': 7 * 24 * 3600}
+    now = 1_000_000.0
+    board = WindowedLeaderboard(windows, 3600, now=now)
+    events = []
+    for _ in range(3000):
+        now += rng.expovariate(1 / 600)
+        user_id = str(rng.randrange(40))
+        amount = rng.randrange(1, 100)
+        board.add(user_id, amount, now=now)
+        events.append((now, user_id, amount))
+        if rng.random() < 0.01:
+            for name, seconds in windows.items():
+                expected = window_totals(events, 3600, seconds // 3600, now)
+                assert board.page(name, 0, 100, now=now) == expected
+                assert board.count(name, now=now) == len(expected)
+                for position, (user_id, earned) in enumerate(expected, 1):
+                    assert board.rank(name, user_id, now=now) == (position, earned)
+                    assert board.count_ahead(name, earned, user_id, now=now) == position - 1
+
+    # Корзины переживают перезапуск
+    restored = WindowedLeaderboard(windows, 3600, board.take_changes()[0], now=now)
+    for name in windows:
+        assert restored.page(name, 0, 100, now=now) == board.page(name, 0, 100, now=now)
+    # Через неделю без заработка рейтинги пусты
+    assert board.page('week', 0, 100, now=now + 8 * 24 * 3600) == []
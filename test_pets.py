@@ -0,0 +1,50 @@
+"""Проверки перевода питомцев в счетчики по id.
+
+Запуск: python -m pytest -q
+"""
+import json
+from database import Database
+from pets import migrate_user, empty_levels, PETS, INVENTORY_SIZE
+from sqlite_database import SQLiteDatabase
+
+
+def legacy_user() -> dict:
+    return {'clicks': 10, 'click_power': 1, 'passive_income': 0,
+            'inventory': ['Котенок', 'Дракон', 'Котенок', 'Нет такого'],
+            'equipped_pets': ['Дракон', 'Котенок', 'Котенок'],
+            'pet_levels': {'Дракон': 3}}
+
+
+def test_legacy_pets_migrated():
+    user = legacy_user()
+    assert migrate_user(user)
+    counts = [0] * INVENTORY_SIZE
+    counts[PETS['Котенок']['id']] = 2
+    counts[PETS['Дракон']['id']] = 1
+    assert user['inventory'] == counts
+    assert user['equipped_pets'] == [PETS['Дракон']['id'], PETS['Котенок']['id']]
+    levels = empty_levels()
+    levels[PETS['Дракон']['id']] = 3
+    assert user['pet_levels'] == levels
+    # Повторный перевод ничего не меняет
+    assert not migrate_user(user)
+
+
+def test_short_inventory_extended():
+    user = {'inventory': [0, 1], 'equipped_pets': [1, 0]}
+    assert migrate_user(user)
+    assert user['inventory'] == [0, 1] + [0] * (INVENTORY_SIZE - 2)
+
+
+def test_legacy_database_loaded_with_counters(data_dir):
+    for backend in (SQLiteDatabase, Database):
+        # Обе базы переносят еще не переведенный database.json
+        (data_dir / 'database.json').write_text(json.dumps({'1': legacy_user()}, ensure_ascii=False),
+                                                encoding='utf-8')
+        db = backend()
+        try:
+            user = db.get_user_stats('1')
+            assert user['inventory'][PETS['Котенок']['id']] == 2
+            assert user['equipped_pets'] == [PETS['Дракон']['id'], PETS['Котенок']['id']]
+        finally:
+            db.close()
@@ -0,0 +1,43 @@
+"""Проверки хранилища SQLite.
+
+Запуск: python -m pytest -q
+"""
+import json
+from database import open_database
+from sqlite_database import SQLiteDatabase
+
+
+def test_changes_kept_after_reopen():
+    db = open_database('sqlite:///players.db')
+    assert isinstance(db, SQLiteDatabase)
+    db.get_user_stats('1')
+    db.update_user('1', {'clicks': 100})
+    db.upgrade_click('1')
+    db.click('1')
+    db.close()
+
+    db = SQLiteDatabase('players.db')
+    try:
+        user = db.get_user_stats('1')
+        assert (user['clicks'], user['click_power']) == (100 - 50 + 2, 2)
+    finally:
+        db.close()
+
+
+def test_json_database_imported_on_first_start(data_dir):
+    users = {str(i): {'clicks': i * 10, 'click_power': 1, 'passive_income': 0, 'inventory': [],
+                      'equipped_pets': []} for i in range(5)}
+    (data_dir / 'database.json').write_text(json.dumps(users), encoding='utf-8')
+    db = SQLiteDatabase('players.db')
+    try:
+        assert sorted(db.users) == sorted(users)
+        assert db.get_leaderboard(1)[0]['user_id'] == '4'
+    finally:
+        db.close()
+    assert (data_dir / 'database.json.imported').exists()
+    # Другая база не переносит уже перенесенных игроков еще раз
+    other = SQLiteDatabase('other.db')
+    try:
+        assert len(other.users) == 0
+    finally:
+        other.close()
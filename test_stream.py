@@ -0,0 +1,77 @@
+"""Проверки потока изменений статистики (Server-Sent Events).
+
+Запуск: python -m pytest -q
+"""
+import asyncio
+import json
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+from database import Database
+import stream
+from stream import StatStream, StreamClient, STREAM_FIELDS, read_stats
+
+
+def test_unread_changes_merged():
+    client = StreamClient()
+    client.push({'clicks': '1', 'click_power': '1'})
+    client.push({'clicks': '2'})
+    assert json.loads(client.take()) == {'clicks': 2, 'click_power': 1}
+    assert not client.changed.is_set()
+
+
+async def read_event(response) -> dict:
+    """Следующее событие data: потока, пропуская keepalive"""
+    while True:
+        line = await asyncio.wait_for(response.content.readline(), 5)
+        if line.startswith(b'data: '):
+            return json.loads(line[len(b'data: '):])
+
+
+def test_rank_recomputed_after_interval(monkeypatch):
+    db = Database()
+    try:
+        db.click('1')
+        calls = []
+        get_rank = db.get_rank
+        monkeypatch.setattr(db, 'get_rank', lambda user_id: calls.append(user_id) or get_rank(user_id))
+        ranks = {}
+        for _ in range(3):
+            assert read_stats(db, ['1', 'missing'], ranks)['1']['rank'] == '1'
+        assert calls == ['1']
+        monkeypatch.setattr(stream, 'STREAM_RANK_INTERVAL', 0)
+        read_stats(db, ['1'], ranks)
+        assert calls == ['1', '1']
+    finally:
+        db.close()
+
+
+def test_stream_sends_stats_then_changes():
+    db = Database()
+    db.get_user_stats('1')
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get('/api/stream', StatStream(db, interval=0.05).handle)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            response = await client.get('/api/stream', params={'user_id': '1'})
+            assert response.headers['Content-Type'] == 'text/event-stream'
+            first = await read_event(response)
+            await asyncio.to_thread(db.click, '1')
+            second = await read_event(response)
+            response.close()
+            missing = await client.get('/api/stream')
+            return first, second, missing.status
+        finally:
+            await client.close()
+
+    try:
+        first, second, missing = asyncio.run(scenario())
+    finally:
+        db.close()
+    assert set(STREAM_FIELDS) <= set(first)
+    assert (first['clicks'], first['rank']) == (0, 1)
+    # Во втором событии только изменившиеся поля
+    assert second['clicks'] == 1 and 'click_power' not in second
+    assert missing == 400
@@ -0,0 +1,62 @@
+import threading
+from bisect import bisect_right
+from fractions import Fraction
+
+
+class CostTable:
+    """Стоимость уровней улучшения base * growth ** k и их суммы.
+
+    Стоимости считаются точно (через Fraction) и округляются вниз, как
+    int(base * 1.5 ** k), но без ошибки float на высоких уровнях. Таблица
+    префиксных сумм растет по мере надобности, поэтому стоимость любого
+    числа уровней - разность двух сумм, а максимум доступных уровней
+    ищется бинарным поиском.
+    """
+
+    def __init__(self, base: int, growth: Fraction = Fraction(3, 2), levels: int = 64):
+        self.base = base
+        self.growth = Fraction(growth)
+        self._lock = threading.Lock()
+        self._costs = []
+        # _sums[k] - стоимость уровней с 0 по k - 1
+        self._sums = [0]
+        self._extend(levels)
+
+    def _extend(self, levels: int):
+        with self._lock:
+            k = len(self._costs)
+            factor = self.growth ** k
+            while len(self._costs) < levels:
+                cost = int(self.base * factor)
+                self._costs.append(cost)
+                self._sums.append(self._sums[-1] + cost)
+                factor *= self.growth
+
+    def cost(self, level: int) -> int:
+        """Стоимость покупки уровня level (с нуля)"""
+        if level >= len(self._costs):
+            self._extend(max(level + 1, 2 * len(self._costs)))
+        return self._costs[level]
+
+    def total(self, level: int, n: int) -> int:
+        """Стоимость n уровней подряд начиная с level"""
+        if level + n >= len(self._sums):
+            self._extend(max(level + n, 2 * len(self._costs)))
+        return self._sums[level + n] - self._sums[level]
+
+    def affordable(self, level: int, budget: int) -> int:
+        """Сколько уровней подряд начиная с level можно купить на budget"""
+        if budget < self.cost(level):
+            return 0
+        target = self._sums[level] + budget
+        # Достраиваем таблицу, пока она не перекроет бюджет
+        while self._sums[-1] <= target:
+            self._extend(2 * len(self._costs))
+        return bisect_right(self._sums, target) - 1 - level
+
+
+# Сила клика: уровень click_power стоит 50 * 1.5 ** (click_power - 1)
+CLICK_UPGRADE_COSTS = CostTable(50)
+
+# Пассивный доход: уровень passive_income стоит 100 * 1.5 ** passive_income
+PASSIVE_UPGRADE_COSTS = CostTable(100)
@@ -0,0 +1,182 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any
+
+
+class LRUUsers:
+    """Словарь пользователей, в памяти которого живут только недавно активные.
+
+    Остальные пользователи читаются из `store` по запросу. Вытесняемые
+    измененные записи сначала записываются обратно в `store`. Хранилище
+    должно предоставлять методы _read_user, _write_users, _has_user,
+    _user_ids и _count_users.
+    """
+
+    def __init__(self, store, max_users: int = 0, max_bytes: int = 0):
+        self.store = store
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._dirty = set()
+        self._pins = {}
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    @staticmethod
+    def _size(user: Dict[str, Any]) -> int:
+        """Примерный размер записи - длина ее JSON"""
+        return len(json.dumps(user, ensure_ascii=False))
+
+    def __getitem__(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            user = self._entries.get(user_id)
+            if user is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return user
+
+            self.misses += 1
+            user = self.store._read_user(user_id)
+            if user is None:
+                raise KeyError(user_id)
+            self._insert(user_id, user)
+            return user
+
+    def __setitem__(self, user_id, user):
+        user_id = str(user_id)
+        with self._lock:
+            self._insert(user_id, user)
+            self._dirty.add(user_id)
+
+    def __contains__(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            return user_id in self._entries or self.store._has_user(user_id)
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.store._user_ids())
+
+    def __len__(self):
+        self.flush()
+        return self.store._count_users()
+
+    def get(self, user_id, default=None):
+        try:
+            return self[user_id]
+        except KeyError:
+            return default
+
+    def setdefault(self, user_id, default=None):
+        with self._lock:
+            if user_id not in self:
+                self[user_id] = default
+            return self[user_id]
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return ((user_id, self[user_id]) for user_id in self)
+
+    def resident(self) -> list:
+        """Пользователи в памяти: пары (user_id, пользователь)"""
+        with self._lock:
+            return list(self._entries.items())
+
+    def pin(self, user_id):
+        """Пока пользователя изменяют, он не вытесняется и не записывается в хранилище"""
+        user_id = str(user_id)
+        with self._lock:
+            self._pins[user_id] = self._pins.get(user_id, 0) + 1
+
+    def unpin(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            if self._pins[user_id] == 1:
+                del self._pins[user_id]
+            else:
+                self._pins[user_id] -= 1
+
+    def mark_dirty(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._entries:
+                self._dirty.add(user_id)
+
+    def flush(self) -> bool:
+        """Запись всех измененных пользователей в хранилище.
+
+        Закрепленные (pin) пользователи остаются измененными до следующей
+        записи: в хранилище остается их прежняя целая версия.
+        """
+        with self._lock:
+            if not self._dirty:
+                return True
+            users = {user_id: self._entries[user_id] for user_id in self._dirty if user_id not in self._pins}
+            self.store._write_users(users)
+            for user_id, user in users.items():
+                self._resize(user_id, user)
+            self.writebacks += len(users)
+            self._dirty.difference_update(users)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self._entries),
+                'bytes': self.bytes,
+                'max_users': self.max_users,
+                'max_bytes': self.max_bytes,
+                'dirty': len(self._dirty),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'writebacks': self.writebacks
+            }
+
+    def _insert(self, user_id: str, user: Dict[str, Any]):
+        if user_id in self._entries:
+            self.bytes -= self._sizes[user_id]
+        self._entries[user_id] = user
+        self._entries.move_to_end(user_id)
+        self._sizes[user_id] = self._size(user)
+        self.bytes += self._sizes[user_id]
+        self._evict()
+
+    def _resize(self, user_id: str, user: Dict[str, Any]):
+        if user_id in self._sizes:
+            size = self._size(user)
+            self.bytes += size - self._sizes[user_id]
+            self._sizes[user_id] = size
+
+    def _over_budget(self) -> bool:
+        if self.max_users and len(self._entries) > self.max_users:
+            return True
+        return bool(self.max_bytes) and self.bytes > self.max_bytes
+
+    def _evict(self):
+        """Вытеснение самых давних записей; последнюю и закрепленные записи не трогаем"""
+        skipped = 0
+        while len(self._entries) - skipped > 1 and self._over_budget():
+            user_id = next(iter(self._entries))
+            if user_id in self._pins:
+                self._entries.move_to_end(user_id)
+                skipped += 1
+                continue
+            user = self._entries.pop(user_id)
+            self.bytes -= self._sizes.pop(user_id)
+            if user_id in self._dirty:
+                self.store._write_users({user_id: user})
+                self._dirty.discard(user_id)
+                self.writebacks += 1
+            self.evictions += 1
@@ -1,11 +1,11 @@
 from flask import Flask, render_template, request, jsonify
-from database import Database
+from database import open_database
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 app = Flask(__name__)
-db = Database()
+db = open_database()
 
 @app.route('/')
 def index():
@@ -19,9 +19,17 @@ def click():
     if not user_id:
         return jsonify({'error': 'No user_id provided'}), 400
     
+    count = data.get('count', 1)
+    seq = data.get('seq')
+    session = data.get('session')
+    if not isinstance(count, int) or count < 1 or (seq is not None and not isinstance(seq, int)):
+        return jsonify({'error': 'Invalid count or seq'}), 400
+    if session is not None and (not isinstance(session, str) or len(session) > 64):
+        return jsonify({'error': 'Invalid session'}), 400
+
     # Обновляем клики пользователя
-    user_stats = db.click(user_id)
-    return jsonify(user_stats)
+    user_stats, accepted = db.click_batch(user_id, count, seq, session)
+    return jsonify({**user_stats, 'accepted': accepted})
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
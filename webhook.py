@@ -0,0 +1,93 @@
+"""Получение обновлений бота через вебхук (BOT_MODE=webhook).
+
+Telegram присылает каждое обновление POST-запросом на WEBHOOK_URL +
+WEBHOOK_PATH. Запрос подтверждается сразу, а обновление обрабатывается
+отдельной задачей через тот же Dispatcher, что и при опросе. Одновременно
+обрабатывается не больше WEBHOOK_MAX_CONCURRENCY обновлений: когда все
+места заняты, ответ на запрос задерживается до освобождения места, и
+Telegram, который держит не больше WEBHOOK_MAX_CONNECTIONS запросов
+сразу, перестает присылать новые обновления (обратное давление).
+"""
+import asyncio
+import hashlib
+import hmac
+from typing import Dict, Any
+from aiohttp import web
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY, WEBHOOK_MAX_CONNECTIONS
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def webhook_secret(token: str) -> str:
+    """WEBHOOK_SECRET или секрет из хэша токена - одинаковый между перезапусками"""
+    return WEBHOOK_SECRET or hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class WebhookHandler:
+    """Прием обновлений с ограничением числа одновременно обрабатываемых"""
+
+    def __init__(self, bot, dp, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY):
+        self.bot = bot
+        self.dp = dp
+        self.secret = webhook_secret(bot.token)
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self._tasks = set()
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.delayed = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            update = None
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+
+        self.received += 1
+        if self._slots.locked():
+            self.delayed += 1
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Dict[str, Any]):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Error processing update {update.get('update_id')}: {e}")
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'in_progress': len(self._tasks),
+            # Сколько раз ответ Telegram задерживался из-за заполненных мест
+            'delayed': self.delayed
+        }
+
+    async def start(self):
+        """Регистрация вебхука в Telegram; вызывается, когда сервер уже принимает запросы"""
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        url = f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}"
+        await self.bot.set_webhook(url, secret_token=self.secret, max_connections=WEBHOOK_MAX_CONNECTIONS,
+                                   allowed_updates=self.dp.resolve_used_update_types())
+        print(f"Webhook set to {url}")
+
+    async def stop(self):
+        """Завершение уже принятых обновлений. Вебхук не удаляется: пока
+        сервер перезапускается, Telegram копит обновления и повторяет их"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+        print(f"Webhook stopped: {self.stats()}")